@@ -0,0 +1,69 @@
+"""
+Import time of the command line interface and of every stage of `lfcoords`.
+
+Every measurement runs in a fresh interpreter, so modules already imported by
+a previous measurement do not hide their cost. Usage:
+
+    python benchmarks/import_time.py [--repeat 5]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+# modules imported by every stage of `lfcoords`, in order of execution
+STAGES = {
+    'cli': 'lisfloodpreprocessing.lfcoords',
+    'config': 'lisfloodpreprocessing.config',
+    'memory': 'lisfloodpreprocessing.memory',
+    'inputs': 'lisfloodpreprocessing.inputs',
+    'fine': 'lisfloodpreprocessing.finer_grid',
+    'coarse': 'lisfloodpreprocessing.coarser_grid',
+}
+
+SNIPPET = 'import time; t = time.perf_counter(); import {0}; print(time.perf_counter() - t)'
+
+
+def import_time(module: str, repeat: int = 5) -> float:
+    """Median time (seconds) to import a module in a fresh interpreter."""
+
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, '-c', SNIPPET.format(module)],
+            capture_output=True, text=True, check=True
+        )
+        times.append(float(out.stdout.strip()))
+    return statistics.median(times)
+
+
+def help_time(repeat: int = 5) -> float:
+    """Median wall time (seconds) of `lfcoords --help`, including the interpreter start."""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-m', 'lisfloodpreprocessing.lfcoords', '--help'],
+            capture_output=True, check=True
+        )
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of measurements per module')
+    args = parser.parse_args()
+
+    print(f'{"stage":<8} {"module":<40} {"import (s)":>10}')
+    for stage, module in STAGES.items():
+        print(f'{stage:<8} {module:<40} {import_time(module, args.repeat):>10.3f}')
+    print(f'\nlfcoords --help: {help_time(args.repeat):.3f} s')
+
+
+if __name__ == '__main__':
+    main()
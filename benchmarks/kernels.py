@@ -0,0 +1,254 @@
+"""
+Micro-benchmarks of the kernels of `lfcoords` on synthetic grids (see
+`synthetic.py`), so they run anywhere without external data.
+
+Every kernel is timed for every combination of grid size and number of
+points, and its result is reduced to a digest. Both are compared with the
+baselines stored in `baselines.json`: a kernel fails if its result changed or
+if it is slower than the baseline times a tolerance. Usage:
+
+    python benchmarks/kernels.py                      # compare with the baselines
+    python benchmarks/kernels.py --update             # store new baselines
+    python benchmarks/kernels.py --sizes 2400 --points 1000 --only search_pixels
+
+Timings depend on the machine, so the baselines should be updated on the
+machine where the benchmark is run before comparing branches.
+"""
+
+import os
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+import argparse
+import hashlib
+import json
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import yaml
+
+from lisfloodpreprocessing.config import Config
+from lisfloodpreprocessing.coarser_grid import locate_coarse
+from lisfloodpreprocessing.finer_grid import locate_fine
+from lisfloodpreprocessing.utils import SEARCH_SCHEDULE, catchment_polygon, find_conflicts, find_pixel, search_pixels
+
+sys.path.insert(0, str(Path(__file__).parent))
+from synthetic import synthetic_grids, synthetic_points
+
+
+BASELINES = Path(__file__).parent / 'baselines.json'
+
+
+def make_config(folder: Path, workers: int = 1) -> Config:
+    """Configuration of `lfcoords` with default settings and an output folder in "folder"."""
+
+    config = {
+        'input': {key: f'{key}.tif' for key in ['points', 'ldd_fine', 'upstream_fine', 'ldd_coarse', 'upstream_coarse']},
+        'output_folder': str(folder / 'outputs'),
+        'conditions': {},
+        'processing': {'workers': workers},
+    }
+    config_file = folder / 'config.yml'
+    with open(config_file, 'w') as f:
+        yaml.dump(config, f)
+
+    return Config(config_file)
+
+
+def digest(result: Any) -> str:
+    """
+    Short hash of the result of a kernel. Values are rounded, so the digest does
+    not change with floating point noise; polygons are represented by their
+    area and bounds.
+    """
+
+    if isinstance(result, gpd.GeoDataFrame):
+        geometry = result.geometry
+        result = pd.DataFrame(result.drop(columns=result.geometry.name))
+        if len(geometry) > 0:
+            result['area'] = geometry.area.values
+            result[['x_min', 'y_min', 'x_max', 'y_max']] = geometry.bounds.values
+    if isinstance(result, pd.DataFrame):
+        text = result.round(6).to_csv()
+    else:
+        text = repr([np.round(np.asarray(x, dtype=float), 6).tolist() for x in result])
+
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+# -------------------------------------------------------------------------------
+# kernels: each one prepares its inputs and returns the function to be timed
+# -------------------------------------------------------------------------------
+
+def bench_find_pixel(ctx: Dict) -> Callable:
+    """`find_pixel` point by point with the first search range."""
+
+    upstream, points = ctx['grids']['upstream_fine'], ctx['points']
+    range_xy, penalty, factor, _ = SEARCH_SCHEDULE[0]
+
+    def run():
+        return list(zip(*[
+            find_pixel(upstream, lat, lon, area, range_xy=range_xy, penalty=penalty, factor=factor)
+            for lat, lon, area in points[['lat', 'lon', 'area']].itertuples(index=False)
+        ]))
+
+    return run
+
+
+def bench_search_pixels(ctx: Dict) -> Callable:
+    """`search_pixels` for all the points at once with the complete schedule."""
+
+    upstream, points = ctx['grids']['upstream_fine'], ctx['points']
+
+    def run():
+        return search_pixels(upstream, *points[['lat', 'lon', 'area']].values.T)
+
+    return run
+
+
+def bench_catchment_polygon(ctx: Dict) -> Callable:
+    """`catchment_polygon` of the catchments of the points, delineated beforehand."""
+
+    fdir = ctx['grids']['fdir_fine']
+    points = ctx['points']
+    masks = [fdir.basins(xy=(lon, lat)) > 0 for lat, lon in points[['lat', 'lon']].itertuples(index=False)]
+
+    def run():
+        return pd.concat([catchment_polygon(mask, fdir.transform, crs='EPSG:4326') for mask in masks])
+
+    return run
+
+
+def bench_find_conflicts(ctx: Dict) -> Callable:
+    """`find_conflicts` of the points located in the fine grid, with a tolerance of 1 pixel."""
+
+    cfg = ctx['cfg']
+    points_fine = located_fine(ctx)[0]
+
+    def run():
+        return find_conflicts(points_fine.copy(), resolution=cfg.fine_resolution, pct_error=cfg.pct_error, tolerance=1)
+
+    return run
+
+
+def bench_locate_fine(ctx: Dict) -> Callable:
+    """Per-point loop of `coordinates_fine`: pixel search, delineation and vectorization."""
+
+    cfg, grids, points = ctx['cfg'], ctx['grids'], ctx['points']
+
+    def run():
+        points_fine, polygons_fine = locate_fine(cfg, points, grids['ldd_fine'], grids['upstream_fine'])
+        return points_fine
+
+    return run
+
+
+def bench_locate_coarse(ctx: Dict) -> Callable:
+    """Per-point loop of `coordinates_coarse`: candidate search and shape matching."""
+
+    cfg, grids = ctx['cfg'], ctx['grids']
+    points_fine, polygons_fine = located_fine(ctx)
+
+    def run():
+        points_coarse, polygons_coarse = locate_coarse(cfg, points_fine, polygons_fine, grids['ldd_coarse'], grids['upstream_coarse'])
+        return points_coarse
+
+    return run
+
+
+BENCHMARKS = {
+    'find_pixel': bench_find_pixel,
+    'search_pixels': bench_search_pixels,
+    'catchment_polygon': bench_catchment_polygon,
+    'find_conflicts': bench_find_conflicts,
+    'locate_fine': bench_locate_fine,
+    'locate_coarse': bench_locate_coarse,
+}
+
+
+def located_fine(ctx: Dict) -> Tuple[pd.DataFrame, gpd.GeoDataFrame]:
+    """Points and catchments in the fine grid, computed once per context."""
+
+    if 'fine' not in ctx:
+        cfg, grids, points = ctx['cfg'], ctx['grids'], ctx['points']
+        points_fine, polygons_fine = locate_fine(cfg, points, grids['ldd_fine'], grids['upstream_fine'])
+        points_fine['abs_error'] = abs(points_fine[f'area_{cfg.fine_resolution}'] - points_fine['area'])
+        points_fine['pct_error'] = points_fine.abs_error / points_fine['area'] * 100
+        ctx['fine'] = points_fine, polygons_fine
+
+    return ctx['fine']
+
+
+def timeit(func: Callable, repeat: int) -> Tuple[float, Any]:
+    """Minimum wall time (seconds) of several runs of a function, and its result."""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[600, 1200], help='Rows and columns of the fine grid')
+    parser.add_argument('-p', '--points', type=int, nargs='+', default=[10, 100], help='Number of points')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs of every kernel; the fastest is reported')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Processes used by locate_fine and locate_coarse')
+    parser.add_argument('-o', '--only', nargs='+', choices=list(BENCHMARKS), help='Kernels to be run')
+    parser.add_argument('-t', '--tolerance', type=float, default=1.5, help='Slowdown relative to the baseline that is reported as a regression')
+    parser.add_argument('-b', '--baselines', type=Path, default=BASELINES, help='JSON file of baselines')
+    parser.add_argument('-u', '--update', action='store_true', help='Store the results as the new baselines')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    baselines = json.loads(args.baselines.read_text()) if args.baselines.is_file() else {}
+    names = args.only or list(BENCHMARKS)
+
+    failed = False
+    print(f'{"kernel":<18} {"size":>6} {"points":>6} {"time (s)":>10} {"baseline":>10} {"ratio":>6}  status')
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            grids = synthetic_grids(size)
+            for n_points in args.points:
+                cfg = make_config(Path(tmp), workers=args.workers)
+                cfg.update_config(grids['ldd_fine'], grids['ldd_coarse'])
+                ctx = {'cfg': cfg, 'grids': grids, 'points': synthetic_points(grids, n_points)}
+                for name in names:
+                    seconds, result = timeit(BENCHMARKS[name](ctx), args.repeat)
+                    key = f'{name}|{size}|{n_points}'
+                    current = {'seconds': round(seconds, 6), 'digest': digest(result)}
+
+                    baseline = baselines.get(key)
+                    if args.update or baseline is None:
+                        status, ratio = ('updated' if args.update else 'new'), np.nan
+                        baselines[key] = current
+                    else:
+                        ratio = seconds / baseline['seconds']
+                        if current['digest'] != baseline['digest']:
+                            status = 'RESULT CHANGED'
+                        elif ratio > args.tolerance:
+                            status = 'SLOWER'
+                        else:
+                            status = 'ok'
+                        failed |= status != 'ok'
+                    reference = baseline['seconds'] if baseline else np.nan
+                    print(f'{name:<18} {size:>6} {n_points:>6} {seconds:>10.4f} {reference:>10.4f} {ratio:>6.2f}  {status}')
+
+    if args.update or not args.baselines.is_file():
+        args.baselines.write_text(json.dumps(baselines, indent=1, sort_keys=True))
+        print(f'Baselines stored in {args.baselines}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
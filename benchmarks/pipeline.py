@@ -0,0 +1,299 @@
+"""
+End-to-end benchmark of `lfcoords` on the datasets shipped with the repository:
+
+* 'efas': the Danube stations of EFAS (1 arcminute), in `calib_stations/EFAS`;
+* 'glofas': the Danube stations of GloFAS (3 arcminutes), in `calib_stations/GloFAS`;
+* 'tests': the test case in `tests/data/lfcoords`.
+
+Every dataset is run with the command `lfcoords --profile` in a separate
+process, with the outputs in a temporary folder. The duration, CPU time and
+peak memory of every stage are reported, and the outputs are compared with the
+reference results committed in the repository. Usage:
+
+    python benchmarks/pipeline.py                          # all the datasets
+    python benchmarks/pipeline.py -d tests -o workers=4 -o delineation=crop
+    python benchmarks/pipeline.py --report benchmark.json
+
+The MERIT grids of the Danube (`calib_stations/MERIT`) are not stored in the
+repository; the datasets whose inputs are missing are skipped. The upstream
+area of the fine grid of the test case is derived from its LDD if missing; the
+upstream area of the points in that grid is then compared with a tolerance.
+The exit code is 1 if a run fails or if its outputs differ from the reference.
+"""
+
+import os
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import yaml
+
+
+ROOT = Path(__file__).parent.parent
+
+# configuration file, folder to which its input paths are relative, reference
+# results: a folder of shapefiles, or a CSV file compared with one output layer,
+# and absolute tolerance of the output columns affected by every derived input
+DATASETS = {
+    'efas': {
+        'config': ROOT / 'calib_stations' / 'EFAS' / 'config_efas.yml',
+        'root': ROOT / 'calib_stations' / 'EFAS',
+        'reference': ROOT / 'calib_stations' / 'EFAS' / 'results',
+    },
+    'glofas': {
+        'config': ROOT / 'calib_stations' / 'GloFAS' / 'config_glofas.yml',
+        'root': ROOT / 'calib_stations' / 'GloFAS',
+        'reference': ROOT / 'calib_stations' / 'GloFAS' / 'results',
+    },
+    'tests': {
+        'config': ROOT / 'tests' / 'data' / 'lfcoords' / 'config.yml',
+        'root': ROOT / 'tests',
+        'reference': {'points_1min': ROOT / 'tests' / 'data' / 'lfcoords' / 'expected.csv'},
+        'tolerance': {'upstream_fine': {'area_3sec': 1}},
+    },
+}
+
+# minimum intersection over union of two catchment polygons considered equal
+MIN_IOU = 1 - 1e-6
+
+
+def derive_upstream(ldd_path: Path, output: Path):
+    """Derives the upstream area (km2) of a D8 map of flow directions."""
+
+    import pyflwdir
+    import rioxarray
+
+    ldd = rioxarray.open_rasterio(ldd_path).squeeze(dim='band')
+    fdir = pyflwdir.from_array(ldd.data, ftype='d8', transform=ldd.rio.transform(), check_ftype=False, latlon=True)
+    upstream = ldd.copy(data=fdir.upstream_area('km2').astype('float32'))
+    upstream.rio.write_nodata(-9999, inplace=True)
+    upstream.rio.to_raster(output)
+
+
+def prepare_config(dataset: Dict, folder: Path, options: Dict) -> Tuple[Optional[Path], List[str]]:
+    """
+    Writes the configuration of a dataset with absolute input paths, the outputs
+    in "folder" as shapefiles, profiling enabled and the processing "options".
+
+    Returns:
+    --------
+    Tuple[pathlib.Path or None, List[str]]
+        Path of the configuration file, or None if some inputs are missing, and
+        the inputs that were derived from the others.
+    """
+
+    with open(dataset['config'], 'r') as f:
+        config = yaml.safe_load(f)
+
+    missing = []
+    for key, value in config['input'].items():
+        path = (dataset['root'] / value).resolve()
+        config['input'][key] = str(path)
+        if not path.exists():
+            missing.append(key)
+
+    if missing == ['upstream_fine']:
+        print(f'Deriving the upstream area of the fine grid from {config["input"]["ldd_fine"]}')
+        derive_upstream(Path(config['input']['ldd_fine']), folder / 'upstream_fine.tif')
+        config['input']['upstream_fine'] = str(folder / 'upstream_fine.tif')
+    elif missing:
+        print(f'Skipped: missing inputs {", ".join(missing)}')
+        return None, []
+
+    config['output_folder'] = str(folder / 'outputs')
+    config['output_format'] = 'shp'
+    config.setdefault('processing', {}).update(options)
+    config['processing']['profile'] = True
+
+    config_file = folder / 'config.yml'
+    with open(config_file, 'w') as f:
+        yaml.dump(config, f)
+
+    return config_file, missing
+
+
+def run(config_file: Path) -> Dict:
+    """
+    Runs `lfcoords` in a new process.
+
+    Returns:
+    --------
+    Dict
+        'success', 'wall' (seconds), 'peak_memory' (MB) of the largest process of
+        the run, and 'stages' as recorded by the profiler.
+    """
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-m', 'lisfloodpreprocessing.lfcoords', '-c', str(config_file)],
+        cwd=config_file.parent,
+        capture_output=True,
+        text=True
+    )
+    wall = time.perf_counter() - start
+    # the maximum over all the children so far; the runs are sorted by size
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak = (maxrss if sys.platform == 'darwin' else maxrss * 1024) / 2**20 if maxrss > children else np.nan
+
+    if process.returncode != 0:
+        print(process.stderr[-2000:])
+
+    profile = config_file.parent / 'outputs' / 'profile_stages.csv'
+    stages = pd.read_csv(profile) if profile.is_file() else pd.DataFrame()
+    if not stages.empty:
+        # the profiler resets the peak memory of the process, hiding it from `getrusage`
+        peak = np.nanmax([peak, stages.peak_memory.max()])
+
+    return {'success': process.returncode == 0, 'wall': wall, 'peak_memory': peak, 'stages': stages}
+
+
+def read_layer(path: Path) -> pd.DataFrame:
+    """Reads an output layer (shapefile) or a table of reference points (CSV) indexed by ID."""
+
+    if path.suffix == '.csv':
+        return pd.read_csv(path, index_col='ID')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        layer = gpd.read_file(path)
+    return layer.set_index('ID')
+
+
+def compare_layer(test: pd.DataFrame, reference: pd.DataFrame, tolerance: Optional[Dict[str, float]] = None) -> List[str]:
+    """
+    Compares an output layer with its reference. Points are compared by their
+    attributes, with the absolute "tolerance" of some columns; polygons by
+    their intersection over union.
+
+    Returns:
+    --------
+    List[str]
+        Description of the differences, empty if there are none.
+    """
+
+    diffs = []
+    missing = reference.index.difference(test.index)
+    extra = test.index.difference(reference.index)
+    if len(missing):
+        diffs.append(f'{len(missing)} IDs missing: {missing.tolist()[:10]}')
+    if len(extra):
+        diffs.append(f'{len(extra)} IDs not in the reference: {extra.tolist()[:10]}')
+    ids = reference.index.intersection(test.index)
+
+    columns = [col for col in reference.columns if col in test.columns and col != 'geometry']
+    if columns:
+        a = test.loc[ids, columns].astype(float).round(6)
+        b = reference.loc[ids, columns].astype(float).round(6)
+        atol = pd.Series({col: (tolerance or {}).get(col, 0) for col in columns})
+        changed = ~(((a - b).abs() <= atol) | (a.isnull() & b.isnull()))
+        for col in columns:
+            if changed[col].any():
+                diffs.append(f'"{col}" differs in {changed[col].sum()} IDs: {changed.index[changed[col]].tolist()[:10]}')
+
+    if isinstance(reference, gpd.GeoDataFrame) and (reference.geom_type == 'Polygon').any():
+        a, b = test.geometry.loc[ids].values, reference.geometry.loc[ids].values
+        with warnings.catch_warnings():
+            # the ratio of areas does not depend on the projection
+            warnings.simplefilter('ignore')
+            union = a.union(b).area
+            iou = pd.Series(np.where(union > 0, a.intersection(b).area / np.where(union > 0, union, 1), 1), index=ids)
+        if (iou < MIN_IOU).any():
+            diffs.append(f'{(iou < MIN_IOU).sum()} catchments differ (minimum IoU {iou.min():.4f}): {iou.index[iou < MIN_IOU].tolist()[:10]}')
+
+    return diffs
+
+
+def compare(outputs: Path, reference, tolerance: Optional[Dict[str, float]] = None) -> Dict[str, List[str]]:
+    """Compares every reference layer with the output layer of the same name."""
+
+    if isinstance(reference, dict):
+        layers = reference
+    else:
+        layers = {path.stem: path for path in sorted(Path(reference).glob('*.shp'))}
+
+    diffs = {}
+    for name, path in layers.items():
+        output = outputs / f'{name}.shp'
+        if not output.is_file():
+            diffs[name] = ['layer not produced']
+            continue
+        diffs[name] = compare_layer(read_layer(output), read_layer(path), tolerance)
+
+    return diffs
+
+
+def report(name: str, result: Dict, diffs: Dict[str, List[str]], detail: bool = False):
+    """Prints the stages and the differences of a dataset."""
+
+    stages = result['stages']
+    if not stages.empty:
+        if not detail:
+            stages = stages[~stages.stage.str.contains('/')]
+        print(stages.to_string(index=False))
+    print(f'Total: {result["wall"]:.2f} s, peak memory {result["peak_memory"]:.0f} MB{"" if result["success"] else " (FAILED)"}')
+    for layer, layer_diffs in diffs.items():
+        print(f'{layer:<20} ' + ('identical' if not layer_diffs else '; '.join(layer_diffs)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-d', '--datasets', nargs='+', choices=list(DATASETS), default=list(DATASETS), help='Datasets to be run')
+    parser.add_argument('-o', '--option', action='append', default=[], metavar='KEY=VALUE', help='Option of the section "processing" of the configuration')
+    parser.add_argument('--detail', action='store_true', help='Report the nested stages, e.g., "fine/search"')
+    parser.add_argument('--report', type=Path, default=None, help='JSON file where the results are saved')
+    parser.add_argument('--keep', type=Path, default=None, help='Folder where the outputs of the runs are kept')
+    args = parser.parse_args()
+
+    options = {}
+    for option in args.option:
+        key, _, value = option.partition('=')
+        options[key] = yaml.safe_load(value)
+
+    failed = False
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        base = args.keep or Path(tmp)
+        for name in args.datasets:
+            print(f'\n=== {name} ===')
+            folder = base / name
+            folder.mkdir(parents=True, exist_ok=True)
+            config_file, derived = prepare_config(DATASETS[name], folder, options)
+            if config_file is None:
+                results[name] = {'skipped': True}
+                continue
+            tolerance = {}
+            for key in derived:
+                tolerance.update(DATASETS[name].get('tolerance', {}).get(key, {}))
+            result = run(config_file)
+            diffs = compare(folder / 'outputs', DATASETS[name]['reference'], tolerance) if result['success'] else {}
+            report(name, result, diffs, detail=args.detail)
+            failed |= not result['success'] or any(diffs.values())
+            results[name] = {
+                'success': result['success'],
+                'wall': round(result['wall'], 3),
+                'peak_memory': None if np.isnan(result['peak_memory']) else round(result['peak_memory'], 1),
+                'stages': result['stages'].to_dict(orient='records'),
+                'differences': diffs,
+            }
+
+    if args.report is not None:
+        args.report.write_text(json.dumps({'options': options, 'datasets': results}, indent=1))
+        print(f'\nReport saved in {args.report}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
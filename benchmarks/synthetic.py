@@ -0,0 +1,140 @@
+"""
+Synthetic inputs of `lfcoords` that do not need any external data: a fine grid
+of D8 flow directions and upstream area derived from a random terrain, the
+coarse grid obtained by upscaling its river network, and a table of points
+whose coordinates and catchment area are perturbed versions of pixels of the
+fine grid.
+"""
+
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import rioxarray
+import pyflwdir
+from affine import Affine
+from scipy import ndimage
+
+
+# resolution of the fine grid (3 arcseconds, as MERIT)
+CELLSIZE = 1 / 1200
+# fine pixels per coarse pixel (1 arcminute, as EFAS)
+UPSCALE_FACTOR = 20
+# upper left corner of the grids
+ORIGIN = (10., 46.)
+
+
+def to_dataarray(data: np.ndarray, transform: Affine, nodata=None) -> xr.DataArray:
+    """Georeferenced map in geographic coordinates."""
+
+    rows, cols = data.shape
+    x = transform.c + (np.arange(cols) + .5) * transform.a
+    y = transform.f + (np.arange(rows) + .5) * transform.e
+    da = xr.DataArray(data, coords={'y': y, 'x': x}, dims=('y', 'x'))
+    da = da.rio.write_crs('EPSG:4326')
+    if nodata is not None:
+        da = da.rio.write_nodata(nodata)
+
+    return da
+
+
+def synthetic_grids(size: int = 1000, factor: int = UPSCALE_FACTOR, seed: int = 0) -> Dict:
+    """
+    Creates the fine and coarse grids of a synthetic catchment.
+
+    The terrain is a smoothed random field on a plane that drains to the south,
+    so the river network has realistic tree structures and catchments of many
+    sizes. The coarse network is upscaled from the fine one, as LISFLOOD maps
+    are derived from high-resolution hydrography.
+
+    Parameters:
+    -----------
+    size: int, optional
+        Rows and columns of the fine grid. It is rounded to a multiple of "factor".
+    factor: int, optional
+        Fine pixels per coarse pixel.
+    seed: int, optional
+        Seed of the random terrain.
+
+    Returns:
+    --------
+    Dict
+        'ldd_fine' (D8), 'upstream_fine' (km2), 'ldd_coarse' (PCRaster LDD),
+        'upstream_coarse' (m2), and the river networks 'fdir_fine' and 'fdir_coarse'.
+    """
+
+    size = max(factor, size // factor * factor)
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[0:size, 0:size]
+    terrain = ndimage.gaussian_filter(rng.standard_normal((size, size)), 8) * 50
+    dem = (terrain + .05 * rows + .02 * np.abs(cols - size / 2)).astype(np.float32)
+
+    transform = Affine(CELLSIZE, 0, ORIGIN[0], 0, -CELLSIZE, ORIGIN[1])
+    fdir_fine = pyflwdir.from_dem(dem, transform=transform, latlon=True, outlets='edge')
+    fdir_coarse, _ = fdir_fine.upscale(factor, method='ihu')
+
+    return {
+        'ldd_fine': to_dataarray(fdir_fine.to_array('d8'), transform, nodata=247),
+        'upstream_fine': to_dataarray(fdir_fine.upstream_area('km2').astype(np.float32), transform, nodata=-9999),
+        'ldd_coarse': to_dataarray(fdir_coarse.to_array('ldd'), fdir_coarse.transform, nodata=255),
+        'upstream_coarse': to_dataarray(fdir_coarse.upstream_area('m2').astype(np.float32), fdir_coarse.transform, nodata=-9999),
+        'fdir_fine': fdir_fine,
+        'fdir_coarse': fdir_coarse,
+    }
+
+
+def synthetic_points(
+    grids: Dict,
+    n_points: int,
+    min_area: float = 50,
+    shift: int = 5,
+    error: float = .02,
+    seed: int = 0
+) -> pd.DataFrame:
+    """
+    Creates a table of points in the format of the input of `lfcoords`. Every
+    point is a random pixel of the fine grid with a catchment larger than
+    "min_area", whose coordinates are shifted a few pixels and whose area has
+    a random error, as the gauging stations in a real inventory.
+
+    Parameters:
+    -----------
+    grids: dictionary
+        Grids created by `synthetic_grids`.
+    n_points: int
+        Number of points.
+    min_area: float, optional
+        Minimum catchment area (km2) of the points.
+    shift: int, optional
+        Maximum shift (fine pixels) of the coordinates in each direction.
+    error: float, optional
+        Standard deviation of the relative error of the reference area.
+    seed: int, optional
+        Seed of the random selection.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Table indexed by 'ID' with fields 'lat', 'lon' and 'area' (km2).
+    """
+
+    rng = np.random.default_rng(seed)
+    upstream = grids['upstream_fine']
+    rows, cols = np.nonzero(upstream.values >= min_area)
+    # keep the points away from the edges, so the search windows fit in the grid
+    inner = (rows >= shift) & (rows < upstream.shape[0] - shift) & (cols >= shift) & (cols < upstream.shape[1] - shift)
+    choice = rng.choice(np.flatnonzero(inner), size=min(n_points, inner.sum()), replace=False)
+    rows, cols = rows[choice], cols[choice]
+
+    area = upstream.values[rows, cols] * (1 + rng.normal(0, error, len(rows)))
+    lat = upstream.y.values[rows] + rng.integers(-shift, shift + 1, len(rows)) * CELLSIZE
+    lon = upstream.x.values[cols] + rng.integers(-shift, shift + 1, len(rows)) * CELLSIZE
+
+    points = pd.DataFrame({
+        'lat': lat.round(6),
+        'lon': lon.round(6),
+        'area': area.round(0),
+    }, index=pd.Index(np.arange(1, len(rows) + 1), name='ID'))
+
+    return points
@@ -20,11 +20,15 @@ setup(
         'pandas',
         'tqdm',
         'pyflwdir',
-        'shapely>=2.0',
+        'shapely>=2.1',
         'pyyaml',
         'rioxarray',
+        'scipy',
         'xarray',
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     author='Peter Burek, Jesús Casado Rodríguez',
     author_email='burek@iiasa.ac.at, chus.casado.88@gmail.com',
     description='Package to preprocess inputs of the hydrological model LISFLOOD.',
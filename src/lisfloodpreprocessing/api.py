@@ -0,0 +1,185 @@
+import copy
+import logging
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+import geopandas as gpd
+import pyflwdir
+import xarray as xr
+
+from lisfloodpreprocessing.config import Config
+from lisfloodpreprocessing.cache import flow_network
+from lisfloodpreprocessing.inputs import check_points
+from lisfloodpreprocessing.utils import find_conflicts
+from lisfloodpreprocessing.finer_grid import coordinates_fine, resolve_conflicts
+from lisfloodpreprocessing.coarser_grid import coordinates_coarse
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+class PointLocator:
+    """
+    Runs the `lfcoords` pipeline on maps and river networks already in memory,
+    without reading or writing any file. The maps are loaded and the river
+    networks built once, when the locator is created, and reused by every call
+    to `locate`, so checking a few points takes a fraction of a second:
+
+        locator = PointLocator(ldd_fine, upstream_fine, ldd_coarse, upstream_coarse)
+        results = locator.locate(points)
+        results['points_1min']
+    """
+
+    def __init__(
+        self,
+        ldd_fine: xr.DataArray,
+        upstream_fine: xr.DataArray,
+        ldd_coarse: Union[xr.DataArray, List[xr.DataArray]],
+        upstream_coarse: Union[xr.DataArray, List[xr.DataArray]],
+        cfg: Optional[Union[Config, Dict]] = None,
+        fdir_fine: Optional[pyflwdir.FlwdirRaster] = None,
+        fdir_coarse: Optional[Union[pyflwdir.FlwdirRaster, List[pyflwdir.FlwdirRaster]]] = None
+    ):
+        """
+        Parameters:
+        -----------
+        ldd_fine: xarray.DataArray
+            Map of local drainage directions (D8) in the fine grid.
+        upstream_fine: xarray.DataArray
+            Map of upstream area (km2) in the fine grid.
+        ldd_coarse: xarray.DataArray or list of xarray.DataArray
+            Map of local drainage directions (LDD) in the coarse grid, or a list
+            of them to locate the points in several coarse grids.
+        upstream_coarse: xarray.DataArray or list of xarray.DataArray
+            Map of upstream area (m2) in the coarse grid, or a list of them in
+            the same order as "ldd_coarse".
+        cfg: Config or dictionary, optional
+            Settings of the pipeline: a `Config` object, or a dictionary with the
+            sections 'conditions', 'conflicts' and 'processing' of the configuration
+            file. By default, the default settings. The results of previous runs
+            are not reused ("incremental") and nothing is exported.
+        fdir_fine: pyflwdir.FlwdirRaster, optional
+            River network of "ldd_fine", if already built.
+        fdir_coarse: pyflwdir.FlwdirRaster or list of pyflwdir.FlwdirRaster, optional
+            River network of every map in "ldd_coarse", if already built.
+        """
+
+        if not isinstance(ldd_coarse, list):
+            ldd_coarse, upstream_coarse = [ldd_coarse], [upstream_coarse]
+            fdir_coarse = [fdir_coarse]
+        elif fdir_coarse is None:
+            fdir_coarse = [None] * len(ldd_coarse)
+        if not len(ldd_coarse) == len(upstream_coarse) == len(fdir_coarse):
+            raise ValueError('"ldd_coarse", "upstream_coarse" and "fdir_coarse" must have the same length')
+
+        # a copy of the settings, so that the caller's configuration is not modified
+        self.cfg = copy.copy(cfg) if isinstance(cfg, Config) else Config(cfg)
+        self.cfg.incremental = False
+        if len(self.cfg.coarse_targets) != len(ldd_coarse):
+            self.cfg.coarse_targets = [{'ldd_coarse': None, 'upstream_coarse': None} for _ in ldd_coarse]
+        self.cfg.update_config(ldd_fine, ldd_coarse)
+
+        # load the maps, except mosaics of tiles, which are read on demand
+        self.ldd_fine = ldd_fine if ldd_fine.attrs.get('tiled') else ldd_fine.load()
+        self.upstream_fine = upstream_fine if upstream_fine.attrs.get('tiled') else upstream_fine.load()
+        self.ldd_coarse = [ldd.load() for ldd in ldd_coarse]
+        self.upstream_coarse = [upstream.load() for upstream in upstream_coarse]
+
+        # build the river networks needed by the delineation and the detection of conflicts
+        flowpath = self.cfg.conflict_flowpath and self.cfg.conflict_tolerance > 0
+        if fdir_fine is None and (self.cfg.delineation != 'crop' or flowpath) and not self.cfg.tiled:
+            fdir_fine = flow_network(self.ldd_fine, 'd8', cache=self.cfg.cache, source=self.cfg.ldd_fine)
+        self.fdir_fine = fdir_fine
+        self.fdir_coarse = []
+        for i, (ldd, fdir) in enumerate(zip(self.ldd_coarse, fdir_coarse)):
+            if fdir is None and (self.cfg.delineation != 'crop' or flowpath):
+                fdir = flow_network(ldd, 'ldd', cache=self.cfg.cache, source=self.cfg.coarse_targets[i]['ldd_coarse'])
+            self.fdir_coarse.append(fdir)
+        self._flowpath = flowpath
+
+    def locate(self, points: pd.DataFrame) -> Dict[str, gpd.GeoDataFrame]:
+        """
+        Finds the coordinates of the points in the fine grid and in every coarse
+        grid, and their catchments, as `lfcoords` does.
+
+        Parameters:
+        -----------
+        points: pandas.DataFrame
+            Table of points with fields 'lat', 'lon' and 'area' (km2), indexed by
+            the point ID or with an 'ID' field.
+
+        Returns:
+        --------
+        Dict[str, geopandas.GeoDataFrame]
+            The layers that `lfcoords` exports, named after the resolution of
+            each grid, e.g., for a fine grid of 3 arcseconds and a coarse grid
+            of 1 arcminute: 'points_3sec', 'catchments_3sec', 'conflicts_3sec',
+            'points_1min', 'catchments_1min' and 'conflicts_1min'. Points in
+            conflict in the fine grid are not located in the coarse grids.
+        """
+
+        cfg = self.cfg
+        points = points.copy()
+        points.columns = points.columns.str.lower()
+        if 'id' in points.columns:
+            points = points.set_index('id').rename_axis('ID')
+        points = check_points(cfg, points, self.ldd_fine)
+
+        # fine grid
+        results = {}
+        points_fine, polygons_fine = coordinates_fine(
+            cfg, points, self.ldd_fine, self.upstream_fine, fdir_fine=self.fdir_fine
+        )
+        if points_fine.empty:
+            return results
+        fdir_conflicts = self.fdir_fine if self._flowpath else None
+        conflicts_fine = find_conflicts(
+            points_fine,
+            resolution=cfg.fine_resolution,
+            pct_error=cfg.pct_error,
+            tolerance=cfg.conflict_tolerance,
+            fdir=fdir_conflicts
+        )
+        if cfg.conflict_resolve and not conflicts_fine.empty:
+            points_fine, polygons_fine = resolve_conflicts(
+                cfg,
+                points_fine,
+                polygons_fine,
+                conflicts_fine,
+                ldd_fine=self.ldd_fine,
+                upstream_fine=self.upstream_fine,
+                fdir_fine=self.fdir_fine
+            )
+            conflicts_fine = find_conflicts(
+                points_fine,
+                resolution=cfg.fine_resolution,
+                pct_error=cfg.pct_error,
+                tolerance=cfg.conflict_tolerance,
+                fdir=fdir_conflicts
+            )
+        results[f'points_{cfg.fine_resolution}'] = points_fine
+        results[f'catchments_{cfg.fine_resolution}'] = polygons_fine
+        results[f'conflicts_{cfg.fine_resolution}'] = conflicts_fine
+        points_fine = points_fine.drop(conflicts_fine.index)
+
+        # coarse grids
+        for i, (ldd, upstream, fdir) in enumerate(zip(self.ldd_coarse, self.upstream_coarse, self.fdir_coarse)):
+            cfg_target = cfg.target(i)
+            points_coarse, polygons_coarse = coordinates_coarse(
+                cfg_target, points_fine, polygons_fine, ldd, upstream, fdir_coarse=fdir
+            )
+            if points_coarse.empty:
+                conflicts_coarse = gpd.GeoDataFrame()
+            else:
+                conflicts_coarse = find_conflicts(
+                    points_coarse,
+                    resolution=cfg_target.coarse_resolution,
+                    pct_error=cfg.pct_error,
+                    tolerance=cfg.conflict_tolerance,
+                    fdir=fdir if self._flowpath else None
+                )
+            results[f'points_{cfg_target.coarse_resolution}'] = points_coarse
+            results[f'catchments_{cfg_target.coarse_resolution}'] = polygons_coarse
+            results[f'conflicts_{cfg_target.coarse_resolution}'] = conflicts_coarse
+
+        return results
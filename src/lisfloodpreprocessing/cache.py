@@ -0,0 +1,322 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import xarray as xr
+import pyflwdir
+import rioxarray
+
+from lisfloodpreprocessing.delineation import flwdir_arrays, flwdir_from_arrays
+from lisfloodpreprocessing.tiles import TILE_INDEX_SUFFIXES, tile_paths
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+# size of the blocks at the beginning and end of a file included in its fingerprint
+FINGERPRINT_BLOCK = 2**20
+
+
+def file_fingerprint(path: Union[str, Path]) -> str:
+    """
+    Computes a fingerprint of a file from its size, modification time and the
+    contents of its first and last megabyte. It is much faster than hashing
+    the complete file, and changes whenever the file is rewritten. The
+    fingerprint of a tile index depends on the size and modification time of
+    all its tiles.
+
+    Parameters:
+    -----------
+    path: string or pathlib.Path
+        File to be fingerprinted.
+
+    Returns:
+    --------
+    str
+        Hexadecimal digest.
+    """
+
+    path = Path(path)
+
+    # mosaics of tiles: size and modification time of every tile
+    if path.is_dir() or path.suffix.lower() in TILE_INDEX_SUFFIXES:
+        digest = hashlib.sha256(str(path.resolve()).encode())
+        for tile in tile_paths(path):
+            stat = tile.stat()
+            digest.update(f'|{tile.resolve()}|{stat.st_size}|{stat.st_mtime_ns}'.encode())
+        return digest.hexdigest()
+
+    stat = path.stat()
+    digest = hashlib.sha256(f'{path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}'.encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BLOCK))
+        if stat.st_size > FINGERPRINT_BLOCK:
+            f.seek(max(stat.st_size - FINGERPRINT_BLOCK, FINGERPRINT_BLOCK))
+            digest.update(f.read(FINGERPRINT_BLOCK))
+
+    return digest.hexdigest()
+
+
+def grid_key(source: Union[str, Path], grid: xr.DataArray, *args) -> str:
+    """
+    Key of a map in the cache. It depends on the fingerprint of the source file,
+    the window of the file that was loaded and any other argument.
+    """
+
+    transform = tuple(np.round(grid.rio.transform()[:6], 12))
+    parts = [file_fingerprint(source), str(grid.shape), str(transform), str(grid.dtype), *map(str, args)]
+
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()[:32]
+
+
+class GridCache:
+    """
+    On-disk cache of the input maps and the river networks derived from them.
+    Arrays are stored as NumPy files and memory-mapped when reused, so repeated
+    runs with the same inputs neither decode the maps nor rebuild the networks.
+    """
+
+    def __init__(self, folder: Union[str, Path]):
+        """
+        Parameters:
+        -----------
+        folder: string or pathlib.Path
+            Folder where the cache is stored.
+        """
+
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _save(path: Path, array: np.ndarray):
+        """Saves an array to a temporary file and moves it into place."""
+
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp.npy')
+        np.save(tmp, array)
+        os.replace(tmp, path)
+
+    def raster(self, grid: xr.DataArray, source: Union[str, Path]) -> xr.DataArray:
+        """
+        Returns a map backed by a memory-mapped array of the cache. If the map is
+        not in the cache, its values are read and stored.
+
+        Parameters:
+        -----------
+        grid: xarray.DataArray
+            Map, possibly lazily loaded, read from "source".
+        source: string or pathlib.Path
+            File from which the map was read.
+
+        Returns:
+        --------
+        xarray.DataArray
+            The same map, with its values memory-mapped from the cache.
+        """
+
+        path = self.folder / 'rasters' / f'{grid_key(source, grid)}.npy'
+        if not path.is_file():
+            path.parent.mkdir(exist_ok=True)
+            self._save(path, grid.values)
+            logger.info(f'Map {source} stored in the cache: {path}')
+        else:
+            logger.info(f'Map {source} loaded from the cache: {path}')
+
+        return grid.copy(data=np.load(path, mmap_mode='r'))
+
+    def network(
+        self,
+        ldd: xr.DataArray,
+        source: Union[str, Path],
+        ftype: str
+    ) -> pyflwdir.FlwdirRaster:
+        """
+        Returns the river network of a map of local drainage directions. If it is
+        not in the cache, it is built with `pyflwdir.from_array` and stored.
+
+        Parameters:
+        -----------
+        ldd: xarray.DataArray
+            Map of local drainage directions read from "source".
+        source: string or pathlib.Path
+            File from which the map was read.
+        ftype: string
+            Type of flow direction map, e.g., 'd8' or 'ldd'.
+
+        Returns:
+        --------
+        pyflwdir.FlwdirRaster
+            River network, with its index arrays memory-mapped from the cache.
+        """
+
+        folder = self.folder / 'networks' / grid_key(source, ldd, ftype)
+        meta_file = folder / 'meta.json'
+        transform = ldd.rio.transform()
+
+        if not meta_file.is_file():
+            fdir = pyflwdir.from_array(
+                ldd.values,
+                ftype=ftype,
+                transform=transform,
+                check_ftype=False,
+                latlon=True
+            )
+            folder.mkdir(parents=True, exist_ok=True)
+            for key, array in flwdir_arrays(fdir).items():
+                self._save(folder / f'{key}.npy', array)
+            with open(meta_file, 'w') as f:
+                json.dump({'source': str(source), 'shape': ldd.shape, 'ftype': ftype}, f)
+            logger.info(f'River network of {source} stored in the cache: {folder}')
+            return fdir
+
+        arrays = {
+            key: np.load(folder / f'{key}.npy', mmap_mode='r')
+            for key in ['idxs_ds', 'idxs_pit', 'idxs_outlet', 'idxs_seq']
+        }
+        logger.info(f'River network of {source} loaded from the cache: {folder}')
+
+        return flwdir_from_arrays(arrays, ldd.shape, ftype, transform=transform, latlon=True)
+
+
+def flow_network(
+    ldd: xr.DataArray,
+    ftype: str,
+    cache: Optional[GridCache] = None,
+    source: Optional[Union[str, Path]] = None
+) -> pyflwdir.FlwdirRaster:
+    """
+    Creates the river network of a map of local drainage directions, using the
+    cache if provided.
+
+    Parameters:
+    -----------
+    ldd: xarray.DataArray
+        Map of local drainage directions.
+    ftype: string
+        Type of flow direction map, e.g., 'd8' or 'ldd'.
+    cache: GridCache, optional
+        Cache of river networks.
+    source: string or pathlib.Path, optional
+        File from which "ldd" was read. Required to use the cache.
+
+    Returns:
+    --------
+    pyflwdir.FlwdirRaster
+        River network.
+    """
+
+    if cache is not None and source is not None:
+        return cache.network(ldd, source, ftype)
+
+    return pyflwdir.from_array(
+        ldd.data,
+        ftype=ftype,
+        transform=ldd.rio.transform(),
+        check_ftype=False,
+        latlon=True
+    )
+
+
+def point_keys(points: pd.DataFrame, *settings) -> pd.Series:
+    """
+    Keys of the points in the cache of results. The key of a point depends on
+    its ID, the values of its row and any setting that affects its result, e.g.,
+    thresholds or fingerprints of the input maps.
+
+    Parameters:
+    -----------
+    points: pandas.DataFrame
+        Table of points, indexed by ID, with the columns that define the result.
+    settings:
+        Any other argument the result depends on.
+
+    Returns:
+    --------
+    pandas.Series
+        Hexadecimal key of every point.
+    """
+
+    common = hashlib.sha256('|'.join(map(str, settings)).encode()).hexdigest()
+    keys = [
+        hashlib.sha256(f'{common}|{point_id}|{values}'.encode()).hexdigest()[:32]
+        for point_id, values in zip(points.index, map(repr, points.values.tolist()))
+    ]
+
+    return pd.Series(keys, index=points.index, name='key')
+
+
+class ResultCache:
+    """
+    Cache of the results of every point in a stage of `lfcoords`, so that a
+    re-run only processes the points that are new or whose inputs changed.
+    """
+
+    def __init__(self, folder: Union[str, Path]):
+        """
+        Parameters:
+        -----------
+        folder: string or pathlib.Path
+            Folder where the results are stored.
+        """
+
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def load(self, stage: str, keys: pd.Series) -> Tuple[pd.DataFrame, gpd.GeoDataFrame]:
+        """
+        Results of the previous run for the points whose key did not change.
+
+        Parameters:
+        -----------
+        stage: string
+            Name of the stage, e.g., 'fine_3sec'.
+        keys: pandas.Series
+            Current key of every point, computed with `point_keys`.
+
+        Returns:
+        --------
+        Tuple[pandas.DataFrame, geopandas.GeoDataFrame]
+            A tuple containing the table of points and the table of polygons of
+            the points that can be reused. Both are empty if there is no cache.
+        """
+
+        path = self.folder / f'{stage}.pkl'
+        if not path.is_file():
+            return pd.DataFrame(), gpd.GeoDataFrame()
+
+        results = pd.read_pickle(path)
+        points, polygons = results['points'], results['polygons']
+        reuse = points.index[points.key == keys.reindex(points.index)]
+
+        return points.loc[reuse].drop(columns='key'), polygons[polygons.index.isin(reuse)]
+
+    def save(self, stage: str, keys: pd.Series, points: pd.DataFrame, polygons: gpd.GeoDataFrame):
+        """
+        Stores the results of the points that produced a polygon. Points that
+        failed are not stored, so they are processed again in the next run.
+
+        Parameters:
+        -----------
+        stage: string
+            Name of the stage, e.g., 'fine_3sec'.
+        keys: pandas.Series
+            Key of every point, computed with `point_keys`.
+        points: pandas.DataFrame
+            Table of points resulting from the stage.
+        polygons: geopandas.GeoDataFrame
+            Table of polygons resulting from the stage.
+        """
+
+        points = points[points.index.isin(polygons.index)].copy()
+        points['key'] = keys.reindex(points.index)
+
+        path = self.folder / f'{stage}.pkl'
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+        pd.to_pickle({'points': points, 'polygons': polygons}, tmp)
+        os.replace(tmp, path)
+        logger.info(f'Results of {len(points)} points stored in: {path}')
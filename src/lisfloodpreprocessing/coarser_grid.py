@@ -1,16 +1,21 @@
+import hashlib
 import logging
-from typing import Optional, Union, Tuple
+from typing import Callable, Optional, Union, Tuple
 import warnings
 
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-import xarray as xr
 import pyflwdir
-from tqdm import tqdm
+import shapely
+import xarray as xr
 
 from lisfloodpreprocessing import Config
-from lisfloodpreprocessing.utils import catchment_polygon
+from lisfloodpreprocessing.cache import file_fingerprint, flow_network, point_keys
+from lisfloodpreprocessing.utils import catchment_polygon, coverage_fraction, intersection_over_union, nearest_indices, pixel_indices, resolution_cellsize
+from lisfloodpreprocessing.delineation import BasinCache, CroppedNetwork, GridNetwork, flow_path
+from lisfloodpreprocessing.parallel import run_tasks
+from lisfloodpreprocessing.profiling import stage, step
 
 warnings.filterwarnings("ignore")
 
@@ -24,7 +29,8 @@ def coordinates_coarse(
     polygons_fine: gpd.GeoDataFrame,
     ldd_coarse: xr.DataArray,
     upstream_coarse: xr.DataArray,
-    save: bool = False
+    save: bool = False,
+    fdir_coarse: Optional[pyflwdir.FlwdirRaster] = None
 ) -> Optional[Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]]:
     """
     Transforms point coordinates from a high-resolution grid to a corresponding
@@ -44,7 +50,9 @@ def coordinates_coarse(
     upstream_coarse : xr.DataArray
         Map of upstream area (m2) in the coarse grid.
     save : bool, optional
-        If True, the updated tables are exported as shapefiles.
+        If True, the updated tables are exported in the output format of the configuration.
+    fdir_coarse : pyflwdir.FlwdirRaster, optional
+        River network of "ldd_coarse", if already built. Otherwise, it is built from "ldd_coarse".
 
     Returns
     -------
@@ -54,126 +62,49 @@ def coordinates_coarse(
         - A table with the catchment polygons in the coarser grid.
     """
     
-    points_coarse = points_fine.copy()
-    n_points = points_coarse.shape[0]
-    
-    # create river network
-    fdir_coarse = pyflwdir.from_array(
-        ldd_coarse.data,
-        ftype='ldd',
-        transform=ldd_coarse.rio.transform(),
-        check_ftype=False,
-        latlon=True
-    )
-
-    # get resolution of the coarse grid
-    cellsize = np.round(np.mean(np.diff(ldd_coarse.x)), 6) # degrees
-
-    # extract resolution of the finer grid
     cols = ['area', 'lat', 'lon']
     cols_fine = [f'{col}_{cfg.fine_resolution}' for col in cols]
-
-    # add new columns to 'points_coarse'
-    cols_coarse = [f'{col}_{cfg.coarse_resolution}' for col in cols]
-    points_coarse[cols_coarse] = np.nan
-
-    # search range of 5x5 array
-    n_cell = 2 # number of cells to search in each direction
-    range_xy = np.arange(-n_cell, n_cell + 1) * cellsize # arcmin
-    polygons_coarse = []
-    for point_id, attrs in tqdm(points_coarse.iterrows(), total=n_points, desc='points'):
-        try:
-            # real upstream area
-            area_ref, lat_ref, lon_ref = attrs[cols]
-
-            # coordinates and upstream area in the fine grid
-            area_fine, lat_fine, lon_fine = attrs[cols_fine]
-
-            # find ratio
-            logger.debug('Start search')
-            inter_vs_union, area_ratio, area_lisf = [], [], []
-            for delta_lat in range_xy:
-                for delta_lon in range_xy:
-                    lon = lon_fine + delta_lon
-                    lat = lat_fine + delta_lat
-                    basin = catchment_polygon(
-                        fdir_coarse.basins(xy=(lon, lat)).astype(np.int32),
-                        transform=ldd_coarse.rio.transform(),
-                        crs=ldd_coarse.rio.crs
-                    )
-
-                    # calculate union and intersection of shapes
-                    intersection = gpd.overlay(polygons_fine.loc[[point_id]], basin, how='intersection')
-                    union = gpd.overlay(polygons_fine.loc[[point_id]], basin, how='union')
-                    inter_vs_union.append(intersection.area.sum() / union.area.sum())
-
-                    # get upstream area (km2) of coarse grid (LISFLOOD)
-                    area = upstream_coarse.sel(x=lon, y=lat, method='nearest').item() * 1e-6
-                    area_lisf.append(area)
-
-                    # ratio between reference and coarse area
-                    if area_ref == 0 or area == 0:
-                        ratio = 0
-                    else:
-                        ratio = area_ref / area if area_ref < area else area / area_ref
-                    area_ratio.append(ratio)
-            logger.debug('End search')
-
-            # maximum of shape similarity and upstream area accordance
-            i_shape = np.argmax(inter_vs_union)
-            area_shape = area_lisf[i_shape]
-            i_centre = int(len(range_xy)**2 / 2) # middle point
-            area_centre = area_lisf[i_centre]
-            
-            # use middle point if errors are small
-            abs_error = abs(area_shape - area_centre)
-            pct_error = 100 * abs(1 - area_centre / area_shape)
-            if (abs_error <= cfg.abs_error) and (pct_error <= cfg.pct_error):
-                i_shape = i_centre
-                area_shape = area_centre
-                
-            # coordinates in the fine resolution
-            i = i_shape // len(range_xy)
-            j = i_shape % len(range_xy)
-            lat = lat_fine + range_xy[i]
-            lon = lon_fine + range_xy[j]
-
-            # coordinates and upstream area on coarse resolution
-            area = upstream_coarse.sel(x=lon, y=lat, method='nearest')
-            area_coarse = area.item() * 1e-6
-            lon_coarse = area.x.item()
-            lat_coarse = area.y.item()
-
-            # derive catchment polygon from the selected coordinates
-            basin_coarse = catchment_polygon(
-                fdir_coarse.basins(xy=(lon_coarse, lat_coarse)).astype(np.int32),
-                transform=ldd_coarse.rio.transform(),
-                crs=ldd_coarse.rio.crs,
-                name='ID'
-            )
-            basin_coarse['ID'] = point_id
-            basin_coarse.set_index('ID', inplace=True)
-            basin_coarse[cols] = area_ref, lat_ref, lon_ref
-            basin_coarse[cols_fine] = area_fine, lat_fine, lon_fine
-            basin_coarse[cols_coarse] = area_coarse, lat_coarse, lon_coarse
-
-            # save polygon
-            polygons_coarse.append(basin_coarse)
-
-            # update new columns in 'points_coarse'
-            points_coarse.loc[point_id, cols_coarse] = [int(area_coarse), round(lat_coarse, 6), round(lon_coarse, 6)]
-
-            # logger.info(f'Point {point_id} located in the coarser grid')
-        except Exception as e:
-            logger.error(f'Point {point_id} could not be located in the coarser grid: {e}')
-
+    
+    # reuse the results of the points that did not change since the last run
+    if cfg.incremental:
+        polygon_keys = polygons_fine.geometry.to_wkb().groupby(level=0).agg(b''.join).map(
+            lambda wkb: hashlib.sha256(wkb).hexdigest()
+        )
+        keys = point_keys(
+            points_fine[cols + cols_fine].assign(polygon=polygon_keys),
+            cfg.abs_error,
+            cfg.pct_error,
+            cfg.min_area_ratio,
+            cfg.coarse_search,
+            file_fingerprint(cfg.ldd_coarse),
+            file_fingerprint(cfg.upstream_coarse)
+        )
+        points_cached, polygons_cached = cfg.results.load(f'coarse_{cfg.coarse_resolution}', keys)
+        logger.info(f'{len(points_cached)} points reused from the previous run in the coarser grid')
+    else:
+        points_cached, polygons_cached = pd.DataFrame(), gpd.GeoDataFrame()
+    points_new = points_fine.drop(points_cached.index)
+    
+    # locate the new points
+    if len(points_new) > 0:
+        points_coarse, polygons_coarse = locate_coarse(cfg, points_new, polygons_fine, ldd_coarse, upstream_coarse, fdir_coarse=fdir_coarse)
+    else:
+        points_coarse, polygons_coarse = pd.DataFrame(), gpd.GeoDataFrame()
+    
+    # merge with the results of the previous run
+    if cfg.incremental:
+        # no polygons at all if every point failed and none was reused
+        frames = [df for df in [points_coarse, points_cached] if not df.empty]
+        points_coarse = pd.concat(frames).loc[points_fine.index] if frames else pd.DataFrame()
+        frames = [gdf for gdf in [polygons_coarse, polygons_cached] if not gdf.empty]
+        polygons_coarse = pd.concat(frames) if frames else gpd.GeoDataFrame()
+        polygons_coarse = polygons_coarse.loc[points_fine.index.intersection(polygons_coarse.index)]
+        cfg.results.save(f'coarse_{cfg.coarse_resolution}', keys, points_coarse, polygons_coarse)
+    
     # handle case where no polygons were generated
-    if not polygons_coarse:
-        logger.warning('No points could be located in the finer grid. Returning empty dataframes.')
+    if polygons_coarse.empty:
+        logger.warning('No points could be located in the coarser grid. Returning empty dataframes.')
         return gpd.GeoDataFrame(), gpd.GeoDataFrame()
-        
-    # concatenate polygons shapefile
-    polygons_coarse = pd.concat(polygons_coarse)
     
     # convert points to geopandas
     points_coarse = gpd.GeoDataFrame(
@@ -192,13 +123,362 @@ def coordinates_coarse(
     
     if save:
         # polygons
-        polygon_shp = cfg.output_folder / f'catchments_{cfg.coarse_resolution}.shp'
-        polygons_coarse.to_file(polygon_shp)
-        logger.info(f'Catchments in the coarser grid have been exported to: {polygon_shp}')
+        layer = f'catchments_{cfg.coarse_resolution}'
+        cfg.writer.write(polygons_coarse, layer)
+        logger.info(f'Catchments in the coarser grid are being exported to: {cfg.writer.path(layer)}')
         
         # points
-        point_shp = cfg.output_folder / f'{cfg.points.stem}_{cfg.coarse_resolution}.shp'
-        points_coarse.to_file(point_shp)
-        logger.info(f'The updated points table in the coarser grid has been exported to: {point_shp}')
+        layer = f'{cfg.points.stem}_{cfg.coarse_resolution}'
+        cfg.writer.write(points_coarse, layer)
+        logger.info(f'The updated points table in the coarser grid is being exported to: {cfg.writer.path(layer)}')
+
+    return points_coarse, polygons_coarse
+
+
+def locate_coarse(
+    cfg: Config,
+    points_fine: Union[pd.DataFrame, gpd.GeoDataFrame],
+    polygons_fine: gpd.GeoDataFrame,
+    ldd_coarse: xr.DataArray,
+    upstream_coarse: xr.DataArray,
+    fdir_coarse: Optional[pyflwdir.FlwdirRaster] = None
+) -> Tuple[pd.DataFrame, gpd.GeoDataFrame]:
+    """
+    Finds the pixel of the coarse grid whose catchment best matches the catchment
+    of every point in the fine grid. It is the core of `coordinates_coarse`,
+    without reusing previous results or exporting.
+
+    Parameters
+    ----------
+    cfg : Config
+        Configuration object with file paths and parameters.
+    points_fine : pd.DataFrame or gpd.GeoDataFrame
+        Table with updated station coordinates and upstream areas from a finer grid.
+    polygons_fine : gpd.GeoDataFrame
+        Table with the catchment polygons from a finer grid.
+    ldd_coarse : xr.DataArray
+        Map of local drainage directions in the coarse grid.
+    upstream_coarse : xr.DataArray
+        Map of upstream area (m2) in the coarse grid.
+    fdir_coarse : pyflwdir.FlwdirRaster, optional
+        River network of "ldd_coarse", if already built. It is not used with the
+        "crop" delineation, which builds the network around every point.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, gpd.GeoDataFrame]
+        A tuple containing:
+        - The table of points with the coordinates and upstream area in the coarse grid.
+        - A table with the catchment polygons of the points that could be located.
+    """
+    
+    points_coarse = points_fine.copy()
+    
+    # create river network
+    if cfg.delineation != 'crop' and fdir_coarse is None:
+        with stage('network'):
+            fdir_coarse = flow_network(ldd_coarse, 'ldd', cache=cfg.cache, source=cfg.ldd_coarse)
+
+    # get resolution of the coarse grid
+    cellsize = np.round(np.mean(np.diff(ldd_coarse.x)), 6) # degrees
+
+    # extract resolution of the finer grid
+    cols = ['area', 'lat', 'lon']
+    cols_fine = [f'{col}_{cfg.fine_resolution}' for col in cols]
+
+    # add new columns to 'points_coarse'
+    cols_coarse = [f'{col}_{cfg.coarse_resolution}' for col in cols]
+    points_coarse[cols_coarse] = np.nan
+    
+    # subpixels used to rasterize the fine catchments: fine pixels in a coarse pixel
+    supersample = max(1, int(round(cellsize / resolution_cellsize(cfg.fine_resolution))))
+
+    # the fine catchment of every point is sent as WKB
+    tasks, task_ids = [], []
+    for point_id, attrs in points_coarse.iterrows():
+        if point_id not in polygons_fine.index:
+            logger.error(f'Point {point_id} could not be located in the coarser grid: no catchment in the finer grid')
+            continue
+        polygon_fine = shapely.union_all(polygons_fine.geometry.loc[[point_id]].values)
+        tasks.append((*attrs[cols].values, *attrs[cols_fine].values, shapely.to_wkb(polygon_fine)))
+        task_ids.append(point_id)
+
+    # match the catchments of all the points
+    with stage('matching'):
+        results = run_tasks(
+            match_coarse,
+            tasks,
+            state={
+                'network': None if cfg.delineation == 'crop' else GridNetwork(fdir_coarse),
+                'ldd_coarse': ldd_coarse,
+                'upstream_coarse': upstream_coarse,
+                'basins': BasinCache(),
+                'cellsize': cellsize,
+                'supersample': supersample,
+                'abs_error': cfg.abs_error,
+                'pct_error': cfg.pct_error,
+                'min_area_ratio': cfg.min_area_ratio,
+                'coarse_search': cfg.coarse_search,
+                'extent_factor': cfg.extent_factor,
+            },
+            workers=cfg.workers,
+            priority=[task[0] for task in tasks],
+            ids=task_ids
+        )
+    
+    polygons_coarse = []
+    for point_id, task, result in zip(task_ids, tasks, results):
+        if isinstance(result, Exception):
+            logger.error(f'Point {point_id} could not be located in the coarser grid: {result}')
+            continue
+        basin_coarse, area_coarse, lat_coarse, lon_coarse = result
+        basin_coarse['ID'] = point_id
+        basin_coarse.set_index('ID', inplace=True)
+        basin_coarse[cols] = task[:3]
+        basin_coarse[cols_fine] = task[3:6]
+        basin_coarse[cols_coarse] = area_coarse, lat_coarse, lon_coarse
+
+        # save polygon
+        polygons_coarse.append(basin_coarse)
 
+        # update new columns in 'points_coarse'
+        points_coarse.loc[point_id, cols_coarse] = [int(area_coarse), round(lat_coarse, 6), round(lon_coarse, 6)]
+
+    # concatenate polygons shapefile
+    if not polygons_coarse:
+        return points_coarse, gpd.GeoDataFrame()
+    polygons_coarse = pd.concat(polygons_coarse)
+    
     return points_coarse, polygons_coarse
+
+
+def match_coarse(
+    task: Tuple[float, float, float, float, float, float, bytes],
+    network: Optional[GridNetwork],
+    ldd_coarse: xr.DataArray,
+    upstream_coarse: xr.DataArray,
+    basins: BasinCache,
+    cellsize: float,
+    supersample: int = 1,
+    abs_error: float = 50,
+    pct_error: float = 1,
+    min_area_ratio: float = 0.1,
+    coarse_search: str = 'square',
+    extent_factor: float = 3
+) -> Tuple[gpd.GeoDataFrame, float, float, float]:
+    """
+    Finds the pixel of the coarse grid whose catchment best matches the catchment
+    of a point in the fine grid.
+
+    Parameters
+    ----------
+    task : tuple
+        Reference area (km2), latitude and longitude, the same values in the
+        fine grid, and the catchment polygon in the fine grid as WKB.
+    network : GridNetwork, optional
+        River network of the complete coarse grid. If None, the network is
+        built on a window of "ldd_coarse" around the point.
+    ldd_coarse : xr.DataArray
+        Map of local drainage directions in the coarse grid.
+    upstream_coarse : xr.DataArray
+        Map of upstream area (m2) in the coarse grid.
+    basins : BasinCache
+        Catchments already delineated in the coarse grid.
+    cellsize : float
+        Cell size of the coarse grid (degrees).
+    supersample : int, optional
+        Subpixels used to rasterize the fine catchment in every coarse pixel.
+    abs_error : float, optional
+        Maximum absolute error (km2) to keep the central pixel.
+    pct_error : float, optional
+        Maximum percentage error (%) to keep the central pixel.
+    min_area_ratio : float, optional
+        Minimum ratio between the reference and the coarse upstream area of a candidate pixel.
+    coarse_search : str, optional
+        Candidate pixels: 'square' or 'flowpath'.
+    extent_factor : float, optional
+        Factor that defines the initial window of the river network when "network" is None.
+
+    Returns
+    -------
+    Tuple[gpd.GeoDataFrame, float, float, float]
+        The catchment polygon, and the upstream area (km2), latitude and longitude
+        of the selected pixel in the coarse grid.
+    """
+
+    area_ref, lat_ref, lon_ref, area_fine, lat_fine, lon_fine, wkb = task
+
+    # search range of 5x5 array
+    n_cell = 2 # number of cells to search in each direction
+    range_xy = np.arange(-n_cell, n_cell + 1) * cellsize # arcmin
+    max_steps = 5 * n_cell # maximum number of cells along the river in each direction (flowpath search)
+    
+    transform_coarse = ldd_coarse.rio.transform()
+    pixel_area = abs(transform_coarse.a * transform_coarse.e)
+    x_coarse, y_coarse = upstream_coarse.x.values, upstream_coarse.y.values
+
+    # river network around the point
+    if network is None:
+        network = CroppedNetwork(ldd_coarse, 'ldd', lat_fine, lon_fine, area_ref, factor=extent_factor, buffer=n_cell + 1)
+    
+    # fraction of every coarse pixel covered by the fine catchment
+    polygon_fine = shapely.from_wkb(wkb)
+    with step('overlay'):
+        fractions, transform_fractions = coverage_fraction(polygon_fine, transform_coarse, supersample=supersample)
+    area_polygon = polygon_fine.area / pixel_area
+
+    # pixels of the search window, and their upstream area (km2) in the coarse grid (LISFLOOD).
+    # The upstream area and the selected pixel are those of the nearest pixel centre, whereas
+    # the catchment of a candidate is traced from the pixel that contains its coordinates, as
+    # `pyflwdir` does. They only differ for coordinates on the edge between two pixels
+    lat_search, lon_search = lat_fine + range_xy, lon_fine + range_xy
+    rows, cols_idx = nearest_indices(upstream_coarse, lat_search, lon_search)
+    area_lisf = upstream_coarse.variable[rows, cols_idx].values.ravel() * 1e-6
+    rows_basin, cols_basin = pixel_indices(upstream_coarse, lat_search, lon_search)
+    rows_basin = np.clip(rows_basin, 0, upstream_coarse.shape[0] - 1)
+    cols_basin = np.clip(cols_basin, 0, upstream_coarse.shape[1] - 1)
+    
+    # ratio between reference and coarse area
+    with np.errstate(divide='ignore', invalid='ignore'):
+        area_ratio = np.where(
+            (area_ref == 0) | (area_lisf == 0),
+            0,
+            np.minimum(area_ref, area_lisf) / np.maximum(area_ref, area_lisf)
+        )
+
+    def shape_similarity(row, col):
+        basin_arr, transform, _ = basins.basin(network, row, col, x_coarse[col], y_coarse[row])
+        with step('overlay'):
+            return intersection_over_union(basin_arr, transform, fractions, transform_fractions, area_polygon)
+
+    # candidate pixels and their shape similarity
+    logger.debug('Start search')
+    if coarse_search == 'flowpath':
+        cand_rows, cand_cols, cand_area, inter_vs_union = search_flowpath(
+            ldd_coarse,
+            upstream_coarse,
+            np.repeat(rows, len(range_xy)),
+            np.tile(cols_idx, len(range_xy)),
+            area_ratio,
+            area_ref,
+            shape_similarity,
+            min_area_ratio=min_area_ratio,
+            max_steps=max_steps
+        )
+    else:
+        cand_rows = np.repeat(rows, len(range_xy))
+        cand_cols = np.tile(cols_idx, len(range_xy))
+        cand_area = area_lisf
+    
+        # discard candidates whose upstream area is implausible, unless none is plausible
+        candidates = np.flatnonzero(area_ratio >= min_area_ratio)
+        if candidates.size == 0:
+            candidates = np.arange(area_ratio.size)
+        logger.debug(f'{area_ratio.size - candidates.size} candidates discarded by their upstream area')
+
+        # find ratio
+        inter_vs_union = np.zeros(area_ratio.size)
+        for k in candidates:
+            i, j = divmod(k, len(range_xy))
+            inter_vs_union[k] = shape_similarity(rows_basin[i], cols_basin[j])
+    logger.debug('End search')
+
+    # maximum of shape similarity and upstream area accordance
+    i_shape = np.argmax(inter_vs_union)
+    row, col = cand_rows[i_shape], cand_cols[i_shape]
+    area_shape = cand_area[i_shape]
+    i_centre = int(len(range_xy)**2 / 2) # middle point
+    area_centre = area_lisf[i_centre]
+    
+    # use middle point if errors are small
+    if (abs(area_shape - area_centre) <= abs_error) and (100 * abs(1 - area_centre / area_shape) <= pct_error):
+        row, col = rows[n_cell], cols_idx[n_cell]
+        area_shape = area_centre
+        
+    # coordinates and upstream area on coarse resolution
+    area_coarse = area_shape
+    lat_coarse = y_coarse[row].item()
+    lon_coarse = x_coarse[col].item()
+
+    # derive catchment polygon from the selected coordinates
+    basin_arr, transform, _ = basins.basin(network, row, col, lon_coarse, lat_coarse)
+    with step('catchment_polygon'):
+        basin_coarse = catchment_polygon(
+            basin_arr,
+            transform=transform,
+            crs=ldd_coarse.rio.crs,
+            name='ID'
+        )
+
+    return basin_coarse, area_coarse, lat_coarse, lon_coarse
+
+
+def search_flowpath(
+    ldd_coarse: xr.DataArray,
+    upstream_coarse: xr.DataArray,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    area_ratio: np.ndarray,
+    area_ref: float,
+    shape_similarity: Callable[[int, int], float],
+    min_area_ratio: float = 0.1,
+    max_steps: int = 10
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Searches the coarse pixel that best matches a catchment along the river
+    channel instead of a square window. The search starts at the pixel of the
+    window whose upstream area best matches the reference, and it moves 
+    downstream and upstream along the LDD while the shape similarity improves.
+
+    Parameters
+    ----------
+    ldd_coarse : xr.DataArray
+        Map of local drainage directions in the coarse grid.
+    upstream_coarse : xr.DataArray
+        Map of upstream area (m2) in the coarse grid.
+    rows : np.ndarray
+        Row of every pixel in the square window around the point.
+    cols : np.ndarray
+        Column of every pixel in the square window around the point.
+    area_ratio : np.ndarray
+        Ratio between the reference and the coarse upstream area of every pixel in the window.
+    area_ref : float
+        Reference catchment area (km2).
+    shape_similarity : Callable
+        Function that computes the shape similarity of the catchment of a pixel (row, column).
+    min_area_ratio : float, optional
+        Pixels along the river whose area ratio is smaller end the search in that direction.
+    max_steps : int, optional
+        Maximum number of pixels visited in each direction.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+        Row, column, upstream area (km2) and shape similarity of the visited pixels.
+    """
+
+    # starting pixel: best area ratio, the closest to the centre in case of ties
+    centre = len(rows) // 2
+    start = min(range(len(rows)), key=lambda k: (-area_ratio[k], abs(k - centre)))
+    row, col = rows[start], cols[start]
+    area = upstream_coarse.variable[row, col].values.item() * 1e-6
+    visited = [(row, col, area, shape_similarity(row, col))]
+
+    downstream, upstream = flow_path(ldd_coarse, upstream_coarse, row, col, max_steps=max_steps)
+    for path in [downstream, upstream]:
+        best = visited[0][3]
+        for row, col, area in path:
+            area *= 1e-6
+            ratio = min(area_ref, area) / max(area_ref, area) if area_ref > 0 and area > 0 else 0
+            if ratio < min_area_ratio:
+                break
+            score = shape_similarity(row, col)
+            visited.append((row, col, area, score))
+            if score <= best:
+                break
+            best = score
+    logger.debug(f'{len(visited)} pixels visited along the river')
+
+    cand_rows, cand_cols, cand_area, scores = map(np.array, zip(*visited))
+
+    return cand_rows.astype(int), cand_cols.astype(int), cand_area, scores
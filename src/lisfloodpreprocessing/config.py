@@ -0,0 +1,195 @@
+import copy
+import logging
+import yaml
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+import numpy as np
+
+from lisfloodpreprocessing.outputs import OutputWriter
+from lisfloodpreprocessing.tiles import is_tiled
+
+if TYPE_CHECKING:
+    import xarray as xr
+    from lisfloodpreprocessing.cache import GridCache, ResultCache
+
+# set logger
+logger = logging.getLogger(__name__)
+
+class Config:
+    """
+    Manages the application's configuration by reading a YAML file
+    and setting default values.
+    """
+    
+    def __init__(self, config_file: Optional[Union[str, Path, Dict]] = None):
+        """
+        Reads the configuration from a YAML file and sets default values if not provided.
+
+        Parameters:
+        -----------
+        config_file: string, pathlib.Path or dictionary, optional
+            The path to the YAML configuration file, or its contents as a dictionary.
+            A dictionary may omit the input files and the output folder, as when the
+            maps are provided in memory (see `lisfloodpreprocessing.api`); without
+            output folder, nothing is written to disk. If not provided, all the
+            settings take their default values.
+        """
+        
+        # read configuration file
+        from_file = config_file is not None and not isinstance(config_file, dict)
+        if from_file:
+            with open(config_file, 'r', encoding='utf8') as ymlfile:
+                config = yaml.load(ymlfile, Loader=yaml.FullLoader)
+        else:
+            config = config_file or {}
+            
+        # input file paths
+        inputs = config.get('input') or {}
+        if from_file:
+            missing = [key for key in ['points', 'ldd_fine', 'upstream_fine'] if not inputs.get(key)]
+            if missing:
+                raise KeyError(f'Input files missing in the configuration file: {missing}')
+        self.points = Path(inputs['points']) if inputs.get('points') else None
+        self.ldd_fine = Path(inputs['ldd_fine']) if inputs.get('ldd_fine') else None
+        self.upstream_fine = Path(inputs['upstream_fine']) if inputs.get('upstream_fine') else None
+        
+        # coarse grids: a single one, or a list of targets with different resolutions
+        targets = inputs.get('coarse') or ([inputs] if from_file or inputs.get('ldd_coarse') else [])
+        self.coarse_targets: List[Dict[str, Path]] = [
+            {key: Path(target[key]) for key in ['ldd_coarse', 'upstream_coarse']}
+            for target in targets
+        ]
+        if not self.coarse_targets:
+            self.coarse_targets = [{'ldd_coarse': None, 'upstream_coarse': None}]
+        self.ldd_coarse = self.coarse_targets[0]['ldd_coarse']
+        self.upstream_coarse = self.coarse_targets[0]['upstream_coarse']
+        
+        # resolutions
+        self.fine_resolution = None
+        self.coarse_resolution = None
+        self.coarse_resolutions: List[str] = []
+        
+        # output folder
+        output_folder = config.get('output_folder') or ('./shapefiles' if from_file else None)
+        self.output_folder = Path(output_folder) if output_folder else None
+        self.output_format = config.get('output_format') or 'shp'
+        if self.output_folder is not None:
+            self.output_folder.mkdir(parents=True, exist_ok=True)
+            name = self.points.stem if self.points is not None else 'points'
+            self.writer = OutputWriter(self.output_folder, self.output_format, name=name)
+        else:
+            self.writer = None
+        
+        # cache of input maps and river networks
+        cache_folder = config.get('cache_folder')
+        self.cache_folder = Path(cache_folder) if cache_folder else None
+        self._cache = None
+        
+        # conditions
+        conditions = config.get('conditions') or {}
+        self.min_area = conditions.get('min_area', 10)
+        self.abs_error = conditions.get('abs_error', 50)
+        self.pct_error = conditions.get('pct_error', 1)
+        self.min_area_ratio = conditions.get('min_area_ratio', 0.1)
+        
+        # detection of conflicts
+        conflicts = config.get('conflicts') or {}
+        self.conflict_tolerance = conflicts.get('tolerance', 0)
+        self.conflict_flowpath = conflicts.get('same_flowpath', False)
+        self.conflict_resolve = conflicts.get('resolve', False)
+        
+        # processing options
+        processing = config.get('processing') or {}
+        self.windowed = processing.get('windowed', False)
+        self.extent_factor = processing.get('extent_factor', 3)
+        self.delineation = processing.get('delineation', 'grid')
+        assert self.delineation in ['grid', 'nested', 'crop'], '"delineation" must be either "grid", "nested" or "crop"'
+        self.workers = processing.get('workers', 1)
+        self.simplify = processing.get('simplify', 0)
+        self.coarse_search = processing.get('coarse_search', 'square')
+        assert self.coarse_search in ['square', 'flowpath'], '"coarse_search" must be either "square" or "flowpath"'
+        self.incremental = processing.get('incremental', False)
+        assert not self.incremental or self.output_folder is not None, '"incremental" requires an output folder'
+        self.tile_cache = processing.get('tile_cache', 2048)
+        self.memory_budget = processing.get('memory_budget')
+        self.profile = processing.get('profile', False)
+        self.profile_log = processing.get('profile_log', False)
+        
+        # mosaics of tiles of the fine grid
+        self.tiled = any(path is not None and is_tiled(path) for path in [self.ldd_fine, self.upstream_fine])
+        if self.tiled and self.delineation != 'crop':
+            logger.warning('The fine grid is a mosaic of tiles: "delineation" is set to "crop"')
+            self.delineation = 'crop'
+        self._results = None
+        
+    @property
+    def cache(self) -> Optional['GridCache']:
+        """Cache of input maps and river networks, if "cache_folder" is defined."""
+
+        if self._cache is None and self.cache_folder is not None:
+            # imported on demand, so that reading the configuration is fast
+            from lisfloodpreprocessing.cache import GridCache
+            self._cache = GridCache(self.cache_folder)
+        return self._cache
+
+    @property
+    def results(self) -> Optional['ResultCache']:
+        """Cache of the results of every point, if "incremental" is True."""
+
+        if self._results is None and self.incremental:
+            from lisfloodpreprocessing.cache import ResultCache
+            self._results = ResultCache(self.output_folder / '.lfcoords')
+        return self._results
+        
+    def update_config(
+        self,
+        fine_grid: 'xr.DataArray',
+        coarse_grid: Union['xr.DataArray', List['xr.DataArray']]
+    ):
+        """
+        Extracts the resolution from the finer and coarser grids and updates the configuration object.
+
+        Parameters:
+        -----------
+        fine_grid: xarray.DataArray
+            Any map in the fine grid
+        coarse_grid: xarray.DataArray or list of xarray.DataArray
+            Any map in the coarse grid, or in the grid of every coarse target
+        """
+
+        # resolution of the finer grid
+        cellsize = np.mean(np.diff(fine_grid.x)) # degrees
+        cellsize_arcsec = int(np.round(cellsize * 3600, 0)) # arcsec
+        logger.info(f'The resolution of the finer grid is {cellsize_arcsec} arcseconds')
+        self.fine_resolution = f'{cellsize_arcsec}sec'
+
+        # resolution of the input maps
+        self.coarse_resolutions = []
+        for grid in coarse_grid if isinstance(coarse_grid, list) else [coarse_grid]:
+            cellsize = np.round(np.mean(np.diff(grid.x)), 6) # degrees
+            cellsize_arcmin = int(np.round(cellsize * 60, 0)) # arcmin
+            logger.info(f'The resolution of the coarser grid is {cellsize_arcmin} arcminutes')
+            self.coarse_resolutions.append(f'{cellsize_arcmin}min')
+        if len(set(self.coarse_resolutions)) < len(self.coarse_resolutions):
+            # the outputs of every target are named after its resolution
+            raise ValueError(f'The coarse targets must have different resolutions: {self.coarse_resolutions}')
+        self.coarse_resolution = self.coarse_resolutions[0]
+
+    def target(self, index: int) -> 'Config':
+        """
+        Configuration of one of the coarse targets. It is a copy of this one,
+        sharing the writer and the caches, with the coarse maps and resolution
+        of the target.
+
+        Parameters:
+        -----------
+        index: int
+            Position of the target in "coarse_targets".
+        """
+
+        cfg = copy.copy(self)
+        cfg.ldd_coarse = self.coarse_targets[index]['ldd_coarse']
+        cfg.upstream_coarse = self.coarse_targets[index]['upstream_coarse']
+        if self.coarse_resolutions:
+            cfg.coarse_resolution = self.coarse_resolutions[index]
+        return cfg
@@ -0,0 +1,500 @@
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+import xarray as xr
+import pyflwdir
+from affine import Affine
+from scipy import ndimage
+
+from lisfloodpreprocessing.profiling import step
+from lisfloodpreprocessing.utils import catchment_extent, pixel_indices, touches_edge
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+# offset (rows, columns) of the downstream pixel for every code of a PCRaster LDD map
+LDD_OFFSETS = {
+    1: (1, -1), 2: (1, 0), 3: (1, 1),
+    4: (0, -1), 6: (0, 1),
+    7: (-1, -1), 8: (-1, 0), 9: (-1, 1),
+}
+
+
+def flwdir_arrays(fdir: pyflwdir.FlwdirRaster) -> Dict[str, np.ndarray]:
+    """
+    Extracts the arrays that define a river network, so that it can be rebuilt
+    with `flwdir_from_arrays` without parsing the LDD map again.
+
+    Parameters:
+    -----------
+    fdir: pyflwdir.FlwdirRaster
+        River network.
+
+    Returns:
+    --------
+    Dict[str, numpy.ndarray]
+        Linear indices of the downstream cell ('idxs_ds'), the pits ('idxs_pit'),
+        the outlets ('idxs_outlet') and the cells ordered from down- to upstream ('idxs_seq').
+    """
+
+    return {
+        'idxs_ds': fdir.idxs_ds,
+        'idxs_pit': fdir.idxs_pit,
+        'idxs_outlet': fdir.idxs_outlet,
+        'idxs_seq': fdir.idxs_seq,
+    }
+
+
+def flwdir_from_arrays(
+    arrays: Dict[str, np.ndarray],
+    shape: Tuple[int, int],
+    ftype: str,
+    transform: Affine,
+    latlon: bool = True
+) -> pyflwdir.FlwdirRaster:
+    """
+    Rebuilds a river network from the arrays extracted with `flwdir_arrays`.
+    The arrays are not copied, so they can be memory maps or shared memory.
+
+    Parameters:
+    -----------
+    arrays: dictionary
+        Arrays 'idxs_ds', 'idxs_pit', 'idxs_outlet' and 'idxs_seq'.
+    shape: tuple
+        Shape of the map.
+    ftype: str
+        Type of flow direction map, e.g., 'd8' or 'ldd'.
+    transform: affine.Affine
+        Affine transform of the map.
+    latlon: bool, optional
+        Whether the coordinate reference system is geographic.
+
+    Returns:
+    --------
+    pyflwdir.FlwdirRaster
+        River network.
+    """
+
+    return pyflwdir.FlwdirRaster(
+        idxs_ds=arrays['idxs_ds'],
+        shape=shape,
+        ftype=ftype,
+        idxs_pit=arrays['idxs_pit'],
+        idxs_outlet=arrays['idxs_outlet'],
+        idxs_seq=arrays['idxs_seq'],
+        nnodes=arrays['idxs_seq'].size,
+        transform=transform,
+        latlon=latlon
+    )
+
+
+class NestedCatchments:
+    """
+    Delineates the catchments of a set of outlets with a single traversal of the
+    river network.
+
+    Every cell is labelled with the first outlet downstream of it (subbasins), and
+    the outlets are arranged in a nesting tree in which the parent of an outlet is
+    the first outlet downstream of it. The complete catchment of an outlet is the
+    union of its own subbasin and the subbasins of all the outlets upstream of it.
+    """
+
+    def __init__(
+        self,
+        fdir: pyflwdir.FlwdirRaster,
+        idxs: np.ndarray
+    ):
+        """
+        Parameters:
+        -----------
+        fdir: pyflwdir.FlwdirRaster
+            River network.
+        idxs: numpy.ndarray
+            Linear indices of the outlets. Repeated outlets share the same catchment.
+        """
+
+        self.shape = fdir.shape
+        self.transform = fdir.transform
+
+        # unique outlets, labelled from 1
+        outlets, self.inverse = np.unique(np.asarray(idxs), return_inverse=True)
+        ids = np.arange(1, len(outlets) + 1, dtype=np.uint32)
+
+        # map of subbasins in a single pass
+        logger.debug(f'Delineating the subbasins of {len(outlets)} outlets')
+        self.subbasins = fdir.basins(idxs=outlets, ids=ids)
+
+        # nesting tree: first outlet downstream of every outlet
+        idxs_ds = fdir.idxs_ds[outlets]
+        parents = np.where(idxs_ds != outlets, self.subbasins.flat[idxs_ds], 0)
+        self.children: Dict[int, List[int]] = {i: [] for i in range(1, len(outlets) + 1)}
+        for i, parent in enumerate(parents, start=1):
+            if parent > 0:
+                self.children[int(parent)].append(i)
+
+        # bounding box of every subbasin
+        self.slices = ndimage.find_objects(self.subbasins, max_label=len(outlets))
+
+        # subbasins that reach the edge of the map
+        edges = np.concatenate([
+            self.subbasins[0, :], self.subbasins[-1, :], self.subbasins[:, 0], self.subbasins[:, -1]
+        ])
+        self.edge_ids = {int(i) for i in np.unique(edges)} - {0}
+
+    def upstream_ids(self, i: int) -> List[int]:
+        """
+        Labels of the subbasins that compose the catchment of the outlet labelled "i".
+        """
+
+        ids, stack = [], [i]
+        while stack:
+            j = stack.pop()
+            ids.append(j)
+            stack.extend(self.children[j])
+
+        return ids
+
+    def catchment(self, k: int) -> Tuple[np.ndarray, Affine, bool]:
+        """
+        Boolean map of the catchment of an outlet, cropped to its bounding box.
+
+        Parameters:
+        -----------
+        k: int
+            Position of the outlet in the "idxs" array used to create the object.
+
+        Returns:
+        --------
+        Tuple[numpy.ndarray, affine.Affine, bool]
+            A tuple containing:
+            - The boolean map of the catchment in its bounding box.
+            - The affine transform of the bounding box.
+            - Whether the catchment reaches the edge of the map.
+        """
+
+        ids = self.upstream_ids(int(self.inverse[k]) + 1)
+
+        # bounding box of the union of the subbasins
+        slices = [self.slices[i - 1] for i in ids if self.slices[i - 1] is not None]
+        row_min = min(s[0].start for s in slices)
+        row_max = max(s[0].stop for s in slices)
+        col_min = min(s[1].start for s in slices)
+        col_max = max(s[1].stop for s in slices)
+
+        mask = np.isin(self.subbasins[row_min:row_max, col_min:col_max], ids)
+        transform = self.transform * Affine.translation(col_min, row_min)
+        edge = not self.edge_ids.isdisjoint(ids)
+
+        return mask, transform, edge
+
+
+class GridNetwork:
+    """
+    River network of the complete map, with the same interface as `CroppedNetwork`.
+    """
+
+    def __init__(self, fdir: pyflwdir.FlwdirRaster):
+        """
+        Parameters:
+        -----------
+        fdir: pyflwdir.FlwdirRaster
+            River network.
+        """
+
+        self.fdir = fdir
+
+    def basin(self, x: float, y: float) -> Tuple[np.ndarray, Affine, bool]:
+        """
+        Boolean map of the catchment of a point.
+
+        Parameters:
+        -----------
+        x: float
+            Longitude of the outlet.
+        y: float
+            Latitude of the outlet.
+
+        Returns:
+        --------
+        Tuple[numpy.ndarray, affine.Affine, bool]
+            A tuple containing:
+            - The boolean map of the catchment.
+            - The affine transform of the map.
+            - Whether the catchment reaches the edge of the map.
+        """
+
+        mask = self.fdir.basins(xy=(x, y)) > 0
+
+        return mask, self.fdir.transform, touches_edge(mask)
+
+
+class CroppedNetwork:
+    """
+    River network built on a window of the LDD map around a point instead of the
+    complete map. The window is initially the bounding box estimated from the
+    catchment area, and it is grown until the catchments delineated on it do not
+    touch the edges of the window.
+    """
+
+    def __init__(
+        self,
+        ldd: xr.DataArray,
+        ftype: str,
+        lat: float,
+        lon: float,
+        area: float,
+        factor: float = 3,
+        buffer: int = 0
+    ):
+        """
+        Parameters:
+        -----------
+        ldd: xarray.DataArray
+            Map of local drainage directions.
+        ftype: str
+            Type of flow direction map passed to `pyflwdir.from_array`, e.g., 'd8' or 'ldd'.
+        lat: float
+            Latitude of the point around which the window is centred.
+        lon: float
+            Longitude of the point around which the window is centred.
+        area: float
+            Catchment area (km2) used to estimate the size of the window.
+        factor: float, optional
+            Multiplier of the square root of the area to obtain the half side of the window.
+        buffer: int, optional
+            Minimum half side of the window (pixels).
+        """
+
+        self.ldd = ldd
+        self.ftype = ftype
+        self.shape = ldd.shape
+        self.transform = ldd.rio.transform()
+
+        # initial window in pixels
+        lon_min, lat_min, lon_max, lat_max = catchment_extent(lat, lon, area, factor=factor)
+        rows, cols = pixel_indices(ldd, [lat], [lon])
+        self.centre = rows[0], cols[0]
+        self.half_rows = max(int(np.ceil((lat_max - lat) / abs(self.transform.e))), buffer, 1)
+        self.half_cols = max(int(np.ceil((lon_max - lon) / abs(self.transform.a))), buffer, 1)
+        self.fdir = None
+
+    def _build(self):
+        """Builds the river network in the current window."""
+
+        row, col = self.centre
+        self.row_min = max(row - self.half_rows, 0)
+        self.row_max = min(row + self.half_rows + 1, self.shape[0])
+        self.col_min = max(col - self.half_cols, 0)
+        self.col_max = min(col + self.half_cols + 1, self.shape[1])
+        with step('network'):
+            window = self.ldd.variable[self.row_min:self.row_max, self.col_min:self.col_max].values
+            self.fdir = pyflwdir.from_array(
+                window,
+                ftype=self.ftype,
+                transform=self.transform * Affine.translation(self.col_min, self.row_min),
+                check_ftype=False,
+                latlon=True
+            )
+        logger.debug('River network built on a window of {0} x {1} pixels'.format(*window.shape))
+
+    @property
+    def is_full(self) -> bool:
+        """Whether the window covers the complete map."""
+
+        return (self.row_min == 0) and (self.col_min == 0) and \
+            (self.row_max == self.shape[0]) and (self.col_max == self.shape[1])
+
+    def basin(self, x: float, y: float) -> Tuple[np.ndarray, Affine, bool]:
+        """
+        Boolean map of the catchment of a point. The window is doubled until the
+        catchment does not reach an edge of the window that is not an edge of the map.
+
+        Parameters:
+        -----------
+        x: float
+            Longitude of the outlet.
+        y: float
+            Latitude of the outlet.
+
+        Returns:
+        --------
+        Tuple[numpy.ndarray, affine.Affine, bool]
+            A tuple containing:
+            - The boolean map of the catchment in the window.
+            - The affine transform of the window.
+            - Whether the catchment reaches the edge of the map.
+        """
+
+        if self.fdir is None:
+            self._build()
+        while True:
+            mask = self.fdir.basins(xy=(x, y)) > 0
+
+            # edges of the window that are not edges of the map
+            edges = [
+                (self.row_min > 0) and mask[0, :].any(),
+                (self.row_max < self.shape[0]) and mask[-1, :].any(),
+                (self.col_min > 0) and mask[:, 0].any(),
+                (self.col_max < self.shape[1]) and mask[:, -1].any()
+            ]
+            if not any(edges) or self.is_full:
+                return mask, self.fdir.transform, touches_edge(mask)
+
+            # grow the window and rebuild the network
+            self.half_rows *= 2
+            self.half_cols *= 2
+            self._build()
+
+
+class BasinCache:
+    """
+    Catchments already delineated in a grid, keyed by the pixel of their outlet
+    and cropped to their bounding box. Neighbouring points often share candidate
+    pixels, so their catchments are traced only once per run. The least recently
+    used catchments are discarded when the cache exceeds its size.
+    """
+
+    def __init__(self, max_bytes: int = 2**28):
+        """
+        Parameters:
+        -----------
+        max_bytes: int, optional
+            Maximum size of the cached maps (bytes).
+        """
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._basins: OrderedDict = OrderedDict()
+
+    def basin(
+        self,
+        network,
+        row: int,
+        col: int,
+        x: float,
+        y: float
+    ) -> Tuple[np.ndarray, Affine, bool]:
+        """
+        Boolean map of the catchment of a pixel, delineated with "network" only
+        if it is not in the cache.
+
+        Parameters:
+        -----------
+        network: GridNetwork or CroppedNetwork
+            River network used to delineate the catchment.
+        row: int
+            Row of the outlet in the complete map.
+        col: int
+            Column of the outlet in the complete map.
+        x: float
+            Longitude of the outlet.
+        y: float
+            Latitude of the outlet.
+
+        Returns:
+        --------
+        Tuple[numpy.ndarray, affine.Affine, bool]
+            A tuple containing:
+            - The boolean map of the catchment in its bounding box.
+            - The affine transform of the bounding box.
+            - Whether the catchment reaches the edge of the map.
+        """
+
+        key = (row, col)
+        if key in self._basins:
+            self._basins.move_to_end(key)
+            return self._basins[key]
+
+        with step('basins'):
+            mask, transform, edge = network.basin(x, y)
+
+        # crop to the bounding box
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if rows.size > 0:
+            mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1].copy()
+            transform = transform * Affine.translation(cols[0], rows[0])
+        mask.flags.writeable = False
+
+        self._basins[key] = mask, transform, edge
+        self.nbytes += mask.nbytes
+        while self.nbytes > self.max_bytes and len(self._basins) > 1:
+            _, (old, _, _) = self._basins.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+        return mask, transform, edge
+
+
+def flow_path(
+    ldd: xr.DataArray,
+    upstream: xr.DataArray,
+    row: int,
+    col: int,
+    max_steps: int = 10
+) -> Tuple[List[Tuple[int, int, float]], List[Tuple[int, int, float]]]:
+    """
+    Pixels of the river channel downstream and upstream of a pixel in a PCRaster
+    LDD map. Upstream, the path follows the tributary with the largest upstream area.
+
+    Parameters:
+    -----------
+    ldd: xarray.DataArray
+        Map of local drainage directions (PCRaster codes 1-9).
+    upstream: xarray.DataArray
+        Map of upstream area in the same grid.
+    row: int
+        Row of the starting pixel.
+    col: int
+        Column of the starting pixel.
+    max_steps: int, optional
+        Maximum number of pixels in each direction.
+
+    Returns:
+    --------
+    Tuple[List[Tuple[int, int, float]], List[Tuple[int, int, float]]]
+        The row, column and upstream area of the pixels downstream and upstream,
+        ordered from the closest to the farthest from the starting pixel.
+    """
+
+    # window that contains any path from the starting pixel
+    r0, c0 = max(row - max_steps, 0), max(col - max_steps, 0)
+    r1, c1 = min(row + max_steps + 1, ldd.shape[0]), min(col + max_steps + 1, ldd.shape[1])
+    ldd_window = ldd.variable[r0:r1, c0:c1].values
+    upstream_window = upstream.variable[r0:r1, c0:c1].values
+
+    def inside(r, c):
+        return (0 <= r < ldd_window.shape[0]) and (0 <= c < ldd_window.shape[1])
+
+    def code(r, c):
+        value = ldd_window[r, c]
+        return int(value) if np.isfinite(value) else 0
+
+    # downstream: follow the flow directions until a pit or the edge of the window
+    downstream = []
+    r, c = row - r0, col - c0
+    for _ in range(max_steps):
+        if code(r, c) not in LDD_OFFSETS:
+            break
+        dr, dc = LDD_OFFSETS[code(r, c)]
+        r, c = r + dr, c + dc
+        if not inside(r, c):
+            break
+        downstream.append((r + r0, c + c0, float(upstream_window[r, c])))
+
+    # upstream: follow the neighbour draining into the pixel with the largest upstream area
+    upstream_path = []
+    r, c = row - r0, col - c0
+    for _ in range(max_steps):
+        inflows = [
+            (r - dr, c - dc) for dr, dc in LDD_OFFSETS.values()
+            if inside(r - dr, c - dc) and LDD_OFFSETS.get(code(r - dr, c - dc)) == (dr, dc)
+        ]
+        if not inflows:
+            break
+        r, c = max(inflows, key=lambda rc: np.nan_to_num(upstream_window[rc], nan=-np.inf))
+        upstream_path.append((r + r0, c + c0, float(upstream_window[r, c])))
+
+    return downstream, upstream_path
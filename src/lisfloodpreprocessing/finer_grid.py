@@ -1,16 +1,21 @@
 import logging
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple, Union
 import warnings
 
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-import xarray as xr
 import pyflwdir
-from tqdm import tqdm
+import xarray as xr
+from pyproj.crs import CRS
 
 from lisfloodpreprocessing import Config
-from lisfloodpreprocessing.utils import find_pixel, catchment_polygon
+from lisfloodpreprocessing.cache import file_fingerprint, flow_network, point_keys
+from lisfloodpreprocessing.delineation import NestedCatchments, CroppedNetwork, GridNetwork
+from lisfloodpreprocessing.parallel import run_tasks
+from lisfloodpreprocessing.profiling import stage, step
+from lisfloodpreprocessing.tiles import TILE_SIZE
+from lisfloodpreprocessing.utils import RESOLVE_SCHEDULE, SEARCH_SCHEDULE, search_pixels, pixel_indices, catchment_polygon, simplify_catchments
 
 warnings.filterwarnings("ignore")
 
@@ -23,7 +28,8 @@ def coordinates_fine(
     points: pd.DataFrame,
     ldd_fine: xr.DataArray,
     upstream_fine: xr.DataArray,
-    save: bool = False
+    save: bool = False,
+    fdir_fine: Optional[pyflwdir.FlwdirRaster] = None
 ) -> Optional[Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]]:
     """
     Processes point coordinates to find the most accurate pixel in a high-resolution
@@ -41,7 +47,9 @@ def coordinates_fine(
     upstream_fine : xr.DataArray
         Map of upstream area (km2) in the fine grid.
     save : bool, optional
-        If True, the updated table of points and catchments are exported.
+        If True, the updated table of points and catchments are exported in the output format of the configuration.
+    fdir_fine : pyflwdir.FlwdirRaster, optional
+        River network of "ldd_fine", if already built. Otherwise, it is built from "ldd_fine".
 
     Returns
     -------
@@ -52,70 +60,53 @@ def coordinates_fine(
         Returns None if no polygons are generated.
     """
     
-    # add columns to the table of points
-    points_fine = points.copy()
-    n_points = points.shape[0]
     cols = ['lat', 'lon', 'area']
-    new_cols = sorted([f'{col}_{cfg.fine_resolution}' for col in cols])
-    points_fine[new_cols] = np.nan
-
-    # create river network
-    fdir_fine = pyflwdir.from_array(
-        ldd_fine.data,
-        ftype='d8',
-        transform=ldd_fine.rio.transform(),
-        check_ftype=False,
-        latlon=True
-    )
     
-    polygons_fine = []
-    for point_id, attrs in tqdm(points.iterrows(), total=n_points, desc='points'):    
-        try:
-            # reference coordinates and upstream area
-            lat_ref, lon_ref, area_ref = attrs[cols]
-
-            # search new coordinates in an increasing range
-            ranges = [55, 101, 151]
-            penalties = [500, 500, 1000]
-            factors = [2, 0.5, 0.25]
-            acceptable_errors = [50, 80, np.nan]
-            for range_xy, penalty, factor, max_error in zip(ranges, penalties, factors, acceptable_errors):
-                logger.debug(f'Set range to {range_xy}')
-                lat, lon, error = find_pixel(upstream_fine, lat_ref, lon_ref, area_ref, range_xy=range_xy, penalty=penalty, factor=factor)
-                if error <= max_error:
-                    break
-
-            # update new columns in 'points_fine'
-            points_fine.loc[point_id, new_cols] = [int(upstream_fine.sel(y=lat, x=lon).item()), round(lat, 6), round(lon, 6)]
-
-            # boolean map of the catchment
-            basin_arr = fdir_fine.basins(xy=(lon, lat)).astype(np.int32)
-
-            # vectorize the boolean map into geopandas
-            basin_gdf = catchment_polygon(
-                basin_arr.astype(np.int32),
-                transform=ldd_fine.rio.transform(),
-                crs=ldd_fine.rio.crs,
-                name='ID'
-            )
-            basin_gdf['ID'] = point_id
-            basin_gdf[cols] = attrs[cols].values
-            basin_gdf.set_index('ID', inplace=True)
-
-            # save polygon
-            polygons_fine.append(basin_gdf)
-
-            # logger.info(f'Point {point_id} located in the finer grid')
-        except Exception as e:
-            logger.error(f'Point {point_id} could not be located in the finer grid: {e}')
-
+    # reuse the results of the points that did not change since the last run. The
+    # window of the grid depends on all the points, so it is part of the key
+    if cfg.incremental:
+        keys = point_keys(
+            points[cols],
+            SEARCH_SCHEDULE,
+            cfg.windowed,
+            np.round(ldd_fine.rio.bounds(), 6).tolist(),
+            cfg.delineation,
+            cfg.extent_factor,
+            file_fingerprint(cfg.ldd_fine),
+            file_fingerprint(cfg.upstream_fine)
+        )
+        points_cached, polygons_cached = cfg.results.load(f'fine_{cfg.fine_resolution}', keys)
+        logger.info(f'{len(points_cached)} points reused from the previous run in the finer grid')
+    else:
+        points_cached, polygons_cached = pd.DataFrame(), gpd.GeoDataFrame()
+    points_new = points.drop(points_cached.index)
+    
+    # locate the new points
+    if len(points_new) > 0:
+        points_fine, polygons_fine = locate_fine(cfg, points_new, ldd_fine, upstream_fine, fdir_fine=fdir_fine)
+    else:
+        points_fine, polygons_fine = pd.DataFrame(), gpd.GeoDataFrame()
+    
+    # merge with the results of the previous run
+    if cfg.incremental:
+        # no polygons at all if every point failed and none was reused
+        frames = [df for df in [points_fine, points_cached] if not df.empty]
+        points_fine = pd.concat(frames).loc[points.index] if frames else pd.DataFrame()
+        frames = [gdf for gdf in [polygons_fine, polygons_cached] if not gdf.empty]
+        polygons_fine = pd.concat(frames) if frames else gpd.GeoDataFrame()
+        polygons_fine = polygons_fine.loc[points.index.intersection(polygons_fine.index)]
+        cfg.results.save(f'fine_{cfg.fine_resolution}', keys, points_fine, polygons_fine)
+    
     # handle case where no polygons were generated
-    if not polygons_fine:
+    if polygons_fine.empty:
         logger.warning('No points could be located in the finer grid. Returning empty dataframes.')
         return gpd.GeoDataFrame(), gpd.GeoDataFrame()
-        
-    # concatenate polygons shapefile
-    polygons_fine = pd.concat(polygons_fine)
+    
+    # simplify the polygons with a tolerance in pixels
+    if cfg.simplify:
+        cellsize = np.abs(np.mean(np.diff(ldd_fine.x)))
+        with stage('simplify'):
+            polygons_fine = simplify_catchments(polygons_fine, tolerance=cfg.simplify * cellsize)
     
     # convert points to geopandas
     points_fine = gpd.GeoDataFrame(
@@ -131,13 +122,370 @@ def coordinates_fine(
     
     if save:
         # polygons
-        polygon_shp = cfg.output_folder / f'catchments_{cfg.fine_resolution}.shp'
-        polygons_fine.to_file(polygon_shp)
-        logger.info(f'Catchments in the finer grid have been exported to: {polygon_shp}')
+        layer = f'catchments_{cfg.fine_resolution}'
+        cfg.writer.write(polygons_fine, layer)
+        logger.info(f'Catchments in the finer grid are being exported to: {cfg.writer.path(layer)}')
         
         # points
-        point_shp = cfg.output_folder / f'{cfg.points.stem}_{cfg.fine_resolution}.shp'
-        points_fine.to_file(point_shp)
-        logger.info(f'The updated points table in the finer grid has been exported to: {point_shp}')
+        layer = f'{cfg.points.stem}_{cfg.fine_resolution}'
+        cfg.writer.write(points_fine, layer)
+        logger.info(f'The updated points table in the finer grid is being exported to: {cfg.writer.path(layer)}')
+        
+    return points_fine, polygons_fine
+
+
+def locate_fine(
+    cfg: Config,
+    points: pd.DataFrame,
+    ldd_fine: xr.DataArray,
+    upstream_fine: xr.DataArray,
+    schedule: List[Tuple[int, float, float, float]] = SEARCH_SCHEDULE,
+    exclude: Optional[np.ndarray] = None,
+    fdir_fine: Optional[pyflwdir.FlwdirRaster] = None
+) -> Tuple[pd.DataFrame, gpd.GeoDataFrame]:
+    """
+    Finds the most accurate pixel of every point in the fine grid and delineates
+    its catchment. It is the core of `coordinates_fine`, without reusing previous
+    results, simplifying or exporting.
+
+    Parameters
+    ----------
+    cfg : Config
+        Configuration object containing file paths and parameters.
+    points : pd.DataFrame
+        DataFrame containing reference point coordinates and upstream areas.
+    ldd_fine : xr.DataArray
+        Map of local drainage directions in the fine grid.
+    upstream_fine : xr.DataArray
+        Map of upstream area (km2) in the fine grid.
+    schedule : list of tuples, optional
+        Search passes defined by range (pixels), penalty, factor and acceptable error.
+    exclude : np.ndarray, optional
+        Linear indices of the pixels of the fine grid that cannot be selected.
+    fdir_fine : pyflwdir.FlwdirRaster, optional
+        River network of "ldd_fine", if already built.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, gpd.GeoDataFrame]
+        A tuple containing:
+        - The table of points with the coordinates and upstream area in the fine grid.
+        - A table with the catchment polygons of the points that could be located.
+    """
+    
+    # in a mosaic of tiles, process the points tile by tile so that the cached tiles are reused
+    index = points.index
+    if cfg.tiled:
+        points = points.iloc[np.lexsort((np.floor(points.lon / TILE_SIZE), np.floor(points.lat / TILE_SIZE)))]
+    
+    # add columns to the table of points
+    points_fine = points.copy()
+    cols = ['lat', 'lon', 'area']
+    new_cols = sorted([f'{col}_{cfg.fine_resolution}' for col in cols])
+    points_fine[new_cols] = np.nan
+
+    # search new coordinates in an increasing range for all the points at once
+    with stage('search'):
+        lat_new, lon_new, _ = search_pixels(
+            upstream_fine,
+            *points[cols].values.astype(float).T,
+            schedule=schedule,
+            exclude=exclude
+        )
+    
+    # update new columns in 'points_fine'
+    located = ~np.isnan(lat_new) & ~np.isnan(lon_new)
+    for point_id, lat, lon in zip(points.index[located], lat_new[located], lon_new[located]):
+        points_fine.loc[point_id, new_cols] = [int(upstream_fine.sel(y=lat, x=lon).item()), round(lat, 6), round(lon, 6)]
+    for point_id in points.index[~located]:
+        logger.error(f'Point {point_id} could not be located in the finer grid: no valid pixel was found in the search window')
+    
+    # delineate the catchments
+    polygons_fine = delineate_fine(cfg, points[located], lat_new[located], lon_new[located], ldd_fine, fdir_fine=fdir_fine)
+    
+    # restore the order of the points
+    if cfg.tiled:
+        points_fine = points_fine.loc[index]
+        if not polygons_fine.empty:
+            polygons_fine = polygons_fine.iloc[np.argsort(index.get_indexer(polygons_fine.index), kind='stable')]
+    
+    return points_fine, polygons_fine
+
+
+def delineate_fine(
+    cfg: Config,
+    points: pd.DataFrame,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    ldd_fine: xr.DataArray,
+    fdir_fine: Optional[pyflwdir.FlwdirRaster] = None
+) -> gpd.GeoDataFrame:
+    """
+    Delineates and vectorizes the catchments of a set of points in the fine grid,
+    in a pool of processes if several workers are configured.
+
+    Parameters
+    ----------
+    cfg : Config
+        Configuration object containing file paths and parameters.
+    points : pd.DataFrame
+        DataFrame containing reference point coordinates and upstream areas.
+    lat : np.ndarray
+        Latitude of the points in the fine grid.
+    lon : np.ndarray
+        Longitude of the points in the fine grid.
+    ldd_fine : xr.DataArray
+        Map of local drainage directions in the fine grid.
+    fdir_fine : pyflwdir.FlwdirRaster, optional
+        River network of "ldd_fine", if already built. It is not used with the
+        "crop" delineation, which builds the network around every point.
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        The catchment polygons of the points that could be delineated.
+    """
+    
+    cols = ['lat', 'lon', 'area']
+    
+    # river network used to delineate the catchments
+    if cfg.delineation == 'crop':
+        network = ldd_fine
+    else:
+        if fdir_fine is None:
+            with stage('network'):
+                fdir_fine = flow_network(ldd_fine, 'd8', cache=cfg.cache, source=cfg.ldd_fine)
+        if cfg.delineation == 'nested':
+            # delineate the catchments of all the points in a single pass
+            with stage('nested'):
+                network = NestedCatchments(fdir_fine, fdir_fine.index(lon, lat))
+            logger.info(f'Catchments of {len(points)} points delineated in a single pass')
+        else:
+            network = GridNetwork(fdir_fine)
+    
+    # delineate and vectorize the catchments
+    area_ref = points['area'].values
+    tasks = list(zip(range(len(points)), lat, lon, area_ref))
+    with stage('delineation'):
+        results = run_tasks(
+            catchment_fine,
+            tasks,
+            state={'network': network, 'crs': ldd_fine.rio.crs, 'extent_factor': cfg.extent_factor},
+            workers=cfg.workers,
+            priority=area_ref,
+            ids=points.index
+        )
+    
+    polygons_fine = []
+    for (point_id, attrs), result in zip(points.iterrows(), results):
+        if isinstance(result, Exception):
+            logger.error(f'Point {point_id} could not be located in the finer grid: {result}')
+            continue
+        basin_gdf, edge = result
+        if cfg.windowed and edge:
+            logger.warning(f'The catchment of point {point_id} reaches the edge of the window and may be truncated. Consider increasing "extent_factor"')
+        basin_gdf['ID'] = point_id
+        basin_gdf[cols] = attrs[cols].values
+        basin_gdf.set_index('ID', inplace=True)
+
+        # save polygon
+        polygons_fine.append(basin_gdf)
+
+    # concatenate polygons shapefile
+    if not polygons_fine:
+        return gpd.GeoDataFrame()
+    
+    return pd.concat(polygons_fine)
+
+
+def resolve_conflicts(
+    cfg: Config,
+    points_fine: gpd.GeoDataFrame,
+    polygons_fine: gpd.GeoDataFrame,
+    conflicts: gpd.GeoDataFrame,
+    ldd_fine: xr.DataArray,
+    upstream_fine: xr.DataArray,
+    save: bool = False,
+    max_iterations: int = 3,
+    fdir_fine: Optional[pyflwdir.FlwdirRaster] = None
+) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """
+    Relocates the points in conflict in the fine grid. Of every group of points
+    located in the same pixel, the point with the smallest area error keeps the
+    pixel and the rest are searched again; points with a large area error are 
+    also searched again. The search uses wider ranges and milder distance 
+    penalties (`RESOLVE_SCHEDULE`), and excludes the pixels occupied by other 
+    points, so overlapping points are assigned distinct pixels in the order of
+    their area error. A point with a large area error is only moved if the error
+    decreases. The catchments of the relocated points are delineated again.
+    Points in conflict because they are nearby ('points nearby' in `find_conflicts`)
+    already occupy distinct pixels and may be distinct stations on the same
+    river, so they are not relocated; they are reported again after resolving.
+
+    Parameters
+    ----------
+    cfg : Config
+        Configuration object containing file paths and parameters.
+    points_fine : gpd.GeoDataFrame
+        Table of points resulting from `coordinates_fine`.
+    polygons_fine : gpd.GeoDataFrame
+        Table of catchment polygons resulting from `coordinates_fine`.
+    conflicts : gpd.GeoDataFrame
+        Conflicts found by `find_conflicts` in the fine grid.
+    ldd_fine : xr.DataArray
+        Map of local drainage directions in the fine grid.
+    upstream_fine : xr.DataArray
+        Map of upstream area (km2) in the fine grid.
+    save : bool, optional
+        If True, the updated tables are exported in the output format of the configuration.
+    max_iterations : int, optional
+        Maximum number of searches. Points that are assigned the same pixel in a
+        search are searched again with that pixel excluded.
+    fdir_fine : pyflwdir.FlwdirRaster, optional
+        River network of "ldd_fine", if already built.
+
+    Returns
+    -------
+    Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]
+        The updated tables of points and catchment polygons.
+    """
+    
+    cols = ['lat', 'lon', 'area']
+    lat_col, lon_col, area_col = [f'{col}_{cfg.fine_resolution}' for col in cols]
+    points_fine = points_fine.copy()
+    
+    # overlapping points: the one with the smallest area error keeps the pixel.
+    # Nearby points are left in place: there is no pixel to free among them
+    overlap = conflicts[conflicts.conflict == 'points overlap']
+    keep = overlap.groupby([lat_col, lon_col]).pct_error.idxmin().values
+    moved = overlap.index.difference(keep)
+    large = conflicts.index[conflicts.conflict == 'large area error']
+    pending = points_fine.loc[moved.union(large).unique()].sort_values('pct_error').index
+    logger.info(f'Searching again {len(pending)} points in conflict in the finer grid')
+    
+    # pixels occupied by the points
+    located = points_fine[[lat_col, lon_col]].notnull().all(axis=1)
+    rows, cols_idx = pixel_indices(upstream_fine, points_fine.loc[located, lat_col], points_fine.loc[located, lon_col])
+    occupied = pd.Series(rows * upstream_fine.shape[1] + cols_idx, index=points_fine.index[located])
+    
+    relocated = {}
+    for _ in range(max_iterations):
+        if len(pending) == 0:
+            break
+        exclude = occupied.drop(pending, errors='ignore').values
+        lat_new, lon_new, _ = search_pixels(
+            upstream_fine,
+            *points_fine.loc[pending, cols].values.astype(float).T,
+            schedule=RESOLVE_SCHEDULE,
+            chunk_size=16,
+            exclude=exclude
+        )
+        
+        # assign the pixels in the order of area error
+        candidates = []
+        for point_id, lat, lon in zip(pending, lat_new, lon_new):
+            if np.isnan(lat) or np.isnan(lon):
+                continue
+            area = upstream_fine.sel(y=lat, x=lon).item()
+            pct_error = abs(area - points_fine.loc[point_id, 'area']) / points_fine.loc[point_id, 'area'] * 100
+            if point_id not in moved and pct_error >= points_fine.loc[point_id, 'pct_error']:
+                continue
+            candidates.append((pct_error, point_id, lat, lon, area))
+        retry = []
+        assigned = set(exclude)
+        for pct_error, point_id, lat, lon, area in sorted(candidates, key=lambda x: x[0]):
+            row, col = pixel_indices(upstream_fine, [lat], [lon])
+            idx = int(row[0] * upstream_fine.shape[1] + col[0])
+            if idx in assigned:
+                retry.append(point_id)
+                continue
+            assigned.add(idx)
+            occupied[point_id] = idx
+            relocated[point_id] = lat, lon, area
+        pending = pd.Index(retry)
+    
+    if not relocated:
+        logger.warning('None of the points in conflict could be relocated in the finer grid')
+        return points_fine, polygons_fine
+    logger.info(f'{len(relocated)} points in conflict relocated in the finer grid')
+    
+    # update the points
+    ids = pd.Index(list(relocated.keys()))
+    lat_new, lon_new, area_new = map(np.array, zip(*relocated.values()))
+    points_fine.loc[ids, [area_col, lat_col, lon_col]] = np.column_stack([area_new.astype(int), lat_new.round(6), lon_new.round(6)])
+    points_fine.loc[ids, 'geometry'] = gpd.points_from_xy(points_fine.loc[ids, lon_col], points_fine.loc[ids, lat_col])
+    points_fine['abs_error'] = abs(points_fine[area_col] - points_fine['area'])
+    points_fine['pct_error'] = points_fine.abs_error / points_fine['area'] * 100
+    
+    # delineate the catchments of the relocated points
+    polygons_new = delineate_fine(cfg, points_fine.loc[ids], lat_new, lon_new, ldd_fine, fdir_fine=fdir_fine)
+    if cfg.simplify and not polygons_new.empty:
+        cellsize = np.abs(np.mean(np.diff(ldd_fine.x)))
+        polygons_new = simplify_catchments(polygons_new, tolerance=cfg.simplify * cellsize)
+    polygons_fine = pd.concat([polygons_fine[~polygons_fine.index.isin(ids)], polygons_new])
+    polygons_fine = polygons_fine.loc[points_fine.index.intersection(polygons_fine.index)]
+    
+    if save:
+        # polygons
+        layer = f'catchments_{cfg.fine_resolution}'
+        cfg.writer.write(polygons_fine, layer)
+        logger.info(f'Catchments in the finer grid are being exported to: {cfg.writer.path(layer)}')
         
-    return points_fine, polygons_fine
\ No newline at end of file
+        # points
+        layer = f'{cfg.points.stem}_{cfg.fine_resolution}'
+        cfg.writer.write(points_fine, layer)
+        logger.info(f'The updated points table in the finer grid is being exported to: {cfg.writer.path(layer)}')
+    
+    return points_fine, polygons_fine
+
+
+def catchment_fine(
+    task: Tuple[int, float, float, float],
+    network: Union[NestedCatchments, GridNetwork, xr.DataArray],
+    crs: CRS,
+    extent_factor: float = 3
+) -> Tuple[gpd.GeoDataFrame, bool]:
+    """
+    Delineates and vectorizes the catchment of a point in the fine grid.
+
+    Parameters
+    ----------
+    task : tuple
+        Position of the point among the located points, latitude, longitude and
+        reference area (km2).
+    network : NestedCatchments, GridNetwork or xr.DataArray
+        Catchments of all the points, river network of the complete grid, or map 
+        of local drainage directions on which a network is built around the point.
+    crs : pyproj.crs.CRS
+        Coordinate reference system of the fine grid.
+    extent_factor : float, optional
+        Factor that defines the initial window around the point when "network" 
+        is a map of local drainage directions.
+
+    Returns
+    -------
+    Tuple[gpd.GeoDataFrame, bool]
+        The catchment polygon, and whether the catchment reaches the edge of the map.
+    """
+
+    k, lat, lon, area = task
+
+    # boolean map of the catchment
+    with step('basins'):
+        if isinstance(network, NestedCatchments):
+            basin_arr, transform, edge = network.catchment(k)
+        elif isinstance(network, xr.DataArray):
+            basin_arr, transform, edge = CroppedNetwork(network, 'd8', lat, lon, area, factor=extent_factor).basin(lon, lat)
+        else:
+            basin_arr, transform, edge = network.basin(lon, lat)
+
+    # vectorize the boolean map into geopandas
+    with step('catchment_polygon'):
+        basin_gdf = catchment_polygon(
+            basin_arr,
+            transform=transform,
+            crs=crs,
+            name='ID'
+        )
+
+    return basin_gdf, edge
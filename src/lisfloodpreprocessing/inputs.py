@@ -0,0 +1,215 @@
+import logging
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import xarray as xr
+import rioxarray as rxr
+
+from lisfloodpreprocessing.config import Config
+from lisfloodpreprocessing.mosaic import open_tiled
+from lisfloodpreprocessing.tiles import is_tiled
+from lisfloodpreprocessing.utils import SEARCH_SCHEDULE, catchment_extent
+
+# set logger
+logger = logging.getLogger(__name__)
+
+def read_input_files(cfg: Config) -> Dict:
+    """
+    Reads input files, updates the Config object, and returns a dictionary
+    of the loaded data.
+    
+    Parameters:
+    -----------
+    cfg: Config
+        Configuration object containing file paths and parameters.
+        
+    Returns:
+    --------
+    Dict
+        A dictionary containing the loaded data:
+        * 'points': geopandas.GeoDataFrame of input points
+        * 'ldd_fine': xarray.DataArray of local drainage directions in the fine grid
+        * 'upstream_fine': xarray.DataArray of upstream area (km2) in the fine grid
+        * 'ldd_coarse': xarray.DataArray of local drainage directions in the coarse grid
+        * 'upstream_coarse': xarray.DataArray of upstream area (m2) in the coarse grid
+        * 'coarse': list with the 'ldd_coarse' and 'upstream_coarse' of every coarse 
+          target (see `Config.coarse_targets`); the first one is also returned above
+    """
+
+    # a helper function to reduce code repetition
+    def open_raster(path):
+        """Helper to open and squeeze a raster file."""
+        return rxr.open_rasterio(path).squeeze(dim='band')
+        
+    # read upstream map with fine resolution
+    if is_tiled(cfg.upstream_fine):
+        upstream_fine = open_tiled(cfg.upstream_fine, max_bytes=cfg.tile_cache * 2**20)
+    else:
+        upstream_fine = rxr.open_rasterio(cfg.upstream_fine).squeeze(dim='band')
+    logger.info(f'Map of upstream area in the finer grid corretly read: {cfg.upstream_fine}')
+
+    # read local drainage direction map
+    if is_tiled(cfg.ldd_fine):
+        ldd_fine = open_tiled(cfg.ldd_fine, max_bytes=cfg.tile_cache * 2**20)
+    else:
+        ldd_fine = rxr.open_rasterio(cfg.ldd_fine).squeeze(dim='band')
+    logger.info(f'Map of local drainage directions in the finer grid corretly read: {cfg.ldd_fine}')
+    
+    coarse = []
+    for target in cfg.coarse_targets:
+        # read upstream area map of coarse grid
+        upstream_coarse = rxr.open_rasterio(target['upstream_coarse']).squeeze(dim='band')
+        logger.info(f'Map of upstream area in the coarser grid corretly read: {target["upstream_coarse"]}')
+
+        # read local drainage direction map
+        ldd_coarse = rxr.open_rasterio(target['ldd_coarse']).squeeze(dim='band')
+        logger.info(f'Map of local drainage directions in the coarser grid correctly read: {target["ldd_coarse"]}')
+        coarse.append({'ldd_coarse': ldd_coarse, 'upstream_coarse': upstream_coarse})
+    
+    # read points text file
+    points = pd.read_csv(cfg.points, index_col='ID')
+    points.columns = points.columns.str.lower()
+    logger.info(f'Table of points correctly read: {cfg.points}')
+    points = check_points(cfg, points, ldd_fine)
+    
+    # load only the window of the fine grid that the points need
+    if cfg.windowed and len(points) > 0:
+        bounds = points_window(cfg, points, ldd_fine)
+        ldd_fine = ldd_fine.rio.clip_box(*bounds)
+        upstream_fine = upstream_fine.rio.clip_box(*bounds)
+        logger.info('Fine grid windowed to {0} x {1} pixels around the points'.format(*ldd_fine.shape))
+    
+    # memory-map the maps from the cache
+    if cfg.cache is not None:
+        if not cfg.tiled:
+            ldd_fine = cfg.cache.raster(ldd_fine, cfg.ldd_fine)
+            upstream_fine = cfg.cache.raster(upstream_fine, cfg.upstream_fine)
+        for grids, target in zip(coarse, cfg.coarse_targets):
+            for key in ['ldd_coarse', 'upstream_coarse']:
+                grids[key] = cfg.cache.raster(grids[key], target[key])
+    
+    # convert to geopandas and export
+    points = gpd.GeoDataFrame(
+        points,
+        geometry=gpd.points_from_xy(points['lon'], points['lat']),
+        crs=coarse[0]['ldd_coarse'].rio.crs
+    )
+    if cfg.writer is not None:
+        cfg.writer.write(points, cfg.points.stem)
+        logger.info(f'The original points table is being exported to: {cfg.writer.path(cfg.points.stem)}')
+    
+    inputs = {
+        'points': points,
+        'ldd_fine': ldd_fine,
+        'upstream_fine': upstream_fine,
+        'ldd_coarse': coarse[0]['ldd_coarse'],
+        'upstream_coarse': coarse[0]['upstream_coarse'],
+        'coarse': coarse,
+    }
+    
+    # update Config
+    cfg.update_config(ldd_fine, [grids['ldd_coarse'] for grids in coarse])
+    
+    return inputs
+
+    
+def check_points(
+    cfg: Config,
+    points: pd.DataFrame,
+    ldd: xr.DataArray
+) -> pd.DataFrame:
+    """
+    Removes input points that have missing values, a small catchment area,
+    or are outside the map extent.
+    
+    Parameters:
+    -----------
+    cfg: Config
+        Configuration object.
+    points: pandas.DataFrame
+        Table of input points with fields 'lat', 'lon' and 'area' (km2)
+    ldd: xarray.DataArray
+        Map of local drainage directions
+        
+    Returns:
+    --------
+    pandas.DataFrame
+        The input table with points with conflicts removed.
+    """
+    
+    # remove points with missing values
+    mask_nan = points.isnull().any(axis=1)
+    if mask_nan.sum() > 0:
+        points = points[~mask_nan]
+        logger.warning(f'{mask_nan.sum()} points were removed because of missing values.')
+        
+    # remove points with small catchment area
+    mask_area = points['area'] < cfg.min_area
+    if mask_area.sum() > 0:
+        points = points[~mask_area]
+        logger.info(f'{mask_area.sum()} points were removed due to their small catchment area.')
+        
+    # remove points outside the input LDD map
+    lon_min, lat_min, lon_max, lat_max = np.round(ldd.rio.bounds(), 6)
+    mask_lon = (points.lon < lon_min) | (points.lon > lon_max)
+    mask_lat = (points.lat < lat_min) | (points.lat > lat_max)
+    mask_extent = mask_lon | mask_lat
+    if mask_extent.sum() > 0:
+        points = points[~mask_extent]
+        logger.info(f'{mask_extent.sum()} points were removed because they are outside the input LDD map.')
+        
+    return points
+
+
+def points_window(
+    cfg: Config,
+    points: pd.DataFrame,
+    grid: xr.DataArray
+) -> Tuple[float, float, float, float]:
+    """
+    Computes the bounding box of the fine grid needed to process a set of points,
+    i.e., the union of the search windows of every point and the maximum extent
+    of their catchments estimated from the reference area.
+    
+    Parameters:
+    -----------
+    cfg: Config
+        Configuration object.
+    points: pandas.DataFrame
+        Table of input points with fields 'lat', 'lon' and 'area' (km2)
+    grid: xarray.DataArray
+        Any map in the fine grid
+        
+    Returns:
+    --------
+    Tuple[float, float, float, float]
+        Bounding box (lon_min, lat_min, lon_max, lat_max) clipped to the extent of "grid".
+        If there are no points, the extent of "grid"
+    """
+    
+    map_lon_min, map_lat_min, map_lon_max, map_lat_max = grid.rio.bounds()
+    if len(points) == 0:
+        return map_lon_min, map_lat_min, map_lon_max, map_lat_max
+    
+    # buffer of the largest search window
+    cellsize = np.abs(np.mean(np.diff(grid.x)))
+    range_xy = max(schedule[0] for schedule in SEARCH_SCHEDULE)
+    buffer = (range_xy + 1) * cellsize
+    
+    # union of the extent of all the catchments
+    extents = np.array([
+        catchment_extent(lat, lon, area, factor=cfg.extent_factor, buffer=buffer)
+        for lat, lon, area in points[['lat', 'lon', 'area']].itertuples(index=False)
+    ])
+    lon_min, lat_min = extents[:, :2].min(axis=0)
+    lon_max, lat_max = extents[:, 2:].max(axis=0)
+    
+    # clip to the extent of the map
+    return (
+        max(lon_min, map_lon_min),
+        max(lat_min, map_lat_min),
+        min(lon_max, map_lon_max),
+        min(lat_max, map_lat_max)
+    )
@@ -3,10 +3,9 @@ import argparse
 import logging
 from datetime import datetime
 
-from lisfloodpreprocessing import Config, read_input_files
-from lisfloodpreprocessing.utils import find_conflicts
-from lisfloodpreprocessing.finer_grid import coordinates_fine
-from lisfloodpreprocessing.coarser_grid import coordinates_coarse
+# the stages, which depend on the scientific stack, are imported once the
+# arguments and the configuration are checked
+from lisfloodpreprocessing.config import Config
 
 logging.getLogger('pyogrio').propagate = False
 
@@ -29,6 +28,22 @@ def main():
         '-c', '--config-file', type=str, required=True, 
         help='Path to the configuration file'
     )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=None,
+        help='Number of parallel processes. It overrides the value in the configuration file'
+    )
+    parser.add_argument(
+        '-m', '--memory-budget', type=float, default=None,
+        help='Maximum memory (MB) of the run. It overrides the value in the configuration file'
+    )
+    parser.add_argument(
+        '-p', '--profile', action='store_true',
+        help='Record the time and memory of every stage and point in the output folder'
+    )
+    parser.add_argument(
+        '--profile-log', action='store_true',
+        help='Log every record of the profile as a line of JSON. It implies --profile'
+    )
     args = parser.parse_args()
 
     # create the root logger
@@ -55,6 +70,7 @@ def main():
 
     # main script logic
     success = False
+    profiler = None
 
     try:
         logger.info('Starting coordinate correction process...')
@@ -62,51 +78,134 @@ def main():
         # read configuration
         logger.info(f"Reading configuration from {args.config_file}")
         cfg = Config(args.config_file)
+        if args.workers is not None:
+            cfg.workers = args.workers
+        if args.memory_budget is not None:
+            cfg.memory_budget = args.memory_budget
+        cfg.profile = cfg.profile or args.profile
+        cfg.profile_log = cfg.profile_log or args.profile_log
+            
+        from lisfloodpreprocessing.inputs import read_input_files
+        from lisfloodpreprocessing.cache import flow_network
+        from lisfloodpreprocessing.memory import MemoryMonitor, plan_memory
+        from lisfloodpreprocessing.profiling import Profiler, stage
+        from lisfloodpreprocessing.utils import find_conflicts
+        from lisfloodpreprocessing.finer_grid import coordinates_fine, resolve_conflicts
+        from lisfloodpreprocessing.coarser_grid import coordinates_coarse
+        
+        # record the time and memory of every stage and point
+        if cfg.profile or cfg.profile_log:
+            profiler = Profiler(cfg.output_folder, log=cfg.profile_log)
+            profiler.start()
+            
+        # estimate the memory of the run and select a strategy that fits in the budget.
+        # Without budget, only the measured peaks are logged: planning opens the inputs twice
+        if cfg.memory_budget is not None:
+            logger.info('Estimating the memory requirements...')
+            with stage('memory_plan'):
+                monitor = MemoryMonitor(plan_memory(cfg, budget=cfg.memory_budget))
+        else:
+            monitor = MemoryMonitor()
     
         # read input files
         logger.info('Reading input files...')
-        inputs = read_input_files(cfg)      
+        with monitor('inputs'), stage('read_input_files'):
+            inputs = read_input_files(cfg)      
+        if inputs['points'].empty:
+            raise ValueError('None of the input points passed the checks of the input table')
     
         # find coordinates in high resolution
         logger.info('Processing points in the high-resolution grid...')
-        points_HR, polygons_HR = coordinates_fine(
-            cfg,
-            points=inputs['points'],
-            ldd_fine=inputs['ldd_fine'],
-            upstream_fine=inputs['upstream_fine'],
-            save=True
-        )
+        flowpath = cfg.conflict_flowpath and cfg.conflict_tolerance > 0
+        with monitor('fine'), stage('fine'):
+            # the river network is built once for the delineation, the conflicts and their resolution
+            if (cfg.delineation != 'crop' or flowpath) and not cfg.tiled:
+                with stage('network'):
+                    fdir_fine = flow_network(inputs['ldd_fine'], 'd8', cache=cfg.cache, source=cfg.ldd_fine)
+            else:
+                fdir_fine = None
+            points_HR, polygons_HR = coordinates_fine(
+                cfg,
+                points=inputs['points'],
+                ldd_fine=inputs['ldd_fine'],
+                upstream_fine=inputs['upstream_fine'],
+                save=True,
+                fdir_fine=fdir_fine
+            )
     
         # find conflicts in high resolution
         logger.info('Finding conflicts in the high-resolution grid...')
-        conflicts_fine = find_conflicts(
-            points_HR,
-            resolution=cfg.fine_resolution,
-            pct_error=cfg.pct_error,
-            save=cfg.output_folder / f'conflicts_{cfg.fine_resolution}.shp'
-        )
-        if conflicts_fine is not None:
+        with stage('conflicts_fine'):
+            conflicts_fine = find_conflicts(
+                points_HR,
+                resolution=cfg.fine_resolution,
+                pct_error=cfg.pct_error,
+                tolerance=cfg.conflict_tolerance,
+                fdir=fdir_fine if flowpath else None
+            )
+        if cfg.conflict_resolve and not conflicts_fine.empty:
+            logger.info('Resolving conflicts in the high-resolution grid...')
+            with stage('resolve'):
+                points_HR, polygons_HR = resolve_conflicts(
+                    cfg,
+                    points_HR,
+                    polygons_HR,
+                    conflicts_fine,
+                    ldd_fine=inputs['ldd_fine'],
+                    upstream_fine=inputs['upstream_fine'],
+                    save=True,
+                    fdir_fine=fdir_fine
+                )
+                conflicts_fine = find_conflicts(
+                    points_HR,
+                    resolution=cfg.fine_resolution,
+                    pct_error=cfg.pct_error,
+                    tolerance=cfg.conflict_tolerance,
+                    fdir=fdir_fine if flowpath else None
+                )
+        if not conflicts_fine.empty:
+            cfg.writer.write(conflicts_fine, f'conflicts_{cfg.fine_resolution}')
             points_HR.drop(conflicts_fine.index, axis=0, inplace=True)
     
-        # find coordinates in LISFLOOD
-        logger.info('Processing points in the LISFLOOD grid...')
-        points_LR, polygons_LR = coordinates_coarse(
-            cfg,
-            points_fine=points_HR,
-            polygons_fine=polygons_HR,
-            ldd_coarse=inputs['ldd_coarse'],
-            upstream_coarse=inputs['upstream_coarse'],
-            save=True
-        )
-    
-        # find conflicts in LISFLOOD
-        logger.info('Finding conflicts in the LISFLOOD grid...')
-        conflicts_coarse = find_conflicts(
-            points_LR,
-            resolution=cfg.coarse_resolution,
-            pct_error=cfg.pct_error,
-            save=cfg.output_folder / f'conflicts_{cfg.coarse_resolution}.shp'
-        )
+        # find coordinates in LISFLOOD, for every coarse target
+        for i, grids in enumerate(inputs['coarse']):
+            cfg_target = cfg.target(i)
+            name = 'coarse' if len(inputs['coarse']) == 1 else f'coarse_{cfg_target.coarse_resolution}'
+            logger.info(f'Processing points in the LISFLOOD grid ({cfg_target.coarse_resolution})...')
+            with monitor('coarse'), stage(name):
+                # the river network is built once for the matching and the conflicts
+                if cfg.delineation != 'crop' or flowpath:
+                    with stage('network'):
+                        fdir_coarse = flow_network(grids['ldd_coarse'], 'ldd', cache=cfg.cache, source=cfg_target.ldd_coarse)
+                else:
+                    fdir_coarse = None
+                points_LR, polygons_LR = coordinates_coarse(
+                    cfg_target,
+                    points_fine=points_HR,
+                    polygons_fine=polygons_HR,
+                    ldd_coarse=grids['ldd_coarse'],
+                    upstream_coarse=grids['upstream_coarse'],
+                    save=True,
+                    fdir_coarse=fdir_coarse
+                )
+        
+            # find conflicts in LISFLOOD
+            logger.info(f'Finding conflicts in the LISFLOOD grid ({cfg_target.coarse_resolution})...')
+            with stage(f'conflicts_{name}'):
+                conflicts_coarse = find_conflicts(
+                    points_LR,
+                    resolution=cfg_target.coarse_resolution,
+                    pct_error=cfg.pct_error,
+                    tolerance=cfg.conflict_tolerance,
+                    fdir=fdir_coarse if flowpath else None
+                )
+            if not conflicts_coarse.empty:
+                cfg.writer.write(conflicts_coarse, f'conflicts_{cfg_target.coarse_resolution}')
+
+        # wait for the outputs to be written
+        with stage('wait_outputs'):
+            if not cfg.writer.close():
+                raise OSError('Some outputs could not be written')
 
         logger.info('Process completed successfully')
         success = True
@@ -118,6 +217,14 @@ def main():
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
         
+    # export the profile, even if the run failed
+    if profiler is not None:
+        profiler.stop()
+        try:
+            profiler.save()
+        except OSError as e:
+            logger.error(f"The profile could not be exported: {e}")
+        
     if not success:
         sys.exit(1)
 
@@ -0,0 +1,278 @@
+import copy
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+import pandas as pd
+import xarray as xr
+import rioxarray as rxr
+
+from lisfloodpreprocessing.config import Config
+from lisfloodpreprocessing.inputs import points_window
+from lisfloodpreprocessing.mosaic import open_tiled
+from lisfloodpreprocessing.profiling import peak_rss, track_peak
+from lisfloodpreprocessing.tiles import is_tiled
+from lisfloodpreprocessing.utils import catchment_extent
+
+# set logger
+logger = logging.getLogger(__name__)
+
+# resident memory of the interpreter and the scientific libraries (bytes)
+BASELINE_BYTES = 350 * 2**20
+# resident memory of a worker process, forked from the main one (bytes)
+WORKER_BASELINE_BYTES = 250 * 2**20
+# bytes per pixel of a river network: downstream and ordered indices (int32)
+NETWORK_BYTES = 8
+# bytes per pixel allocated temporarily by `pyflwdir` while delineating a catchment
+BASIN_BYTES = 32
+# size of the cache of catchments in the coarse grid (see `BasinCache`)
+BASIN_CACHE_BYTES = 2**28
+# times the initial window of `CroppedNetwork` is assumed to grow (doubling its sides)
+CROP_GROWTH = 4
+
+# stages of `lfcoords` whose peak memory is estimated and measured
+STAGES = ['inputs', 'fine', 'coarse']
+
+
+class MemoryMonitor:
+    """
+    Logs the measured peak memory of every stage of `lfcoords`, next to its
+    estimate if available, so that the memory planner can be checked.
+
+    Use as a context manager around each stage:
+
+        with monitor('fine'):
+            coordinates_fine(...)
+    """
+
+    def __init__(self, estimate: Optional[Dict[str, int]] = None):
+        """
+        Parameters:
+        -----------
+        estimate: dictionary, optional
+            Estimated peak memory (bytes) of every stage, as returned by `estimate_memory`.
+        """
+
+        self.estimate = estimate or {}
+        self.peaks: Dict[str, int] = {}
+
+    @contextmanager
+    def __call__(self, stage: str):
+        children = peak_rss(children=True)
+        try:
+            with track_peak() as memory:
+                yield
+        finally:
+            peak = self.peaks[stage] = memory.get('peak', 0)
+            msg = f'Peak memory of stage "{stage}": {peak / 2**20:.0f} MB'
+            if peak_rss(children=True) > children:
+                msg += f' (largest worker: {peak_rss(children=True) / 2**20:.0f} MB)'
+            if stage in self.estimate:
+                msg += f'; estimated for all the processes: {self.estimate[stage] / 2**20:.0f} MB'
+            logger.info(msg)
+
+
+def estimate_memory(
+    cfg: Config,
+    points: pd.DataFrame,
+    ldd_fine: xr.DataArray,
+    upstream_fine: xr.DataArray,
+    ldd_coarse: xr.DataArray,
+    upstream_coarse: xr.DataArray
+) -> Dict[str, int]:
+    """
+    Estimates the peak resident memory of every stage of `lfcoords` from the
+    shape and data type of the maps and the catchment area of the points,
+    without reading the values of the maps. The memory of the worker processes
+    is included.
+
+    Parameters:
+    -----------
+    cfg: Config
+        Configuration object; the estimate depends on "windowed", "delineation",
+        "workers", "cache" and "tile_cache".
+    points: pandas.DataFrame
+        Table of points with fields 'lat', 'lon' and 'area' (km2).
+    ldd_fine: xarray.DataArray
+        Lazily opened map of local drainage directions in the fine grid.
+    upstream_fine: xarray.DataArray
+        Lazily opened map of upstream area in the fine grid.
+    ldd_coarse: xarray.DataArray
+        Lazily opened map of local drainage directions in the coarse grid.
+    upstream_coarse: xarray.DataArray
+        Lazily opened map of upstream area in the coarse grid.
+
+    Returns:
+    --------
+    Dict[str, int]
+        Estimated peak memory (bytes) of the stages 'inputs', 'fine' and 'coarse'.
+    """
+
+    workers = max(cfg.workers, 1)
+    map_bytes = ldd_fine.dtype.itemsize + upstream_fine.dtype.itemsize
+
+    # pixels of the fine grid that are loaded
+    cellsize = abs(ldd_fine.rio.resolution()[0])
+    if cfg.windowed and len(points) > 0:
+        lon_min, lat_min, lon_max, lat_max = points_window(cfg, points, ldd_fine)
+        cells_fine = max(lat_max - lat_min, 0) * max(lon_max - lon_min, 0) / cellsize**2
+    else:
+        cells_fine = ldd_fine.size
+    loaded_fine = 0 if cfg.tiled else cells_fine * map_bytes
+
+    # inputs: the fine maps are only loaded if they are stored in the cache
+    inputs = BASELINE_BYTES
+    if cfg.cache is not None:
+        inputs += loaded_fine
+
+    # fine grid
+    if cfg.delineation == 'crop':
+        # largest window around a point, built in every worker at the same time
+        if len(points) > 0:
+            lat, lon, area = points.loc[points['area'].idxmax(), ['lat', 'lon', 'area']]
+            x_min, y_min, x_max, y_max = catchment_extent(lat, lon, area, factor=cfg.extent_factor)
+            cells_crop = min((x_max - x_min) * (y_max - y_min) / cellsize**2 * CROP_GROWTH, cells_fine)
+        else:
+            cells_crop = 0
+        per_task = cells_crop * (ldd_fine.dtype.itemsize + NETWORK_BYTES + BASIN_BYTES)
+        if cfg.tiled:
+            # every process keeps its own cache of tiles
+            per_task += min(cfg.tile_cache * 2**20, ldd_fine.size * map_bytes)
+        fine = BASELINE_BYTES + per_task
+        if cfg.cache is not None and not cfg.tiled and workers > 1:
+            # the LDD map loaded from the cache is copied to shared memory; otherwise,
+            # every worker reads its windows from the file
+            fine += cells_fine * ldd_fine.dtype.itemsize
+        if workers > 1:
+            fine += workers * (WORKER_BASELINE_BYTES + per_task)
+    else:
+        # the network of the complete (windowed) map is shared by the workers
+        fine = BASELINE_BYTES + loaded_fine + cells_fine * (NETWORK_BYTES + BASIN_BYTES)
+        if workers > 1:
+            fine += cells_fine * NETWORK_BYTES + workers * (WORKER_BASELINE_BYTES + cells_fine * BASIN_BYTES)
+
+    # coarse grid
+    cells_coarse = ldd_coarse.size
+    per_process = cells_coarse * BASIN_BYTES + min(BASIN_CACHE_BYTES, len(points) * cells_coarse)
+    coarse = BASELINE_BYTES + cells_coarse * (ldd_coarse.dtype.itemsize + upstream_coarse.dtype.itemsize + NETWORK_BYTES) + per_process
+    if workers > 1:
+        coarse += workers * (WORKER_BASELINE_BYTES + per_process)
+
+    return {'inputs': int(inputs), 'fine': int(fine), 'coarse': int(coarse)}
+
+
+def open_lazily(cfg: Config) -> Dict:
+    """
+    Opens the input maps without reading their values, and reads the table of
+    points without the ones that will be discarded, as needed by `estimate_memory`.
+    Of the coarse targets, only the largest grid is returned.
+    """
+
+    def open_raster(path: Path) -> xr.DataArray:
+        if is_tiled(path):
+            return open_tiled(path, max_bytes=0)
+        return rxr.open_rasterio(path).squeeze(dim='band')
+
+    inputs = {
+        'ldd_fine': open_raster(cfg.ldd_fine),
+        'upstream_fine': open_raster(cfg.upstream_fine),
+    }
+    # the coarse targets are processed one after the other: the largest sets the peak
+    coarse = [{key: open_raster(path) for key, path in target.items()} for target in cfg.coarse_targets]
+    inputs.update(max(coarse, key=lambda grids: grids['ldd_coarse'].size))
+    points = pd.read_csv(cfg.points, index_col='ID')
+    points.columns = points.columns.str.lower()
+    inputs['points'] = points[points.notnull().all(axis=1) & (points['area'] >= cfg.min_area)]
+
+    return inputs
+
+
+def plan_memory(cfg: Config, budget: Optional[float] = None) -> Dict[str, int]:
+    """
+    Estimates the peak memory of the run before reading the maps and, if a
+    budget is given, updates the configuration with the first strategy that
+    fits in it:
+
+    1. the configuration as is, e.g., the complete fine grid in memory;
+    2. reading only the window of the fine grid around the points ("windowed");
+    3. building the river network on a window around every point ("crop"),
+       with a smaller cache of tiles if the fine grid is a mosaic;
+    4. the previous strategy with fewer workers.
+
+    If no strategy fits, the one with the smallest estimate is kept.
+
+    Parameters:
+    -----------
+    cfg: Config
+        Configuration object. It is modified in place.
+    budget: float, optional
+        Maximum memory (MB) of the run, including the worker processes.
+
+    Returns:
+    --------
+    Dict[str, int]
+        Estimated peak memory (bytes) of every stage with the selected strategy.
+    """
+
+    inputs = open_lazily(cfg)
+
+    def estimate(config):
+        return estimate_memory(config, **inputs)
+
+    current = estimate(cfg)
+    if budget is None or max(current.values()) <= budget * 2**20:
+        if budget is not None:
+            logger.info(f'The configuration fits in the memory budget of {budget:.0f} MB')
+        log_estimate(current)
+        return current
+
+    # candidate strategies, from the fastest to the leanest
+    candidates = []
+    windowed = copy.copy(cfg)
+    windowed.windowed = True
+    candidates.append(('windowed', windowed))
+    crop = copy.copy(windowed)
+    crop.delineation = 'crop'
+    candidates.append(('crop', crop))
+    workers = crop.workers
+    while workers > 1:
+        workers = workers // 2
+        fewer = copy.copy(crop)
+        fewer.workers = workers
+        candidates.append((f'crop, {workers} workers', fewer))
+
+    best_name, best, best_peak = 'current', cfg, max(current.values())
+    for name, candidate in candidates:
+        if candidate.tiled:
+            # the cache of tiles takes the memory left by the rest of the run
+            candidate.tile_cache = 1
+            fixed = max(estimate(candidate).values())
+            room = int((budget * 2**20 - fixed) / 2**20)
+            candidate.tile_cache = max(1, min(cfg.tile_cache, room))
+        peak = max(estimate(candidate).values())
+        if peak < best_peak:
+            best_name, best, best_peak = name, candidate, peak
+        if peak <= budget * 2**20:
+            break
+    else:
+        logger.warning(f'No strategy fits in the memory budget of {budget:.0f} MB; the leanest is used')
+
+    if best is not cfg:
+        logger.info(f'Strategy selected to fit in the memory budget of {budget:.0f} MB: {best_name}')
+        for key in ['windowed', 'delineation', 'workers', 'tile_cache']:
+            if getattr(cfg, key) != getattr(best, key):
+                logger.info(f'"{key}" changed from {getattr(cfg, key)} to {getattr(best, key)}')
+                setattr(cfg, key, getattr(best, key))
+
+    best_estimate = estimate(cfg)
+    log_estimate(best_estimate)
+
+    return best_estimate
+
+
+def log_estimate(estimate: Dict[str, int]):
+    """Logs the estimated peak memory of every stage."""
+
+    for stage in STAGES:
+        logger.info(f'Estimated peak memory of stage "{stage}": {estimate[stage] / 2**20:.0f} MB')
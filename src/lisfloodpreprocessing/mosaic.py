@@ -0,0 +1,178 @@
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import rasterio
+import rioxarray as rxr
+from affine import Affine
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+from lisfloodpreprocessing.tiles import tile_paths
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+class TiledArray(BackendArray):
+    """
+    Lazy array of a mosaic of tiles of the same grid. Only the tiles that overlap
+    the requested window are read, and they are kept in a cache from which the
+    least recently used tiles are released when it exceeds its size.
+    """
+
+    def __init__(self, paths: List[Path], max_bytes: int = 2**31):
+        """
+        Parameters:
+        -----------
+        paths: list of pathlib.Path
+            Files of the tiles.
+        max_bytes: int, optional
+            Maximum size of the tiles kept in memory (bytes).
+        """
+
+        if len(paths) == 0:
+            raise ValueError('The tile index does not contain any tile')
+
+        # tiles metadata from the headers
+        bounds = []
+        for path in paths:
+            with rasterio.open(path) as src:
+                if not bounds:
+                    self.res = src.res
+                    self.crs = src.crs
+                    self.dtype = np.dtype(src.dtypes[0])
+                    self.nodata = src.nodata
+                elif not np.allclose(src.res, self.res):
+                    raise ValueError(f'The resolution of tile {path} differs from that of the mosaic')
+                bounds.append(src.bounds)
+        bounds = np.array(bounds)
+
+        # mosaic grid
+        lon_min, lat_max = bounds[:, 0].min(), bounds[:, 3].max()
+        self.transform = Affine(self.res[0], 0, lon_min, 0, -self.res[1], lat_max)
+        cols, rows = ~self.transform * (bounds[:, [0, 2]].T, bounds[:, [3, 1]].T)
+        offsets = np.round(np.stack([rows[0], rows[1], cols[0], cols[1]], axis=1)).astype(int)
+        self.tiles = pd.DataFrame(offsets, columns=['row_min', 'row_max', 'col_min', 'col_max'])
+        self.tiles['path'] = [str(p) for p in paths]
+        self.shape = int(offsets[:, 1].max()), int(offsets[:, 3].max())
+
+        self.max_bytes = max_bytes
+        self._init_cache()
+
+    def _init_cache(self):
+        self._cache: OrderedDict = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the cache is not sent to the worker processes
+        state = self.__dict__.copy()
+        for key in ['_cache', '_nbytes', '_lock']:
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_cache()
+
+    def _tile(self, k: int) -> np.ndarray:
+        """Values of a tile, read from disk if they are not in the cache."""
+
+        with self._lock:
+            if k in self._cache:
+                self._cache.move_to_end(k)
+                return self._cache[k]
+
+        with rasterio.open(self.tiles.path[k]) as src:
+            data = src.read(1).astype(self.dtype, copy=False)
+        logger.debug(f'Tile read: {self.tiles.path[k]}')
+
+        with self._lock:
+            self._cache[k] = data
+            self._nbytes += data.nbytes
+            while self._nbytes > self.max_bytes and len(self._cache) > 1:
+                _, old = self._cache.popitem(last=False)
+                self._nbytes -= old.nbytes
+                logger.debug('Tile released from the cache')
+
+        return data
+
+    def __getitem__(self, key: indexing.ExplicitIndexer) -> np.ndarray:
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self._getitem)
+
+    def _getitem(self, key: tuple) -> np.ndarray:
+        """Reads a window of the mosaic defined by integers and slices."""
+
+        # window of the mosaic
+        window, squeeze = [], []
+        for axis, (k, size) in enumerate(zip(key, self.shape)):
+            if isinstance(k, (int, np.integer)):
+                k = int(k) % size
+                window.append((k, k + 1))
+                squeeze.append(axis)
+            else:
+                start, stop, step = k.indices(size)
+                window.append((start, max(stop, start)))
+        (r0, r1), (c0, c1) = window
+        out = np.full((r1 - r0, c1 - c0), self.nodata if self.nodata is not None else 0, dtype=self.dtype)
+
+        # copy the overlapping part of every tile
+        tiles = self.tiles
+        overlap = (tiles.row_min < r1) & (tiles.row_max > r0) & (tiles.col_min < c1) & (tiles.col_max > c0)
+        for k, tile in tiles[overlap].iterrows():
+            data = self._tile(k)
+            tr0, tr1 = max(r0, tile.row_min), min(r1, tile.row_max)
+            tc0, tc1 = max(c0, tile.col_min), min(c1, tile.col_max)
+            out[tr0 - r0:tr1 - r0, tc0 - c0:tc1 - c0] = data[tr0 - tile.row_min:tr1 - tile.row_min, tc0 - tile.col_min:tc1 - tile.col_min]
+
+        # steps of the slices
+        steps = tuple(k.step if isinstance(k, slice) else None for k in key)
+        out = out[tuple(slice(None, None, step) for step in steps)]
+
+        return out.squeeze(axis=tuple(squeeze)) if squeeze else out
+
+
+def open_tiled(path: Union[str, Path], max_bytes: int = 2**31) -> xr.DataArray:
+    """
+    Opens a mosaic of tiles as a lazy map. Values are only read when a window of
+    the map is accessed, so the complete mosaic is never loaded in memory.
+
+    Parameters:
+    -----------
+    path: string or pathlib.Path
+        A VRT, a folder of GeoTIFF tiles, a text file listing the tiles, or a vector
+        tile index with a 'location' field.
+    max_bytes: int, optional
+        Maximum size of the tiles kept in memory (bytes). The tiles of a VRT are
+        cached by GDAL instead (see the environment variable GDAL_CACHEMAX).
+
+    Returns:
+    --------
+    xarray.DataArray
+        Lazy map with coordinates 'y' and 'x', and the attribute 'tiled'.
+    """
+
+    path = Path(path)
+    if path.suffix.lower() == '.vrt':
+        da = rxr.open_rasterio(path, cache=False).squeeze(dim='band', drop=True)
+    else:
+        array = TiledArray(tile_paths(path), max_bytes=max_bytes)
+        transform = array.transform
+        x = transform.c + (np.arange(array.shape[1]) + .5) * transform.a
+        y = transform.f + (np.arange(array.shape[0]) + .5) * transform.e
+        variable = xr.Variable(('y', 'x'), indexing.LazilyIndexedArray(array))
+        da = xr.DataArray(variable, coords={'y': y, 'x': x})
+        da = da.rio.write_crs(array.crs)
+        if array.nodata is not None:
+            da = da.rio.write_nodata(array.nodata)
+        logger.info(f'Mosaic of {len(array.tiles)} tiles of {array.shape[0]} x {array.shape[1]} pixels: {path}')
+    da.attrs['tiled'] = 1
+
+    return da
@@ -0,0 +1,143 @@
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Union
+
+from lisfloodpreprocessing.profiling import add_stage
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+# supported output formats and their file extension
+FORMATS = {
+    'shp': '.shp',
+    'gpkg': '.gpkg',
+    'parquet': '.parquet',
+}
+
+
+class OutputWriter:
+    """
+    Exports the layers produced by `lfcoords` to the output folder. Layers can be
+    written as shapefiles (legacy), GeoParquet files, or layers of a single
+    GeoPackage. Writes run in a background thread, so the next stage can start
+    while the previous outputs are being written.
+    """
+
+    def __init__(
+        self,
+        folder: Union[str, Path],
+        format: str = 'shp',
+        name: str = 'lfcoords',
+        background: bool = True
+    ):
+        """
+        Parameters:
+        -----------
+        folder: string or pathlib.Path
+            Folder where the outputs are saved.
+        format: string, optional
+            Output format: 'shp', 'gpkg' or 'parquet'.
+        name: string, optional
+            Name of the GeoPackage file. Only used if "format" is 'gpkg'.
+        background: bool, optional
+            Whether to write the outputs in a background thread.
+        """
+
+        if format not in FORMATS:
+            raise ValueError(f'Unknown output format "{format}". Select one of: {", ".join(FORMATS)}')
+        if format == 'parquet':
+            try:
+                import pyarrow
+            except ImportError:
+                raise ImportError('The GeoParquet output format requires "pyarrow": pip install pyarrow')
+
+        self.folder = Path(folder)
+        self.format = format
+        self.name = name
+        self.background = background
+        self._executor = None
+        self._futures: List[Future] = []
+
+    def path(self, layer: str) -> Path:
+        """
+        File where a layer is written.
+
+        Parameters:
+        -----------
+        layer: string
+            Name of the layer, e.g., 'catchments_3sec'.
+
+        Returns:
+        --------
+        pathlib.Path
+        """
+
+        if self.format == 'gpkg':
+            return self.folder / f'{self.name}{FORMATS[self.format]}'
+        return self.folder / f'{layer}{FORMATS[self.format]}'
+
+    def write(self, gdf: 'gpd.GeoDataFrame', layer: str):
+        """
+        Exports a layer. A copy of the table is written, so it can be modified
+        right after calling this method.
+
+        Parameters:
+        -----------
+        gdf: geopandas.GeoDataFrame
+            Table to be exported.
+        layer: string
+            Name of the layer, e.g., 'catchments_3sec'.
+        """
+
+        if not self.background:
+            self._write(gdf, layer)
+            return
+
+        if self._executor is None:
+            # a single thread keeps the writes to the same GeoPackage sequential
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer')
+        self._futures.append(self._executor.submit(self._write, gdf.copy(), layer))
+
+    def _write(self, gdf: 'gpd.GeoDataFrame', layer: str):
+        """Writes a layer in the selected format."""
+
+        wall, cpu = time.perf_counter(), time.thread_time()
+        path = self.path(layer)
+        if self.format == 'parquet':
+            gdf.to_parquet(path)
+        elif self.format == 'gpkg':
+            gdf.to_file(path, layer=layer, driver='GPKG')
+        else:
+            gdf.to_file(path)
+        add_stage(f'write/{layer}', time.perf_counter() - wall, time.thread_time() - cpu)
+        logger.info(f'Layer "{layer}" exported to: {path}')
+
+    def close(self) -> bool:
+        """
+        Waits until all the pending layers are written.
+
+        Returns:
+        --------
+        bool
+            Whether all the layers were written successfully.
+        """
+
+        success = True
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f'An output layer could not be written: {e}')
+                success = False
+        self._futures = []
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+        return success
@@ -0,0 +1,241 @@
+import copy
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import xarray as xr
+import rioxarray
+from tqdm import tqdm
+
+from lisfloodpreprocessing.delineation import GridNetwork, NestedCatchments, flwdir_arrays, flwdir_from_arrays
+from lisfloodpreprocessing.profiling import add_points, timed
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+# objects shared with the worker processes, restored by the initializer
+_STATE: Dict[str, Any] = {}
+# references to the shared memory attached by a worker process, kept alive while it runs
+_ATTACHED: List[Any] = []
+
+
+class SharedArray:
+    """
+    NumPy array stored in shared memory. When pickled, only the name of the
+    shared memory block, the shape and the data type are sent, so worker
+    processes attach to the same memory instead of receiving a copy.
+    """
+
+    def __init__(self, array: np.ndarray):
+        """
+        Copies an array into a new block of shared memory.
+
+        Parameters:
+        -----------
+        array: numpy.ndarray
+            Array to be shared.
+        """
+
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self._shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.array[...] = array
+
+    @property
+    def array(self) -> np.ndarray:
+        """View of the shared memory as a NumPy array."""
+
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'shape': self.shape, 'dtype': self.dtype}
+
+    def __setstate__(self, state):
+        self.shape = state['shape']
+        self.dtype = state['dtype']
+        self._shm = SharedMemory(name=state['name'])
+
+    def unlink(self):
+        """Releases the shared memory. Only to be called by the creating process."""
+
+        self._shm.close()
+        self._shm.unlink()
+
+
+def share(obj: Any, shared: List[SharedArray]) -> Any:
+    """
+    Creates a picklable copy of an object whose large arrays are stored in
+    shared memory. Supported objects are `xarray.DataArray`, `GridNetwork` and
+    `NestedCatchments`; any other object, including maps opened with 
+    `open_tiled`, is returned as is. Maps that have not been loaded from their
+    file are not copied: every process reopens the file and reads only the
+    windows it needs.
+
+    Parameters:
+    -----------
+    obj: Any
+        Object to be shared with the worker processes.
+    shared: list of SharedArray
+        List where the shared arrays are appended, so that they can be released.
+
+    Returns:
+    --------
+    Any
+        Picklable object to be restored with `restore` in the workers.
+    """
+
+    def to_shared(array):
+        shared_array = SharedArray(np.ascontiguousarray(array))
+        shared.append(shared_array)
+        return shared_array
+
+    if isinstance(obj, xr.DataArray) and obj.attrs.get('tiled'):
+        # mosaics of tiles are read lazily by every process
+        return obj
+    elif isinstance(obj, xr.DataArray) and not obj.variable._in_memory and obj.encoding.get('source'):
+        # maps read lazily from a file, e.g., the LDD cropped around every point
+        return {
+            'type': 'RasterFile',
+            'path': obj.encoding['source'],
+            'transform': obj.rio.transform(),
+            'shape': obj.shape,
+        }
+    elif isinstance(obj, xr.DataArray):
+        return {
+            'type': 'DataArray',
+            'data': to_shared(obj.values),
+            'coords': {dim: obj[dim].values for dim in obj.dims},
+            'dims': obj.dims,
+            'crs': obj.rio.crs,
+        }
+    elif isinstance(obj, GridNetwork):
+        fdir = obj.fdir
+        return {
+            'type': 'GridNetwork',
+            'arrays': {key: to_shared(array) for key, array in flwdir_arrays(fdir).items()},
+            'shape': fdir.shape,
+            'ftype': fdir.ftype,
+            'transform': fdir.transform,
+            'latlon': fdir.latlon,
+        }
+    elif isinstance(obj, NestedCatchments):
+        obj = copy.copy(obj)
+        obj.subbasins = to_shared(obj.subbasins)
+        return obj
+    return obj
+
+
+def restore(obj: Any) -> Any:
+    """
+    Restores in a worker process an object created by `share`.
+    """
+
+    if isinstance(obj, dict) and obj.get('type') == 'DataArray':
+        da = xr.DataArray(obj['data'].array, coords=obj['coords'], dims=obj['dims'])
+        return da.rio.write_crs(obj['crs']) if obj['crs'] is not None else da
+    elif isinstance(obj, dict) and obj.get('type') == 'RasterFile':
+        da = rioxarray.open_rasterio(obj['path']).squeeze(dim='band')
+        # offset of the window in the complete map
+        transform, window = da.rio.transform(), obj['transform']
+        row = int(round((window.f - transform.f) / transform.e))
+        col = int(round((window.c - transform.c) / transform.a))
+        rows, cols = obj['shape']
+        return da.isel(y=slice(row, row + rows), x=slice(col, col + cols))
+    elif isinstance(obj, dict) and obj.get('type') == 'GridNetwork':
+        arrays = {key: shared_array.array for key, shared_array in obj['arrays'].items()}
+        fdir = flwdir_from_arrays(arrays, obj['shape'], obj['ftype'], transform=obj['transform'], latlon=obj['latlon'])
+        return GridNetwork(fdir)
+    elif isinstance(obj, NestedCatchments):
+        _ATTACHED.append(obj.subbasins)
+        obj.subbasins = obj.subbasins.array
+        return obj
+    return obj
+
+
+def _initializer(state: Dict[str, Any]):
+    """Restores the shared objects in a worker process."""
+
+    _ATTACHED.append(state)
+    _STATE.update({key: restore(value) for key, value in state.items()})
+
+
+def _call(func: Callable, task: Any) -> Tuple[Any, Dict[str, float]]:
+    """Runs and times a task in a worker process with the restored shared objects."""
+
+    return timed(func, task, **_STATE)
+
+
+def run_tasks(
+    func: Callable,
+    tasks: Sequence[Any],
+    state: Dict[str, Any],
+    workers: int = 1,
+    priority: Optional[Sequence[float]] = None,
+    desc: str = 'points',
+    ids: Optional[Sequence] = None
+) -> List[Any]:
+    """
+    Runs a function over a list of tasks, either serially or in a pool of
+    processes. In the latter case, the objects in "state" are shared once with
+    every worker through shared memory instead of being pickled with every task.
+
+    Parameters:
+    -----------
+    func: Callable
+        Module-level function called as `func(task, **state)`.
+    tasks: sequence
+        Arguments of every call.
+    state: dictionary
+        Objects required by "func" that are common to all the tasks.
+    workers: int, optional
+        Number of processes. If 1, the tasks are run in the current process.
+    priority: sequence of float, optional
+        Tasks with higher priority are submitted first, e.g., the catchment area,
+        so that the largest catchments do not delay the end of the pool.
+    desc: str, optional
+        Description of the progress bar.
+    ids: sequence, optional
+        Identifier of every task, e.g., the point ID, under which its timings
+        are recorded if the run is profiled.
+
+    Returns:
+    --------
+    list
+        The result of every task, in the same order as "tasks". If a task raised
+        an exception, the exception is returned in its place.
+    """
+
+    results = [None] * len(tasks)
+    timings = [None] * len(tasks)
+    ids = range(len(tasks)) if ids is None else ids
+
+    if workers <= 1:
+        for i, task in tqdm(enumerate(tasks), total=len(tasks), desc=desc):
+            results[i], timings[i] = timed(func, task, **state)
+        add_points(ids, timings)
+        return results
+
+    # schedule the tasks with higher priority first
+    order = range(len(tasks)) if priority is None else np.argsort(-np.asarray(priority, dtype=float), kind='stable')
+
+    shared = []
+    try:
+        shared_state = {key: share(value, shared) for key, value in state.items()}
+        logger.info(f'Running {len(tasks)} tasks in {workers} processes')
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initializer, initargs=(shared_state,)) as executor:
+            futures = {executor.submit(_call, func, tasks[i]): i for i in order}
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                i = futures[future]
+                try:
+                    results[i], timings[i] = future.result()
+                except Exception as e:
+                    results[i] = e
+    finally:
+        for shared_array in shared:
+            shared_array.unlink()
+    add_points(ids, timings)
+
+    return results
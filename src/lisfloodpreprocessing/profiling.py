@@ -0,0 +1,273 @@
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+try:
+    import resource
+except ImportError:
+    # not available in Windows
+    resource = None
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+# profiler of the current run, if profiling is enabled
+_PROFILER: Optional['Profiler'] = None
+# duration (seconds) of the steps of the task being run in the current process
+_STEPS: Dict[str, float] = {}
+# steps in progress in the current process, with the time spent in their sub-steps
+_STEP_STACK: List[List] = []
+# peak memory of the stages in progress, updated when a nested stage starts
+_PEAK_STACK: List[int] = []
+
+
+def peak_rss(children: bool = False) -> int:
+    """
+    Peak resident memory (bytes) of the current process or, if "children", of
+    the largest worker process that has finished.
+    """
+
+    if resource is None:
+        return 0
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    maxrss = resource.getrusage(who).ru_maxrss
+    # kilobytes in Linux, bytes in macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak resident memory of the current process, so that the next
+    reading only covers the following stage. Only possible in Linux.
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def current_peak_rss() -> int:
+    """
+    Peak resident memory (bytes) since the last call to `reset_peak_rss` in
+    Linux, or since the start of the process otherwise.
+    """
+
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return peak_rss()
+
+
+def children_cpu_time() -> float:
+    """CPU time (seconds) of the worker processes that have finished."""
+
+    if resource is None:
+        return 0.
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextmanager
+def track_peak():
+    """
+    Measures the peak resident memory of a block of code. Blocks can be nested:
+    the peak of a block includes that of the blocks nested in it. The peak
+    (bytes) is stored in the key 'peak' of the yielded dictionary.
+    """
+
+    # the peak so far belongs to the enclosing blocks
+    peak = current_peak_rss()
+    _PEAK_STACK[:] = [max(p, peak) for p in _PEAK_STACK]
+    _PEAK_STACK.append(0)
+    reset_peak_rss()
+    out = {}
+    try:
+        yield out
+    finally:
+        out['peak'] = max(_PEAK_STACK.pop(), current_peak_rss())
+
+
+@contextmanager
+def step(name: str):
+    """
+    Measures the wall time of a step of the task being run, e.g., the delineation
+    of a catchment. The time of nested steps is not included in the enclosing one.
+    """
+
+    frame = [time.perf_counter(), 0.]
+    _STEP_STACK.append(frame)
+    try:
+        yield
+    finally:
+        _STEP_STACK.pop()
+        elapsed = time.perf_counter() - frame[0]
+        _STEPS[name] = _STEPS.get(name, 0.) + elapsed - frame[1]
+        if _STEP_STACK:
+            _STEP_STACK[-1][1] += elapsed
+
+
+def timed(func: Callable, task: Any, **kwargs) -> Tuple[Any, Dict[str, float]]:
+    """
+    Runs a task and measures its wall time, CPU time and the duration of its steps.
+
+    Returns:
+    --------
+    Tuple[Any, Dict[str, float]]
+        The result of the task, or the exception it raised, and its timings (seconds).
+    """
+
+    _STEPS.clear()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        result = func(task, **kwargs)
+    except Exception as e:
+        result = e
+    timings = {'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu, **_STEPS}
+
+    return result, timings
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time and peak memory of the stages of `lfcoords`,
+    and the timings of every point, and exports them as CSV and JSON files.
+    """
+
+    def __init__(self, folder: Union[str, Path], log: bool = False):
+        """
+        Parameters:
+        -----------
+        folder: string or pathlib.Path
+            Folder where the profile is saved.
+        log: bool, optional
+            Whether to log every record as a line of JSON.
+        """
+
+        self.folder = Path(folder)
+        self.log = log
+        self.stages: List[Dict[str, Any]] = []
+        self.points: List[Dict[str, Any]] = []
+        self._stack: List[str] = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Makes this profiler the one that records the stages of the run."""
+
+        global _PROFILER
+        _PROFILER = self
+
+    def stop(self):
+        """Stops recording."""
+
+        global _PROFILER
+        if _PROFILER is self:
+            _PROFILER = None
+
+    def _record(self, table: List[Dict[str, Any]], record: Dict[str, Any]):
+        with self._lock:
+            table.append(record)
+        if self.log:
+            logger.info(json.dumps(record))
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Records a stage. Stages can be nested; the name of a nested stage is
+        prefixed with those of the enclosing stages, e.g., 'fine/search'.
+        """
+
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        wall, cpu, cpu_workers = time.perf_counter(), time.process_time(), children_cpu_time()
+        try:
+            with track_peak() as memory:
+                yield
+        finally:
+            self._stack.pop()
+            self._record(self.stages, {
+                'type': 'stage',
+                'stage': path,
+                'wall': round(time.perf_counter() - wall, 6),
+                'cpu': round(time.process_time() - cpu, 6),
+                'cpu_workers': round(children_cpu_time() - cpu_workers, 6),
+                'peak_memory': round(memory.get('peak', 0) / 2**20, 1),
+            })
+
+    def add_stage(self, name: str, wall: float, cpu: float):
+        """Records a stage measured elsewhere, e.g., in the thread that writes the outputs."""
+
+        self._record(self.stages, {
+            'type': 'stage',
+            'stage': name,
+            'wall': round(wall, 6),
+            'cpu': round(cpu, 6),
+            'cpu_workers': 0.,
+            'peak_memory': None,
+        })
+
+    def add_points(self, ids: Sequence, timings: Sequence[Optional[Dict[str, float]]]):
+        """Records the timings of the points processed in the current stage."""
+
+        path = '/'.join(self._stack)
+        for point_id, times in zip(ids, timings):
+            if times is None:
+                continue
+            point_id = point_id.item() if hasattr(point_id, 'item') else point_id
+            record = {'type': 'point', 'ID': point_id, 'stage': path}
+            record.update({key: round(value, 6) for key, value in times.items()})
+            self._record(self.points, record)
+
+    def save(self):
+        """
+        Exports the stages and the points to 'profile_stages.csv' and
+        'profile_points.csv', and both to 'profile.json'.
+        """
+
+        import pandas as pd
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        stages = pd.DataFrame(self.stages).drop(columns='type', errors='ignore')
+        stages.to_csv(self.folder / 'profile_stages.csv', index=False)
+        points = pd.DataFrame(self.points).drop(columns='type', errors='ignore')
+        points.to_csv(self.folder / 'profile_points.csv', index=False)
+        with open(self.folder / 'profile.json', 'w') as f:
+            json.dump({'stages': self.stages, 'points': self.points}, f, indent=1)
+        logger.info(f'Profile of the run exported to: {self.folder}')
+
+
+def stage(name: str):
+    """
+    Records a stage with the active profiler, if any. Otherwise, it does nothing.
+
+        with stage('search'):
+            ...
+    """
+
+    return _PROFILER.stage(name) if _PROFILER is not None else nullcontext()
+
+
+def add_stage(name: str, wall: float, cpu: float):
+    """Records a stage measured elsewhere with the active profiler, if any."""
+
+    if _PROFILER is not None:
+        _PROFILER.add_stage(name, wall, cpu)
+
+
+def add_points(ids: Sequence, timings: Sequence[Optional[Dict[str, float]]]):
+    """Records the timings of a set of points with the active profiler, if any."""
+
+    if _PROFILER is not None:
+        _PROFILER.add_points(ids, timings)
@@ -0,0 +1,49 @@
+from pathlib import Path
+from typing import List, Union
+
+# side (degrees) of the MERIT tiles, used to process the points tile by tile
+TILE_SIZE = 5
+
+# files that define a tile index instead of a single map
+TILE_INDEX_SUFFIXES = {'.txt', '.gpkg', '.shp', '.geojson'}
+
+
+def is_tiled(path: Union[str, Path]) -> bool:
+    """
+    Whether a path defines a mosaic of tiles: a VRT, a folder of GeoTIFF tiles, a
+    text file listing the tiles, or a vector tile index with a 'location' field
+    (as created by `gdaltindex`).
+    """
+
+    path = Path(path)
+    return path.is_dir() or path.suffix.lower() in TILE_INDEX_SUFFIXES | {'.vrt'}
+
+
+def tile_paths(path: Union[str, Path]) -> List[Path]:
+    """
+    Files of the tiles defined by a folder, a text file or a vector tile index.
+
+    Parameters:
+    -----------
+    path: string or pathlib.Path
+        Tile index.
+
+    Returns:
+    --------
+    List[pathlib.Path]
+        Paths of the tiles.
+    """
+
+    path = Path(path)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.suffix.lower() in {'.tif', '.tiff'})
+    elif path.suffix.lower() == '.txt':
+        with open(path, 'r') as f:
+            files = [line.strip() for line in f if line.strip()]
+    else:
+        # only needed for vector tile indexes
+        import geopandas as gpd
+        files = gpd.read_file(path)['location'].tolist()
+
+    # relative paths are relative to the tile index
+    return [p if p.is_absolute() else path.parent / p for p in map(Path, files)]
@@ -1,19 +1,38 @@
 import logging
-from typing import Tuple, Optional, Union
+from typing import List, Tuple, Optional, Union
 from pathlib import Path
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 import xarray as xr
+import pyflwdir
+import shapely
 from affine import Affine
 from rasterio import features
 from pyproj.crs import CRS
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 
 
 # set logger
 logger = logging.getLogger(__name__)
 
+# search schedule in the finer grid: range (pixels), penalty, factor and acceptable error
+SEARCH_SCHEDULE = [
+    (55, 500, 2, 50),
+    (101, 500, 0.5, 80),
+    (151, 1000, 0.25, np.nan)
+]
+
+# search schedule used to relocate conflicting points: wider ranges and milder distance penalties
+RESOLVE_SCHEDULE = [
+    (151, 250, 0.5, 20),
+    (251, 100, 0.25, np.nan)
+]
+
 
 def find_pixel(
     upstream: xr.DataArray,
@@ -63,44 +82,457 @@ def find_pixel(
             The minimum error value at the new location.
     """
 
-    # find coordinates of the nearest pixel in the map
-    nearest_pixel = upstream.sel(y=lat, x=lon, method='nearest')
-    lat_orig, lon_orig = (nearest_pixel[coord].item() for coord in ['y', 'x'])
+    lat_new, lon_new, min_error = find_pixels(
+        upstream,
+        lat=[lat],
+        lon=[lon],
+        area=[area],
+        range_xy=range_xy,
+        penalty=penalty,
+        factor=factor,
+        distance_scaler=distance_scaler,
+        error_threshold=error_threshold
+    )
+    if np.isnan(min_error[0]):
+        raise ValueError(f'No valid pixel found in a range of {range_xy} pixels around ({lat}, {lon})')
+    
+    return lat_new[0], lon_new[0], min_error[0]
+
 
-    # extract subset of the upstream map
-    cellsize = np.mean(np.diff(upstream.x.data))
-    delta = range_xy * cellsize + 1e-6
-    upstream_sel = upstream.sel(y=slice(lat_orig + delta, lat_orig - delta),
-                                x=slice(lon_orig - delta, lon_orig + delta))
+def find_pixels(
+    upstream: xr.DataArray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    area: np.ndarray,
+    range_xy: int = 55,
+    penalty: int = 500,
+    factor: int = 2,
+    distance_scaler: float = .92,
+    error_threshold: int = 50,
+    chunk_size: int = 64
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Batched version of `find_pixel`. It finds, for every point, the coordinates 
+    of the pixel in the upstream map with a smaller error compared with a 
+    reference area.
     
-    # distance from the original pixel (in pixels)
-    i = np.arange(-range_xy, range_xy + 1)
-    ii, jj = np.meshgrid(i, i)
-    distance = xr.DataArray(
-        data=np.sqrt(ii**2 + jj**2) * distance_scaler, 
-        coords=upstream_sel.coords, 
-        dims=upstream_sel.dims
+    The coordinates of all the points are converted to row/column indices at 
+    once, the search windows are extracted by integer slicing and the error is 
+    computed for all the points in a chunk with vectorized NumPy operations 
+    (see `search_pixels`).
+    
+    Parameters:
+    -----------
+    upstream: xr.DataArray
+        The upstream data containing latitude and longitude coordinates.
+    lat: numpy.ndarray
+        The original latitude values.
+    lon: numpy.ndarray
+        The original longitude values.
+    area: numpy.ndarray
+        The reference areas to calculate percent error.
+    range_xy: int, optional
+        The range in both x and y directions to search for the new location.
+    penalty: int, optional
+        The penalty value to add to the distance when the percent error is too high.
+    factor: int, optional
+        The factor to multiply with the distance for the error calculation.
+    distance_scaler: float, optional
+        The scaling factor for the distance calculation in pixels.
+    error_threshold: float, optional
+        The threshold for the percent error to apply the penalty.
+    chunk_size: int, optional
+        Number of points whose search windows are processed at once. It limits
+        the memory used by the windows array.
+    
+    Returns:
+    --------
+    Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        A tuple containing the latitude, longitude and minimum error of the new 
+        location of every point. The three values are NaN if the search window 
+        of a point does not contain any valid pixel.
+    """
+    
+    return search_pixels(
+        upstream,
+        lat,
+        lon,
+        area,
+        schedule=[(range_xy, penalty, factor, np.nan)],
+        distance_scaler=distance_scaler,
+        error_threshold=error_threshold,
+        chunk_size=chunk_size
     )
 
-    # percent error in catchment area
-    error = 100 * abs(area - upstream_sel) / area
 
-    # penalise if error is too big
-    distance = distance.where(error <= error_threshold, distance + penalty)
+def search_pixels(
+    upstream: xr.DataArray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    area: np.ndarray,
+    schedule: List[Tuple[int, float, float, float]] = SEARCH_SCHEDULE,
+    distance_scaler: float = .92,
+    error_threshold: int = 50,
+    chunk_size: int = 64,
+    exclude: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds, for every point, the coordinates of the pixel in the upstream map with
+    a smaller error compared with a reference area, trying several search passes
+    in order until the error is acceptable.
+    
+    The window of the largest range in the schedule is extracted only once; every
+    pass is scored on a nested view of that window centred on the point. A point
+    is not scored in the following passes once its error is acceptable.
+    
+    Parameters:
+    -----------
+    upstream: xr.DataArray
+        The upstream data containing latitude and longitude coordinates.
+    lat: numpy.ndarray
+        The original latitude values.
+    lon: numpy.ndarray
+        The original longitude values.
+    area: numpy.ndarray
+        The reference areas to calculate percent error.
+    schedule: list of tuples, optional
+        Search passes defined by range (pixels), penalty, factor and acceptable
+        error. The result of the last pass is kept regardless of its error.
+    distance_scaler: float, optional
+        The scaling factor for the distance calculation in pixels.
+    error_threshold: float, optional
+        The threshold for the percent error to apply the penalty.
+    chunk_size: int, optional
+        Number of points whose search windows are processed at once. It limits
+        the memory used by the windows array.
+    exclude: numpy.ndarray, optional
+        Linear indices (row * number of columns + column) of the pixels that
+        cannot be selected, e.g., pixels already occupied by other points.
+    
+    Returns:
+    --------
+    Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        A tuple containing the latitude, longitude and minimum error of the new 
+        location of every point. The three values are NaN if the search window 
+        of a point does not contain any valid pixel.
+    """
+    
+    area = np.asarray(area, dtype=float)
+    rows, cols = pixel_indices(upstream, lat, lon)
+    
+    n_points = len(rows)
+    lat_new = np.full(n_points, np.nan)
+    lon_new = np.full(n_points, np.nan)
+    min_error = np.full(n_points, np.nan)
+    
+    # the largest window contains the windows of all the passes
+    max_range = max(range_xy for range_xy, *_ in schedule)
+    size = 2 * max_range + 1
+    windows = np.empty((min(chunk_size, n_points), size, size), dtype=float)
+    for start in range(0, n_points, chunk_size):
+        idxs = np.arange(start, min(start + chunk_size, n_points))
+        
+        # extract subsets of the upstream map
+        extract_windows(upstream, rows[idxs], cols[idxs], max_range, out=windows[:len(idxs)])
+        
+        # discard the excluded pixels
+        if exclude is not None and len(exclude) > 0:
+            offsets = np.arange(-max_range, max_range + 1)
+            window_rows = rows[idxs, None, None] + offsets[None, :, None]
+            window_cols = cols[idxs, None, None] + offsets[None, None, :]
+            inside = (window_cols >= 0) & (window_cols < upstream.shape[1])
+            excluded = inside & np.isin(window_rows * upstream.shape[1] + window_cols, exclude)
+            windows[:len(idxs)][excluded] = np.nan
+        
+        pending = np.arange(len(idxs))
+        for range_xy, penalty, factor, max_error in schedule:
+            logger.debug(f'Set range to {range_xy}')
+            
+            # nested view of the windows of the points not located yet
+            offset = max_range - range_xy
+            view = windows[pending, offset:size - offset, offset:size - offset]
+            i, j, error = score_windows(
+                view,
+                area[idxs[pending]],
+                penalty=penalty,
+                factor=factor,
+                distance=distance_kernel(range_xy, distance_scaler),
+                error_threshold=error_threshold
+            )
+            
+            # coordinates of the pixel with the smallest error
+            k = idxs[pending]
+            valid = ~np.isnan(error)
+            min_error[k] = error
+            lat_new[k] = np.where(valid, coordinate_values(upstream.y.data, rows[k] - range_xy + i), np.nan)
+            lon_new[k] = np.where(valid, coordinate_values(upstream.x.data, cols[k] - range_xy + j), np.nan)
+            
+            # stop searching for the points with an acceptable error
+            pending = pending[~(error <= max_error)]
+            if len(pending) == 0:
+                break
+    
+    return lat_new, lon_new, min_error
 
-    # update error based on distance
-    error += factor * distance
 
+def score_windows(
+    windows: np.ndarray,
+    area: np.ndarray,
+    penalty: float,
+    factor: float,
+    distance: np.ndarray,
+    error_threshold: float = 50
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the pixel with the smallest error in a stack of search windows. The
+    error combines the percent error in catchment area and the distance to the 
+    central pixel, penalised when the percent error is too high.
+    
+    Parameters:
+    -----------
+    windows: numpy.ndarray
+        Upstream area in the search windows, of shape (n_points, size, size).
+    area: numpy.ndarray
+        The reference area of every point.
+    penalty: float
+        The penalty value to add to the distance when the percent error is too high.
+    factor: float
+        The factor to multiply with the distance for the error calculation.
+    distance: numpy.ndarray
+        Distance (in pixels) to the central pixel, of shape (size, size).
+    error_threshold: float, optional
+        The threshold for the percent error to apply the penalty.
+        
+    Returns:
+    --------
+    Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        Row and column index in the window of the pixel with the smallest error, 
+        and its error (NaN if the window has no valid pixel).
+    """
+    
+    n, size = windows.shape[:2]
+    
+    # percent error in catchment area
+    ref = area[:, None, None]
+    error = 100 * np.abs(ref - windows) / ref
+    
+    # penalise if error is too big and update error based on distance
+    error += factor * np.where(error <= error_threshold, distance, distance + penalty)
+    
     # the new location is that with the smallest error
-    min_error = error.where(error == error.min(), drop=True)
-    if min_error.size == 1:
-        lat_new, lon_new = [min_error[coord].item() for coord in ['y', 'x']]
-    else:
-        idx = np.argwhere(~np.isnan(min_error.data.flatten()))[0][0]
-        x_idx, y_idx = np.unravel_index(idx, min_error.shape)
-        lat_new, lon_new = min_error.y.data[y_idx], min_error.x.data[x_idx]
+    error = error.reshape(n, -1)
+    valid = ~np.isnan(error).all(axis=1)
+    idx = np.nanargmin(np.where(valid[:, None], error, 0), axis=1)
+    i, j = np.unravel_index(idx, (size, size))
+    min_error = np.where(valid, error[np.arange(n), idx], np.nan)
+    
+    return i, j, min_error
+
+
+def pixel_indices(
+    grid: xr.DataArray,
+    lat: np.ndarray,
+    lon: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Converts coordinates into the row and column indices of the nearest pixel 
+    using the affine transform of the map. Indices may be outside the map.
+    
+    Parameters:
+    -----------
+    grid: xr.DataArray
+        Any map in the grid.
+    lat: numpy.ndarray
+        Latitude values.
+    lon: numpy.ndarray
+        Longitude values.
+        
+    Returns:
+    --------
+    Tuple[numpy.ndarray, numpy.ndarray]
+        Row and column indices.
+    """
+    
+    cols, rows = ~grid.rio.transform() * (np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    
+    return np.floor(rows).astype(int), np.floor(cols).astype(int)
+
+
+def nearest_indices(
+    grid: xr.DataArray,
+    lat: np.ndarray,
+    lon: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Converts coordinates into the row and column indices of the pixel whose 
+    centre is the nearest, as `xarray.DataArray.sel(method='nearest')`. It only
+    differs from `pixel_indices` for coordinates on the edge between two pixels,
+    e.g., pixel centres of a finer grid aligned with the coarse grid. Indices 
+    are clipped to the map.
+    
+    Parameters:
+    -----------
+    grid: xr.DataArray
+        Any map in the grid.
+    lat: numpy.ndarray
+        Latitude values.
+    lon: numpy.ndarray
+        Longitude values.
+        
+    Returns:
+    --------
+    Tuple[numpy.ndarray, numpy.ndarray]
+        Row and column indices.
+    """
+    
+    rows = grid.indexes['y'].get_indexer(np.asarray(lat, dtype=float), method='nearest')
+    cols = grid.indexes['x'].get_indexer(np.asarray(lon, dtype=float), method='nearest')
+    
+    return rows, cols
+
+
+def coordinate_values(coords: np.ndarray, idxs: np.ndarray) -> np.ndarray:
+    """
+    Extracts coordinate values by index, with NaN for indices outside the map.
+    """
+    
+    inside = (idxs >= 0) & (idxs < len(coords))
+    return np.where(inside, coords[np.clip(idxs, 0, len(coords) - 1)], np.nan)
+
+
+@lru_cache(maxsize=8)
+def distance_kernel(range_xy: int, distance_scaler: float = .92) -> np.ndarray:
+    """
+    Distance (in pixels) of every pixel in a search window to its central pixel.
+    The result is cached and must not be modified.
+    
+    Parameters:
+    -----------
+    range_xy: int
+        The range in both x and y directions of the search window.
+    distance_scaler: float, optional
+        The scaling factor for the distance calculation in pixels.
+        
+    Returns:
+    --------
+    numpy.ndarray
+        Array of shape (2 * range_xy + 1, 2 * range_xy + 1).
+    """
+    
+    i = np.arange(-range_xy, range_xy + 1)
+    ii, jj = np.meshgrid(i, i)
+    distance = np.sqrt(ii**2 + jj**2) * distance_scaler
+    distance.flags.writeable = False
+    
+    return distance
+
+
+def extract_windows(
+    grid: xr.DataArray,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    range_xy: int,
+    out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Extracts square windows centred on a set of pixels. The parts of the windows
+    outside the map are filled with NaN.
+    
+    Parameters:
+    -----------
+    grid: xr.DataArray
+        Map from which the windows are extracted.
+    rows: numpy.ndarray
+        Row index of the central pixels.
+    cols: numpy.ndarray
+        Column index of the central pixels.
+    range_xy: int
+        The range in both x and y directions of the windows.
+    out: numpy.ndarray, optional
+        Preallocated array of shape (len(rows), 2 * range_xy + 1, 2 * range_xy + 1)
+        where the windows are written.
+        
+    Returns:
+    --------
+    numpy.ndarray
+        Array of windows of shape (len(rows), 2 * range_xy + 1, 2 * range_xy + 1).
+    """
+    
+    size = 2 * range_xy + 1
+    if out is None:
+        out = np.empty((len(rows), size, size), dtype=float)
+    out[...] = np.nan
+    
+    n_rows, n_cols = grid.shape
+    for k, (row, col) in enumerate(zip(rows, cols)):
+        r0, c0 = row - range_xy, col - range_xy
+        r_min, r_max = max(r0, 0), min(r0 + size, n_rows)
+        c_min, c_max = max(c0, 0), min(c0 + size, n_cols)
+        if (r_min >= r_max) or (c_min >= c_max):
+            continue
+        out[k, r_min - r0:r_max - r0, c_min - c0:c_max - c0] = grid.variable[r_min:r_max, c_min:c_max].values
+        
+    return out
+
+
+def catchment_extent(
+    lat: float,
+    lon: float,
+    area: float,
+    factor: float = 3,
+    buffer: float = 0
+) -> Tuple[float, float, float, float]:
+    """
+    Estimates the maximum extent of the catchment draining to a point from its
+    area. The catchment is assumed to fit in a square centred on the point whose
+    half side is "factor" times the side of a square of the same area.
+    
+    Parameters:
+    -----------
+    lat: float
+        Latitude of the point.
+    lon: float
+        Longitude of the point.
+    area: float
+        Catchment area (km2).
+    factor: float, optional
+        Multiplier of the square root of the area to obtain the half side of the box.
+    buffer: float, optional
+        Minimum half side of the box (degrees), e.g., the search window of the point.
+        
+    Returns:
+    --------
+    Tuple[float, float, float, float]
+        Bounding box (lon_min, lat_min, lon_max, lat_max) in degrees.
+    """
     
-    return lat_new, lon_new, min_error.item()
+    # half side of the box (km)
+    half_side = factor * np.sqrt(area)
+    
+    # convert to degrees
+    delta_lat = max(half_side / 111.32, buffer)
+    cos_lat = max(np.cos(np.deg2rad(lat)), 1e-3)
+    delta_lon = min(max(half_side / (111.32 * cos_lat), buffer), 180)
+    
+    return lon - delta_lon, lat - delta_lat, lon + delta_lon, lat + delta_lat
+
+
+def touches_edge(mask: np.ndarray) -> bool:
+    """
+    Checks whether a boolean map has any True value in its outer rows or columns.
+    
+    Parameters:
+    -----------
+    mask: numpy.ndarray
+        2D boolean map, e.g., of catchment extent.
+        
+    Returns:
+    --------
+    bool
+        Whether the mask touches the edge of the map.
+    """
+    
+    return bool(mask[0, :].any() or mask[-1, :].any() or mask[:, 0].any() or mask[:, -1].any())
 
 
 def catchment_polygon(
@@ -129,10 +561,26 @@ def catchment_polygon(
         A GeoDataFrame containing the vectorized geometries.
     """
     
+    # Crop the raster to the bounding box of the non-zero values
+    mask = data if data.dtype == bool else data != 0
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0:
+        raise ValueError("No features found in the raster data.")
+    window = slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+    transform = transform * Affine.translation(cols[0], rows[0])
+    
+    # Use a compact data type for the values
+    values = data[window]
+    if data.dtype == bool or (values.min() >= 0 and values.max() <= np.iinfo(np.uint8).max):
+        values = values.astype(np.uint8)
+    elif values.dtype not in (np.int16, np.int32, np.uint16, np.float32):
+        values = values.astype(np.int32)
+    
     # Generate shapes and associated values from the raster data
     feats_gen = features.shapes(
-        data,
-        mask=data != 0,
+        values,
+        mask=mask[window],
         transform=transform,
         connectivity=8,
     )
@@ -154,17 +602,233 @@ def catchment_polygon(
     
     return gdf
 
+
+
+def coverage_fraction(
+    geometry: shapely.Geometry,
+    transform: Affine,
+    supersample: int = 1,
+    max_cells: int = 2**26
+) -> Tuple[np.ndarray, Affine]:
+    """
+    Fraction of every pixel of a grid covered by a polygon, in the window of the
+    grid that contains the polygon. The polygon is rasterized on a grid whose 
+    pixels are "supersample" times smaller, and the result is averaged by blocks.
+    
+    Parameters:
+    -----------
+    geometry: shapely.Geometry
+        Polygon, e.g., a catchment delineated in a finer grid.
+    transform: affine.Affine
+        Affine transform of the grid.
+    supersample: int, optional
+        Number of subpixels per pixel in each direction. If the polygon follows the
+        pixels of a finer grid aligned with this one, the ratio between the cell
+        sizes of both grids yields exact fractions.
+    max_cells: int, optional
+        Maximum number of subpixels. "supersample" is reduced if necessary.
         
+    Returns:
+    --------
+    Tuple[numpy.ndarray, affine.Affine]
+        The covered fraction of every pixel in the window, and the affine 
+        transform of the window.
+    """
+    
+    # window of the grid that contains the polygon
+    lon_min, lat_min, lon_max, lat_max = geometry.bounds
+    cols, rows = ~transform * (np.array([lon_min, lon_max]), np.array([lat_max, lat_min]))
+    col_min, row_min = int(np.floor(cols.min())), int(np.floor(rows.min()))
+    col_max, row_max = int(np.ceil(cols.max())), int(np.ceil(rows.max()))
+    shape = max(row_max - row_min, 1), max(col_max - col_min, 1)
+    window_transform = transform * Affine.translation(col_min, row_min)
+    
+    # rasterize in subpixels and average by blocks
+    supersample = max(1, min(int(supersample), int(np.sqrt(max_cells / (shape[0] * shape[1])))))
+    subpixels = features.rasterize(
+        [geometry],
+        out_shape=(shape[0] * supersample, shape[1] * supersample),
+        transform=window_transform * Affine.scale(1 / supersample),
+        fill=0,
+        default_value=1,
+        dtype=np.uint8
+    )
+    fractions = subpixels.reshape(shape[0], supersample, shape[1], supersample).mean(axis=(1, 3))
+    
+    return fractions, window_transform
+
+
+def intersection_over_union(
+    mask: np.ndarray,
+    transform: Affine,
+    fractions: np.ndarray,
+    fractions_transform: Affine,
+    area: float
+) -> float:
+    """
+    Ratio between the intersection and the union of a catchment map and a 
+    polygon rasterized with `coverage_fraction` in the same grid.
+    
+    Parameters:
+    -----------
+    mask: numpy.ndarray
+        Boolean map of the catchment.
+    transform: affine.Affine
+        Affine transform of "mask".
+    fractions: numpy.ndarray
+        Fraction of every pixel covered by the polygon.
+    fractions_transform: affine.Affine
+        Affine transform of "fractions".
+    area: float
+        Area of the polygon in pixels. It may be larger than the sum of "fractions"
+        if the polygon extends beyond the map.
+        
+    Returns:
+    --------
+    float
+        Intersection over union, between 0 and 1.
+    """
+    
+    # offset of the polygon window with respect to the catchment map
+    row_off = int(round((fractions_transform.f - transform.f) / transform.e))
+    col_off = int(round((fractions_transform.c - transform.c) / transform.a))
+    
+    # overlapping window in both arrays
+    r0, c0 = max(row_off, 0), max(col_off, 0)
+    r1 = min(row_off + fractions.shape[0], mask.shape[0])
+    c1 = min(col_off + fractions.shape[1], mask.shape[1])
+    if r1 > r0 and c1 > c0:
+        window = fractions[r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off]
+        intersection = window[mask[r0:r1, c0:c1]].sum()
+    else:
+        intersection = 0.0
+    union = area + mask.sum() - intersection
+    
+    return intersection / union if union > 0 else 0.0
+
+
+def simplify_catchments(
+    polygons: gpd.GeoDataFrame,
+    tolerance: float
+) -> gpd.GeoDataFrame:
+    """
+    Simplifies catchment polygons keeping the boundaries shared by different
+    catchments, e.g., nested catchments, consistent with each other.
+    
+    The polygons are split into the faces of their planar partition, the faces
+    are simplified as a coverage (every shared edge is simplified only once), 
+    and each catchment is rebuilt as the union of the simplified faces that it
+    contains. The attributes of the polygons are kept unchanged.
+    
+    Parameters:
+    -----------
+    polygons: geopandas.GeoDataFrame
+        Catchment polygons, e.g., the output of `catchment_polygon` for several points.
+    tolerance: float
+        Maximum distance between the original and the simplified boundaries, in 
+        the units of the coordinate reference system.
+        
+    Returns:
+    --------
+    geopandas.GeoDataFrame
+        The simplified polygons.
+    """
+    
+    geoms = polygons.geometry.values
+    
+    # planar partition of the polygons
+    linework = shapely.union_all(shapely.boundary(geoms))
+    faces = np.asarray(shapely.get_parts(shapely.polygonize(shapely.get_parts(linework))))
+    
+    # simplify the faces as a coverage
+    simplified = shapely.coverage_simplify(faces, tolerance)
+    
+    # assign faces to the polygons that contain them
+    tree = shapely.STRtree(shapely.point_on_surface(faces))
+    i_geom, i_face = tree.query(geoms, predicate='contains')
+    
+    new_geoms = np.array([
+        shapely.coverage_union_all(simplified[i_face[i_geom == i]]) for i in range(len(geoms))
+    ])
+    
+    simplified_polygons = polygons.copy()
+    simplified_polygons.geometry = new_geoms
+    n_before, n_after = shapely.get_num_coordinates(geoms).sum(), shapely.get_num_coordinates(new_geoms).sum()
+    logger.info(f'Catchment polygons simplified from {n_before} to {n_after} vertices')
+    
+    return simplified_polygons
+
+        
+def resolution_cellsize(resolution: str) -> float:
+    """
+    Cell size (degrees) of a resolution defined as in `Config`, e.g., '3sec' or '1min'.
+    """
+    
+    for suffix, factor in [('sec', 3600), ('min', 60)]:
+        if resolution.endswith(suffix):
+            return float(resolution[:-len(suffix)]) / factor
+    raise ValueError(f'Unknown resolution "{resolution}"')
+
+
+def on_same_flowpath(
+    fdir: pyflwdir.FlwdirRaster,
+    idx_a: int,
+    idx_b: int,
+    max_steps: int
+) -> bool:
+    """
+    Whether one of two pixels is downstream of the other within a number of 
+    steps along the river network.
+    
+    Parameters:
+    -----------
+    fdir: pyflwdir.FlwdirRaster
+        River network.
+    idx_a: int
+        Linear index of a pixel.
+    idx_b: int
+        Linear index of the other pixel.
+    max_steps: int
+        Maximum number of steps downstream.
+        
+    Returns:
+    --------
+    bool
+    """
+    
+    for start, end in [(idx_a, idx_b), (idx_b, idx_a)]:
+        idx = start
+        for _ in range(max_steps + 1):
+            if idx == end:
+                return True
+            idx_ds = fdir.idxs_ds[idx]
+            if idx_ds == idx:
+                break
+            idx = idx_ds
+            
+    return False
+
+
 def find_conflicts(
     points: gpd.GeoDataFrame,
     resolution: str,
     pct_error: float = 30, 
-    save: Optional[Union[Path, str]] = None
+    save: Optional[Union[Path, str]] = None,
+    tolerance: int = 0,
+    fdir: Optional[pyflwdir.FlwdirRaster] = None
 ) -> gpd.GeoDataFrame:
     """
     Finds conflicts in the new point layer, either due to points that overlap,
     or large catchment area errors.
     
+    Points overlap if they are located at most "tolerance" pixels apart in any
+    direction. The pairs of overlapping points are found with a KD-tree on the
+    pixel indices, so the cost does not grow quadratically with the number of
+    points. If a river network is provided, nearby points only overlap if they 
+    are on the same flow path. Points in the same pixel are labelled 'points 
+    overlap', and points in different pixels within the tolerance are labelled
+    'points nearby'; the remaining conflicts are labelled 'large area error'.
+    
     Parameters:
     -----------
     points: geopandas.GeoDataFrame
@@ -178,6 +842,13 @@ def find_conflicts(
         with the reference. It must be a value between 0 and 100
     save: pathlib.Path or string (optional)
         If provided, file name of the shapefile of conflicting points
+    tolerance: int (optional)
+        Maximum distance (pixels) between overlapping points. By default, 0, i.e.,
+        only points in the same pixel overlap
+    fdir: pyflwdir.FlwdirRaster (optional)
+        River network in the grid defined by "resolution". If provided, nearby
+        points must be connected along the river within the window of 
+        "tolerance" pixels around them to overlap
         
     Returns:
     --------
@@ -185,14 +856,39 @@ def find_conflicts(
         Subset of "points" with conflicts. Only if "save" is None.
     """  
         
-    # find overlaping points
+    # pixel indices of the points
     columns = [f'{col}_{resolution}' for col in ['lat', 'lon']]
-    mask = points.duplicated(subset=columns, keep=False)
-    duplicates = points[mask].copy()
-    duplicates['conflict'] = 'points overlap'
-    if duplicates.shape[0] > 0:
-        n_duplicates = len(duplicates[columns[0]].unique())
-        logger.warning(f'There are {n_duplicates} conflicts in which points are located at the same pixel in the finer grid')
+    located = points[columns].notnull().all(axis=1).values
+    cellsize = resolution_cellsize(resolution)
+    coords = points.loc[located, columns[::-1]].values
+    origin = coords[0] if len(coords) > 0 else 0 # pixel centres differ by multiples of the cell size
+    pixels = np.round((coords - origin) / cellsize).astype(np.int64)
+    
+    # pairs of points within the tolerance
+    tree = cKDTree(pixels)
+    pairs = tree.query_pairs(r=tolerance, p=np.inf, output_type='ndarray')
+    if fdir is not None and tolerance > 0 and len(pairs) > 0:
+        lat, lon = points.loc[located, columns].values.T
+        idxs = fdir.index(lon, lat)
+        max_steps = (2 * tolerance + 1)**2
+        same_path = [on_same_flowpath(fdir, idxs[a], idxs[b], max_steps) for a, b in pairs]
+        pairs = pairs[np.array(same_path, dtype=bool)]
+    
+    # groups of overlapping points
+    positions = np.flatnonzero(located)
+    if len(pairs) > 0:
+        graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(pixels),) * 2)
+        _, labels = connected_components(graph, directed=False)
+        in_pairs = np.unique(pairs)
+        duplicates = points.iloc[positions[in_pairs]].copy()
+        exact = pd.Series(pixels[in_pairs].tolist()).duplicated(keep=False).values
+        duplicates['conflict'] = np.where(exact, 'points overlap', 'points nearby')
+        n_duplicates = len(np.unique(labels[in_pairs]))
+        distance = f'within {tolerance} pixels' if tolerance > 0 else 'at the same pixel'
+        logger.warning(f'There are {n_duplicates} conflicts in which points are located {distance} in the {resolution} grid')
+    else:
+        duplicates = points.iloc[[]].copy()
+        duplicates['conflict'] = pd.Series(dtype=str)
         
     # errors in the delineated area
     assert 0 <= pct_error <= 100, '"pct_error" must be a value between 0 and 100'
@@ -0,0 +1,131 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rioxarray
+import shapely
+from lisfloodpreprocessing.cache import GridCache, ResultCache, flow_network, point_keys
+
+
+class TestGridCache(unittest.TestCase):
+
+    path = Path(__file__).parent / 'data' / 'lfcoords'
+
+    def setUp(self):
+
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+
+        # a window of the LDD of the test case
+        ldd = rioxarray.open_rasterio(self.path / 'MERIT' / 'ldd_3sec.tif').squeeze(dim='band')
+        self.ldd = ldd.isel(y=slice(300, 400), x=slice(500, 600)).load()
+        self.source = tmp / 'ldd.tif'
+        self.ldd.rio.to_raster(self.source)
+        self.cache = GridCache(tmp / 'cache')
+
+    def tearDown(self):
+
+        self.tmp.cleanup()
+
+    def read(self):
+
+        return rioxarray.open_rasterio(self.source).squeeze(dim='band')
+
+    def rewrite(self, ldd):
+        """Overwrites the source file, making sure that its modification time changes."""
+
+        stat = self.source.stat()
+        ldd.rio.to_raster(self.source)
+        os.utime(self.source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def test_raster(self):
+
+        grid = self.cache.raster(self.read(), self.source)
+        self.assertIsInstance(grid.data, np.memmap)
+        np.testing.assert_array_equal(grid.values, self.ldd.values)
+        self.assertEqual(len(list((self.cache.folder / 'rasters').glob('*.npy'))), 1)
+
+        # reused while the file does not change
+        self.cache.raster(self.read(), self.source)
+        self.assertEqual(len(list((self.cache.folder / 'rasters').glob('*.npy'))), 1)
+
+        # invalidated when the file changes
+        modified = self.ldd.copy(data=np.flipud(self.ldd.values))
+        self.rewrite(modified)
+        grid = self.cache.raster(self.read(), self.source)
+        np.testing.assert_array_equal(grid.values, modified.values)
+        self.assertEqual(len(list((self.cache.folder / 'rasters').glob('*.npy'))), 2)
+
+    def test_network(self):
+
+        fdir = flow_network(self.ldd, 'd8')
+        stored = flow_network(self.read(), 'd8', cache=self.cache, source=self.source)
+        loaded = flow_network(self.read(), 'd8', cache=self.cache, source=self.source)
+        self.assertIsInstance(loaded.idxs_ds, np.memmap)
+        for network in [stored, loaded]:
+            np.testing.assert_array_equal(network.idxs_ds, fdir.idxs_ds)
+            np.testing.assert_array_equal(network.upstream_area('cell'), fdir.upstream_area('cell'))
+
+        # invalidated when the file changes
+        modified = self.ldd.copy(data=np.where(self.ldd.values == 1, 4, self.ldd.values).astype(self.ldd.dtype))
+        self.rewrite(modified)
+        network = flow_network(self.read(), 'd8', cache=self.cache, source=self.source)
+        np.testing.assert_array_equal(network.idxs_ds, flow_network(modified, 'd8').idxs_ds)
+        self.assertFalse(np.array_equal(network.idxs_ds, fdir.idxs_ds))
+        self.assertEqual(len(list((self.cache.folder / 'networks').iterdir())), 2)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.points = pd.DataFrame(
+            {'lat': [43.1, 43.2, 43.3], 'lon': [-6.1, -6.2, -6.3], 'area': [100, 200, 300]},
+            index=pd.Index([1, 2, 3], name='ID')
+        )
+
+    def tearDown(self):
+
+        self.tmp.cleanup()
+
+    def test_point_keys(self):
+
+        keys = point_keys(self.points, 'setting', 1)
+        pd.testing.assert_series_equal(point_keys(self.points.copy(), 'setting', 1), keys)
+
+        # only the modified point changes its key
+        points = self.points.copy()
+        points.loc[2, 'area'] = 250
+        changed = point_keys(points, 'setting', 1) != keys
+        self.assertEqual(changed.tolist(), [False, True, False])
+
+        # a setting changes all the keys
+        self.assertTrue((point_keys(self.points, 'setting', 2) != keys).all())
+
+    def test_load_save(self):
+
+        cache = ResultCache(Path(self.tmp.name) / 'results')
+        keys = point_keys(self.points)
+        points_cached, polygons_cached = cache.load('fine', keys)
+        self.assertTrue(points_cached.empty and polygons_cached.empty)
+
+        # point 3 produced no polygon, so it is not stored
+        results = self.points.assign(area_3sec=self.points['area'] + 1)
+        polygons = gpd.GeoDataFrame(
+            geometry=[shapely.box(lon, lat, lon + .1, lat + .1) for lat, lon in results[['lat', 'lon']].values[:2]],
+            index=results.index[:2],
+            crs='EPSG:4326'
+        )
+        cache.save('fine', keys, results, polygons)
+
+        # point 2 changed
+        points = self.points.copy()
+        points.loc[2, 'lat'] = 43.25
+        points_cached, polygons_cached = cache.load('fine', point_keys(points))
+        self.assertEqual(points_cached.index.tolist(), [1])
+        self.assertEqual(polygons_cached.index.tolist(), [1])
+        pd.testing.assert_frame_equal(points_cached, results.loc[[1]])
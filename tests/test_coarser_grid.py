@@ -0,0 +1,111 @@
+import unittest
+from pathlib import Path
+import numpy as np
+import pyflwdir
+import rioxarray
+import xarray as xr
+from lisfloodpreprocessing.coarser_grid import match_coarse, search_flowpath
+from lisfloodpreprocessing.delineation import BasinCache, GridNetwork
+from lisfloodpreprocessing.utils import catchment_polygon
+
+
+class TestMatchCoarse(unittest.TestCase):
+
+    path = Path(__file__).parent / 'data' / 'lfcoords'
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.ldd = rioxarray.open_rasterio(cls.path / 'EFAS' / 'ldd_1min.nc').squeeze(dim='band').load()
+        cls.upstream = rioxarray.open_rasterio(cls.path / 'EFAS' / 'uparea_1min.nc').squeeze(dim='band').load()
+        cls.fdir = pyflwdir.from_array(cls.ldd.data, ftype='ldd', transform=cls.ldd.rio.transform(), check_ftype=False, latlon=True)
+
+    def match(self, lat, lon, polygon, area=100, basins=None, **kwargs):
+
+        task = (area, lat, lon, area, lat, lon, polygon.wkb)
+        return match_coarse(
+            task,
+            network=GridNetwork(self.fdir),
+            ldd_coarse=self.ldd,
+            upstream_coarse=self.upstream,
+            basins=BasinCache() if basins is None else basins,
+            cellsize=1 / 60,
+            **kwargs
+        )
+
+    def polygon(self, lat, lon):
+        """Catchment polygon of a pixel of the coarse grid."""
+
+        basin = self.fdir.basins(xy=(lon, lat)) > 0
+        return catchment_polygon(basin, self.ldd.rio.transform(), crs='EPSG:4326').geometry.iloc[0]
+
+    def test_cell_edge(self):
+
+        # a point of the fine grid on the edge between two rows of the coarse grid
+        lat, lon = 43.4, -6.825
+        nearest = self.upstream.sel(y=lat, x=lon, method='nearest')
+        polygon = self.polygon(nearest.y.item(), nearest.x.item())
+
+        # with large tolerances the central pixel is kept: the nearest, as `sel` does
+        basin_coarse, area, lat_coarse, lon_coarse = self.match(lat, lon, polygon, abs_error=np.inf, pct_error=np.inf)
+        self.assertEqual((lat_coarse, lon_coarse), (nearest.y.item(), nearest.x.item()))
+        self.assertAlmostEqual(area, nearest.item() * 1e-6, places=6)
+        self.assertTrue(basin_coarse.geometry.iloc[0].equals(polygon))
+
+    def test_pruning(self):
+
+        # point 2651 of the test case in the coarse grid
+        lat, lon = 43.391667, -6.825
+        area = self.upstream.sel(y=lat, x=lon, method='nearest').item() * 1e-6
+        polygon = self.polygon(lat, lon)
+
+        # candidates with implausible upstream area are not delineated
+        basins = BasinCache()
+        _, area_coarse, lat_coarse, lon_coarse = self.match(lat, lon, polygon, area=area, basins=basins)
+        self.assertAlmostEqual(area_coarse, area, places=6)
+        self.assertEqual((round(lat_coarse, 6), round(lon_coarse, 6)), (lat, lon))
+        self.assertLess(len(basins._basins), 10)
+
+        # if no candidate is plausible, all of them are compared
+        basins = BasinCache()
+        _, area_coarse, lat_coarse, lon_coarse = self.match(lat, lon, polygon, area=1e6, basins=basins)
+        self.assertEqual((round(lat_coarse, 6), round(lon_coarse, 6)), (lat, lon))
+        self.assertEqual(len(basins._basins), 25)
+
+
+class TestSearchFlowpath(unittest.TestCase):
+
+    def setUp(self):
+
+        # a straight river that flows east, whose upstream area (km2) is the column number plus one
+        cols = np.arange(15)
+        self.ldd = xr.DataArray(np.where(cols < 14, 6, 5)[None, :].astype(float), dims=('y', 'x'))
+        self.upstream = xr.DataArray((cols + 1)[None, :] * 1e6, dims=('y', 'x'))
+
+    def search(self, **kwargs):
+
+        # the window covers columns 4 to 6; the reference area matches column 5, and
+        # the shape similarity is maximum in column 9
+        rows, cols = np.zeros(3, dtype=int), np.array([4, 5, 6])
+        area_ref = 6
+        area_ratio = np.minimum(cols + 1, area_ref) / np.maximum(cols + 1, area_ref)
+        return search_flowpath(
+            self.ldd, self.upstream, rows, cols, area_ratio, area_ref,
+            shape_similarity=lambda row, col: 1 - abs(col - 9) / 10,
+            **kwargs
+        )
+
+    def test_search(self):
+
+        rows, cols, area, scores = self.search()
+
+        # from column 5, downstream while the similarity improves, and one step upstream
+        self.assertEqual(cols.tolist(), [5, 6, 7, 8, 9, 10, 4])
+        self.assertEqual(cols[np.argmax(scores)], 9)
+        np.testing.assert_allclose(area, cols + 1)
+
+    def test_area_ratio(self):
+
+        # pixels whose upstream area is too different from the reference end the search
+        rows, cols, area, scores = self.search(min_area_ratio=0.7)
+        self.assertEqual(cols.tolist(), [5, 6, 7, 4])
@@ -0,0 +1,64 @@
+import unittest
+from pathlib import Path
+import pandas as pd
+import pyflwdir
+import rioxarray
+from lisfloodpreprocessing import Config
+from lisfloodpreprocessing.delineation import CroppedNetwork, GridNetwork
+from lisfloodpreprocessing.finer_grid import delineate_fine
+
+
+class TestDelineation(unittest.TestCase):
+
+    path = Path(__file__).parent / 'data' / 'lfcoords'
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.ldd = rioxarray.open_rasterio(cls.path / 'MERIT' / 'ldd_3sec.tif').squeeze(dim='band').load()
+        cls.fdir = pyflwdir.from_array(cls.ldd.data, ftype='d8', transform=cls.ldd.rio.transform(), check_ftype=False, latlon=True)
+
+        # the points of the test case in the fine grid, and a point downstream of
+        # one of them, so that their catchments are nested
+        expected = pd.read_csv(cls.path / 'expected.csv', index_col='ID')
+        points = expected[['lat_3sec', 'lon_3sec', 'area_3sec']]
+        points.columns = ['lat', 'lon', 'area']
+        idx = cls.fdir.index(points.loc[2651, 'lon'], points.loc[2651, 'lat'])
+        for _ in range(40):
+            idx = cls.fdir.idxs_ds[idx]
+        lon, lat = cls.fdir.xy(idx)
+        points.loc[9999] = [lat, lon, 2305]
+        cls.points = points
+
+    def delineate(self, delineation, **processing):
+
+        cfg = Config({'processing': {'delineation': delineation, **processing}})
+        fdir = None if delineation == 'crop' else self.fdir
+        return delineate_fine(cfg, self.points, self.points.lat.values, self.points.lon.values, self.ldd, fdir_fine=fdir)
+
+    def test_nested(self):
+
+        grid = self.delineate('grid')
+        nested = self.delineate('nested')
+
+        self.assertEqual(nested.index.tolist(), self.points.index.tolist())
+        self.assertTrue(nested.geom_equals(grid).all())
+        # the catchment downstream contains the one upstream
+        upstream, downstream = nested.geometry.loc[2651], nested.geometry.loc[9999]
+        self.assertAlmostEqual(upstream.difference(downstream).area, 0, places=12)
+        self.assertGreater(downstream.area, upstream.area)
+
+    def test_crop(self):
+
+        # the initial window is too small, so it must grow until the catchment fits
+        grid = self.delineate('grid')
+        crop = self.delineate('crop', extent_factor=0.1)
+        self.assertTrue(crop.geom_equals(grid).all())
+
+        lat, lon, area = self.points.loc[2651]
+        network = CroppedNetwork(self.ldd, 'd8', lat, lon, area, factor=0.1)
+        half_rows = network.half_rows
+        mask, transform, edge = network.basin(lon, lat)
+        self.assertGreater(network.half_rows, half_rows)
+        self.assertFalse(edge)
+        self.assertEqual(mask.sum(), GridNetwork(self.fdir).basin(lon, lat)[0].sum())
@@ -0,0 +1,65 @@
+import unittest
+from pathlib import Path
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyflwdir
+import rioxarray
+from lisfloodpreprocessing import Config
+from lisfloodpreprocessing.finer_grid import delineate_fine, resolve_conflicts
+from lisfloodpreprocessing.utils import find_conflicts
+
+
+class TestResolveConflicts(unittest.TestCase):
+
+    path = Path(__file__).parent / 'data' / 'lfcoords'
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.ldd = rioxarray.open_rasterio(cls.path / 'MERIT' / 'ldd_3sec.tif').squeeze(dim='band').load()
+        cls.fdir = pyflwdir.from_array(cls.ldd.data, ftype='d8', transform=cls.ldd.rio.transform(), check_ftype=False, latlon=True)
+        # the upstream area of MERIT is not shipped, but it can be derived from the LDD
+        cls.upstream = cls.ldd.copy(data=cls.fdir.upstream_area('km2').astype('float32'))
+        ldd_coarse = rioxarray.open_rasterio(cls.path / 'EFAS' / 'ldd_1min.nc').squeeze(dim='band')
+        cls.cfg = Config({'processing': {'delineation': 'grid'}})
+        cls.cfg.update_config(cls.ldd, ldd_coarse)
+
+    def test_overlap(self):
+
+        # two stations that snap to the pixel of point 2651: station 2 matches its
+        # upstream area, whereas the area of station 1 has an error of 20%
+        lat, lon = pd.read_csv(self.path / 'expected.csv', index_col='ID').loc[2651, ['lat_3sec', 'lon_3sec']]
+        area = self.upstream.sel(y=lat, x=lon, method='nearest').item()
+        points = pd.DataFrame(
+            {'lat': lat, 'lon': lon, 'area': [area * 1.2, area]},
+            index=pd.Index([1, 2], name='ID')
+        )
+        points_fine = gpd.GeoDataFrame(
+            points.assign(area_3sec=int(area), lat_3sec=lat, lon_3sec=lon),
+            geometry=gpd.points_from_xy(points.lon, points.lat),
+            crs=self.ldd.rio.crs
+        )
+        points_fine['abs_error'] = abs(points_fine['area_3sec'] - points_fine['area'])
+        points_fine['pct_error'] = points_fine.abs_error / points_fine['area'] * 100
+        polygons_fine = delineate_fine(self.cfg, points, points.lat.values, points.lon.values, self.ldd, fdir_fine=self.fdir)
+        conflicts = find_conflicts(points_fine.copy(), '3sec', pct_error=50)
+        self.assertEqual(conflicts.conflict.tolist(), ['points overlap'] * 2)
+
+        points_new, polygons_new = resolve_conflicts(
+            self.cfg, points_fine, polygons_fine, conflicts, self.ldd, self.upstream, fdir_fine=self.fdir
+        )
+
+        # the station with the smallest error keeps the pixel, the other one is moved
+        # to a distinct pixel with a smaller error
+        pd.testing.assert_series_equal(points_new.loc[2], points_fine.loc[2])
+        self.assertNotEqual(tuple(points_new.loc[1, ['lat_3sec', 'lon_3sec']]), (lat, lon))
+        self.assertLess(points_new.loc[1, 'pct_error'], points_fine.loc[1, 'pct_error'])
+        self.assertTrue(find_conflicts(points_new.copy(), '3sec', pct_error=50).empty)
+
+        # the catchment of the moved station is delineated again
+        self.assertEqual(polygons_new.index.tolist(), [1, 2])
+        self.assertTrue(polygons_new.geometry.loc[2].equals(polygons_fine.geometry.loc[2]))
+        self.assertFalse(polygons_new.geometry.loc[1].equals(polygons_fine.geometry.loc[1]))
+        basin = self.fdir.basins(xy=tuple(points_new.loc[1, ['lon_3sec', 'lat_3sec']])) > 0
+        self.assertAlmostEqual(polygons_new.geometry.loc[1].area * 1200**2, basin.sum(), places=6)
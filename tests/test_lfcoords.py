@@ -1,29 +1,179 @@
+import tempfile
 import unittest
 from pathlib import Path
+from unittest.mock import patch
+import geopandas as gpd
+import numpy as np
 import pandas as pd
 import pandas.testing as pdt
-from lisfloodutilities.lfcoords import Config
-from lisfloodutilities.lfcoords.finer_grid import coordinates_fine
-from lisfloodutilities.lfcoords.coarser_grid import coordinates_coarse
+import pyflwdir
+import rioxarray
+import xarray as xr
+import yaml
+from lisfloodpreprocessing import Config, PointLocator, read_input_files
+from lisfloodpreprocessing.finer_grid import coordinates_fine
+from lisfloodpreprocessing.coarser_grid import coordinates_coarse
 
 
 class TestLFcoords(unittest.TestCase):
 
-    path = Path('tests/data/lfcoords')
+    path = Path(__file__).parent / 'data' / 'lfcoords'
+    # difference (km2) of the upstream area in the fine grid allowed when it is derived from the LDD
+    area_tolerance = 1
+
+    def setUp(self):
+
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+
+        # absolute paths to the test data, outputs in a temporary folder
+        with open(self.path / 'config.yml', 'r') as f:
+            config = yaml.safe_load(f)
+        for key, value in config['input'].items():
+            config['input'][key] = str(self.path.parent.parent / value)
+        config['output_folder'] = str(tmp / 'outputs')
+
+        # the upstream area of MERIT is not shipped, but it can be derived from the LDD
+        self.derived = not Path(config['input']['upstream_fine']).is_file()
+        if self.derived:
+            ldd = rioxarray.open_rasterio(config['input']['ldd_fine']).squeeze(dim='band')
+            fdir = pyflwdir.from_array(ldd.data, ftype='d8', transform=ldd.rio.transform(), check_ftype=False, latlon=True)
+            upstream = ldd.copy(data=fdir.upstream_area('km2').astype('float32'))
+            upstream.rio.write_nodata(-9999, inplace=True)
+            upstream.rio.to_raster(tmp / 'uparea_3sec.tif')
+            config['input']['upstream_fine'] = str(tmp / 'uparea_3sec.tif')
+
+        self.config = config
+        self.config_file = tmp / 'config.yml'
+        with open(self.config_file, 'w') as f:
+            yaml.dump(config, f)
+
+    def tearDown(self):
+
+        self.tmp.cleanup()
+
+    def assert_points_equal(self, test, expected):
+        """Compares the located points with the expected values."""
+
+        columns = expected.columns
+        if self.derived:
+            # the derived upstream area differs slightly from the original map of MERIT
+            pdt.assert_series_equal(
+                test['area_3sec'], expected['area_3sec'], check_dtype=False, check_exact=False, rtol=0, atol=self.area_tolerance
+            )
+            columns = columns.drop('area_3sec')
+        pdt.assert_frame_equal(test[columns], expected[columns], check_dtype=False, check_exact=True)
 
     def test_lfcoords(self):
 
         # compute test values
-        cfg = Config(self.path / 'config.yml')
-        stations_HR = coordinates_fine(cfg, save=False)
-        test = coordinates_coarse(cfg, stations_HR, save=False)
+        cfg = Config(self.config_file)
+        inputs = read_input_files(cfg)
+        points_fine, polygons_fine = coordinates_fine(cfg, inputs['points'], inputs['ldd_fine'], inputs['upstream_fine'])
+        test, _ = coordinates_coarse(cfg, points_fine, polygons_fine, inputs['ldd_coarse'], inputs['upstream_coarse'])
 
         # load expected values
         expected = pd.read_csv(self.path / 'expected.csv', index_col='ID')
         expected.index =expected.index.astype(test.index.dtype)
 
         # check
-        try:
-            pdt.assert_frame_equal(test, expected, check_dtype=False)
-        except AssertionError as e:
-            print(e)
+        self.assert_points_equal(test, expected)
+
+    def test_inputs_without_output_folder(self):
+
+        # the inputs can be read with a configuration that writes nothing
+        cfg = Config({'input': self.config['input'], 'conditions': self.config['conditions']})
+        inputs = read_input_files(cfg)
+        self.assertIsNone(cfg.writer)
+        self.assertEqual(len(inputs['points']), 3)
+
+    def test_incremental_no_polygons(self):
+
+        # no point is located and none can be reused from a previous run
+        cfg = Config(self.config_file)
+        inputs = read_input_files(cfg)
+        points_fine, polygons_fine = coordinates_fine(cfg, inputs['points'], inputs['ldd_fine'], inputs['upstream_fine'])
+        cfg.incremental = True
+        failed = lambda cfg, points, *args, **kwargs: (points.copy(), gpd.GeoDataFrame())
+        
+        with patch('lisfloodpreprocessing.coarser_grid.locate_coarse', side_effect=failed):
+            points_coarse, polygons_coarse = coordinates_coarse(cfg, points_fine, polygons_fine, inputs['ldd_coarse'], inputs['upstream_coarse'])
+        self.assertTrue(points_coarse.empty and polygons_coarse.empty)
+        
+        with patch('lisfloodpreprocessing.finer_grid.locate_fine', side_effect=failed):
+            points_fine, polygons_fine = coordinates_fine(cfg, inputs['points'], inputs['ldd_fine'], inputs['upstream_fine'])
+        self.assertTrue(points_fine.empty and polygons_fine.empty)
+
+    def test_api(self):
+
+        # maps opened directly and settings without output folder
+        ldd_fine, upstream_fine, ldd_coarse, upstream_coarse = [
+            rioxarray.open_rasterio(self.config['input'][key]).squeeze(dim='band')
+            for key in ['ldd_fine', 'upstream_fine', 'ldd_coarse', 'upstream_coarse']
+        ]
+        listing = lambda: sorted(Path(self.tmp.name).rglob('*')) + sorted(self.path.rglob('*')) + sorted(Path.cwd().iterdir())
+        files = listing()
+
+        # compute test values with the maps in memory
+        locator = PointLocator(ldd_fine, upstream_fine, ldd_coarse, upstream_coarse, cfg={'conditions': self.config['conditions']})
+        points = pd.read_csv(self.path / 'points.csv')
+        results = locator.locate(points)
+        self.assertEqual(
+            sorted(results),
+            sorted(f'{layer}_{resolution}' for layer in ['points', 'catchments', 'conflicts'] for resolution in ['3sec', '1min'])
+        )
+        test = results['points_1min']
+        
+        # the results do not change when the locator is reused
+        pdt.assert_frame_equal(locator.locate(points)['points_1min'], test)
+
+        # load expected values
+        expected = pd.read_csv(self.path / 'expected.csv', index_col='ID')
+        expected.index = expected.index.astype(test.index.dtype)
+
+        # check
+        self.assert_points_equal(test, expected)
+        self.assertEqual(len(results['catchments_1min']), len(expected))
+
+        # nothing is written to disk
+        self.assertIsNone(locator.cfg.writer)
+        self.assertEqual(listing(), files)
+
+    def test_coarse_targets(self):
+
+        ldd_fine, upstream_fine, ldd_coarse, upstream_coarse = [
+            rioxarray.open_rasterio(self.config['input'][key]).squeeze(dim='band').load()
+            for key in ['ldd_fine', 'upstream_fine', 'ldd_coarse', 'upstream_coarse']
+        ]
+
+        # a second coarse target of 3 arcminutes upscaled from the one of 1 arcminute
+        fdir = pyflwdir.from_array(ldd_coarse.data, ftype='ldd', transform=ldd_coarse.rio.transform(), check_ftype=False, latlon=True)
+        fdir_3min, idxs_out = fdir.upscale(3, method='ihu', uparea=upstream_coarse.values)
+        transform = fdir_3min.transform
+        coords = {
+            'y': transform.f + (np.arange(fdir_3min.shape[0]) + .5) * transform.e,
+            'x': transform.c + (np.arange(fdir_3min.shape[1]) + .5) * transform.a
+        }
+        ldd_3min = xr.DataArray(fdir_3min.to_array('ldd'), coords=coords, dims=('y', 'x')).rio.write_crs(ldd_coarse.rio.crs)
+        upstream_3min = ldd_3min.copy(data=np.where(idxs_out >= 0, upstream_coarse.values.flat[idxs_out], upstream_coarse.rio.nodata))
+
+        # every target gives its own layers, and the first one matches a single target
+        locator = PointLocator(
+            ldd_fine, upstream_fine, [ldd_coarse, ldd_3min], [upstream_coarse, upstream_3min],
+            cfg={'conditions': self.config['conditions']}
+        )
+        points = pd.read_csv(self.path / 'points.csv')
+        results = locator.locate(points)
+        self.assertEqual(
+            sorted(results),
+            sorted(f'{layer}_{resolution}' for layer in ['points', 'catchments', 'conflicts'] for resolution in ['3sec', '1min', '3min'])
+        )
+        single = PointLocator(ldd_fine, upstream_fine, ldd_coarse, upstream_coarse, cfg={'conditions': self.config['conditions']})
+        pdt.assert_frame_equal(results['points_1min'], single.locate(points)['points_1min'])
+
+        # the points are located in pixels of the grid of 3 arcminutes
+        test = results['points_3min']
+        self.assertEqual(len(results['catchments_3min']), len(test))
+        self.assertTrue(test[['lat_3min', 'lon_3min', 'area_3min']].notnull().all().all())
+        self.assertTrue(np.isin(test['lat_3min'].round(6), ldd_3min.y.round(6)).all())
+        self.assertTrue(np.isin(test['lon_3min'].round(6), ldd_3min.x.round(6)).all())
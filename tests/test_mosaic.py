@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+from pathlib import Path
+import numpy as np
+import rioxarray
+from lisfloodpreprocessing.mosaic import open_tiled
+from lisfloodpreprocessing.tiles import is_tiled
+
+
+class TestOpenTiled(unittest.TestCase):
+
+    path = Path(__file__).parent / 'data' / 'lfcoords'
+
+    def setUp(self):
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name) / 'tiles'
+        self.folder.mkdir()
+
+        # the LDD of the test case split in 2 x 2 tiles of different sizes
+        self.ldd = rioxarray.open_rasterio(self.path / 'MERIT' / 'ldd_3sec.tif').squeeze(dim='band', drop=True).load()
+        self.tile_nbytes = []
+        for i, rows in enumerate([slice(None, 500), slice(500, None)]):
+            for j, cols in enumerate([slice(None, 700), slice(700, None)]):
+                tile = self.ldd.isel(y=rows, x=cols)
+                tile.rio.to_raster(self.folder / f'tile_{i}{j}.tif')
+                self.tile_nbytes.append(tile.nbytes)
+        with open(Path(self.tmp.name) / 'tiles.txt', 'w') as f:
+            f.write('\n'.join(f'tiles/{p.name}' for p in sorted(self.folder.iterdir())))
+
+    def tearDown(self):
+
+        self.tmp.cleanup()
+
+    def test_mosaic(self):
+
+        # a folder of tiles and a text file listing them define the same map
+        for path in [self.folder, Path(self.tmp.name) / 'tiles.txt']:
+            self.assertTrue(is_tiled(path))
+            mosaic = open_tiled(path)
+            self.assertEqual(mosaic.shape, self.ldd.shape)
+            np.testing.assert_allclose(mosaic.x, self.ldd.x)
+            np.testing.assert_allclose(mosaic.y, self.ldd.y)
+            self.assertEqual(mosaic.rio.crs, self.ldd.rio.crs)
+            np.testing.assert_array_equal(mosaic.values, self.ldd.values)
+        self.assertFalse(is_tiled(self.path / 'MERIT' / 'ldd_3sec.tif'))
+
+    def test_window(self):
+
+        # a window across the four tiles, with a cache that only keeps one tile
+        mosaic = open_tiled(self.folder, max_bytes=max(self.tile_nbytes))
+        window = dict(y=slice(450, 560), x=slice(650, 760))
+        np.testing.assert_array_equal(mosaic.isel(window).values, self.ldd.isel(window).values)
+        np.testing.assert_array_equal(mosaic.isel(y=520, x=710).values, self.ldd.isel(y=520, x=710).values)
+        self.assertEqual(mosaic.sel(y=43, x=-7, method='nearest').item(), self.ldd.sel(y=43, x=-7, method='nearest').item())
+        cache = mosaic.variable._data.array._cache
+        self.assertEqual(len(cache), 1)
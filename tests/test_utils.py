@@ -0,0 +1,131 @@
+import unittest
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyflwdir
+import shapely
+from affine import Affine
+from rasterio import features
+from lisfloodpreprocessing.utils import catchment_polygon, find_conflicts, simplify_catchments
+
+
+class TestCatchmentPolygon(unittest.TestCase):
+
+    transform = Affine(1 / 1200, 0, -7, 0, -1 / 1200, 44)
+
+    def test_bounding_box(self):
+
+        # a catchment with a hole in a corner of a large map
+        mask = np.zeros((500, 400), dtype=bool)
+        mask[300:360, 320:390] = True
+        mask[320:330, 340:350] = False
+        polygon = catchment_polygon(mask, self.transform, crs='EPSG:4326')
+
+        # the same as vectorizing the complete map
+        shapes = features.shapes(mask.astype(np.uint8), mask=mask, transform=self.transform, connectivity=8)
+        reference = shapely.union_all([shapely.geometry.shape(geom) for geom, _ in shapes])
+        self.assertEqual(len(polygon), 1)
+        self.assertTrue(polygon.geometry.iloc[0].equals(reference))
+        self.assertAlmostEqual(polygon.geometry.iloc[0].area, mask.sum() / 1200**2, places=12)
+        self.assertEqual(polygon['catchment'].dtype, bool)
+
+    def test_values(self):
+
+        # values out of the range of uint8 keep their data type
+        data = np.zeros((50, 50), dtype=np.int32)
+        data[10:20, 10:20] = 1000
+        data[10:20, 20:30] = 1
+        polygons = catchment_polygon(data, self.transform, crs='EPSG:4326', name='ID')
+        self.assertEqual(sorted(polygons['ID']), [1, 1000])
+        self.assertEqual(polygons['ID'].dtype, np.int32)
+
+        with self.assertRaises(ValueError):
+            catchment_polygon(np.zeros((5, 5), dtype=bool), self.transform, crs='EPSG:4326')
+
+
+class TestSimplifyCatchments(unittest.TestCase):
+
+    def test_coverage(self):
+
+        # two neighbouring catchments with jagged boundaries and the catchment that contains both
+        transform = Affine(1 / 1200, 0, -7, 0, -1 / 1200, 44)
+        rows, cols = np.mgrid[:200, :200]
+        disc = (rows - 100)**2 + (cols - 100)**2 < 80**2
+        left = disc & (cols + 10 * np.sin(rows / 5) < 100)
+        masks = {1: left, 2: disc & ~left, 3: disc}
+        polygons = pd.concat([
+            catchment_polygon(mask, transform, crs='EPSG:4326', name='ID').assign(ID=ID)
+            for ID, mask in masks.items()
+        ]).set_index('ID')
+
+        simplified = simplify_catchments(polygons, tolerance=2 / 1200)
+        geoms = simplified.geometry
+
+        self.assertEqual(simplified.index.tolist(), [1, 2, 3])
+        self.assertTrue(geoms.is_valid.all())
+        self.assertLess(shapely.get_num_coordinates(geoms.values).sum(), shapely.get_num_coordinates(polygons.geometry.values).sum())
+        # no overlaps between neighbours and no gaps with the catchment that contains them
+        self.assertAlmostEqual(geoms.loc[1].intersection(geoms.loc[2]).area, 0, places=12)
+        self.assertAlmostEqual(geoms.loc[1].union(geoms.loc[2]).symmetric_difference(geoms.loc[3]).area, 0, places=12)
+
+
+class TestFindConflicts(unittest.TestCase):
+
+    transform = Affine(1 / 60, 0, -7, 0, -1 / 60, 44)
+
+    def setUp(self):
+
+        # a river that flows east along the central row, fed by the rows above and below
+        ldd = np.full((5, 7), 2, dtype=np.uint8)
+        ldd[2] = 6
+        ldd[2, -1] = 5
+        ldd[3:] = 8
+        self.fdir = pyflwdir.from_array(ldd, ftype='ldd', transform=self.transform, latlon=True)
+
+        # A and B in the same pixel; C and D in consecutive pixels of the river; E and F
+        # in neighbouring pixels of different tributaries; G with a large area error
+        pixels = {'A': (2, 1), 'B': (2, 1), 'C': (2, 3), 'D': (2, 4), 'E': (0, 0), 'F': (0, 1), 'G': (4, 6)}
+        rows, cols = np.array(list(pixels.values())).T
+        lon, lat = self.transform * (cols + .5, rows + .5)
+        self.points = gpd.GeoDataFrame(
+            {'lat_1min': lat, 'lon_1min': lon, 'area': 100., 'area_1min': [100.] * 6 + [200.]},
+            geometry=gpd.points_from_xy(lon, lat),
+            index=pd.Index(list(pixels), name='ID'),
+            crs='EPSG:4326'
+        )
+
+    def conflicts(self, **kwargs):
+
+        conflicts = find_conflicts(self.points.copy(), '1min', pct_error=10, **kwargs)
+        return conflicts['conflict'].sort_index().to_dict()
+
+    def test_tolerance(self):
+
+        # only points in the same pixel overlap
+        self.assertEqual(
+            self.conflicts(),
+            {'A': 'points overlap', 'B': 'points overlap', 'G': 'large area error'}
+        )
+
+        # points in neighbouring pixels are nearby
+        self.assertEqual(
+            self.conflicts(tolerance=1),
+            {
+                'A': 'points overlap', 'B': 'points overlap',
+                'C': 'points nearby', 'D': 'points nearby',
+                'E': 'points nearby', 'F': 'points nearby',
+                'G': 'large area error'
+            }
+        )
+
+    def test_flowpath(self):
+
+        # nearby points in different tributaries are not a conflict
+        self.assertEqual(
+            self.conflicts(tolerance=1, fdir=self.fdir),
+            {
+                'A': 'points overlap', 'B': 'points overlap',
+                'C': 'points nearby', 'D': 'points nearby',
+                'G': 'large area error'
+            }
+        )